@@ -0,0 +1,241 @@
+"""
+Benchmarks every stage of the pipeline separately and writes the results as JSON,
+so runs can be compared between commits.
+- Stages: load (raw parse and cached), featurize, train, evaluate, stream (no sleeping) and midi.
+- Reports wall time, throughput (windows/s, samples/s), peak memory, and
+    p50/p95/p99 per-window latency for the stream stage.
+- The dataset can be scaled up by tiling the Bonn segments (e.g. 10x, 100x) to see how each stage grows.
+    The midi stage always renders one track per set, so it is marked "scaled": false.
+- The feature store is bypassed so every run measures the actual computation, and
+    nothing is written over the real model or MIDI files.
+"""
+
+import contextlib
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+import numpy as np
+
+from windows import window_view
+
+from variables import BENCH_OUTPUT_PATH
+
+
+def tile_segments(segments, factor):
+    """
+    Repeat the segments factor times (signals are shared, ids get a -<copy number> suffix)
+    """
+    if factor == 1:
+        return list(segments)
+    return [
+        {**seg, "segment_id": f"{seg['segment_id']}-{k}"}
+        for k in range(factor)
+        for seg in segments
+    ]
+
+
+def count_windows(segments):
+    return sum(len(window_view(s["signal"])) for s in segments)
+
+
+def count_samples(segments):
+    return sum(len(s["signal"]) for s in segments)
+
+
+def _rss():
+    """
+    Current resident memory in bytes (Linux only, None elsewhere)
+    """
+    try:
+        with open("/proc/self/statm", "rb") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return None
+
+
+class PeakMemory:
+    """
+    Samples resident memory from a background thread and keeps the peak above the starting level.
+    (tracemalloc would also work but slows the timed code down several times over.)
+    """
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+
+    def __enter__(self):
+        self._base = _rss()
+        if self._base is not None:
+            self._thread = threading.Thread(target=self._sample, daemon=True)
+            self._thread.start()
+        return self
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, _rss() - self._base)
+
+    def __exit__(self, *exc):
+        if self._base is not None:
+            self._stop.set()
+            self._thread.join()
+            self.peak = max(self.peak, _rss() - self._base)
+
+
+def measure(fn, *args, **kwargs):
+    """
+    Run fn once with its output hidden. Returns (result, seconds, peak extra memory in bytes)
+    """
+    with PeakMemory() as memory, contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        result = fn(*args, **kwargs)
+        elapsed = time.perf_counter() - start
+    return result, elapsed, memory.peak
+
+
+def stage_result(seconds, peak, windows=None, samples=None, **extra):
+    """
+    One stage's numbers as a dict
+    """
+    result = {"seconds": seconds, "peak_mb": peak / 1024 ** 2}
+    if windows is not None:
+        result["windows"] = windows
+        result["windows_per_s"] = windows / seconds if seconds else None
+    if samples is not None:
+        result["samples"] = samples
+        result["samples_per_s"] = samples / seconds if seconds else None
+    result.update(extra)
+    return result
+
+
+def latency_percentiles(latencies):
+    lat = np.array(latencies) * 1000
+    return {
+        "p50_ms": float(np.percentile(lat, 50)),
+        "p95_ms": float(np.percentile(lat, 95)),
+        "p99_ms": float(np.percentile(lat, 99)),
+        "max_ms": float(lat.max()),
+    }
+
+
+def load_cached(factor):
+    """
+    Load the dataset from the cache, then read every sample of it tiled factor times
+    (so the cached load grows with the scale like the other stages). Returns (train, test) untiled
+    """
+    from loader import loader, batched
+
+    train_segs, test_segs = loader()
+    for batch in batched(tile_segments(train_segs + test_segs, factor)):
+        for seg in batch:
+            np.asarray(seg["signal"], dtype=np.float64).sum()
+    return train_segs, test_segs
+
+
+def bench_scale(factor, stream_segments=20):
+    """
+    Benchmark every stage with the dataset tiled factor times
+    """
+    from loader import load_segments, segment_files
+    from classifier import window_features, train, evaluate
+    from streamer import stream_segment
+    from midi import midi
+
+    results = {}
+
+    files = [fp for fp, _, _ in segment_files()] * factor
+    signals, seconds, peak = measure(load_segments, files)
+    results["load_parse"] = stage_result(seconds, peak, samples=sum(len(s) for s in signals), files=len(files))
+    del signals
+
+    (train_segs, test_segs), seconds, peak = measure(load_cached, factor)
+    results["load_cached"] = stage_result(seconds, peak, samples=count_samples(train_segs + test_segs) * factor)
+
+    train_segs = tile_segments(train_segs, factor)
+    test_segs = tile_segments(test_segs, factor)
+    all_segs = train_segs + test_segs
+
+    # Import scipy.signal before timing, or only the first scale would pay for it
+    window_features(all_segs[:1], store=False)
+    _, seconds, peak = measure(window_features, all_segs, store=False)
+    results["featurize"] = stage_result(seconds, peak, windows=count_windows(all_segs),
+                                        samples=count_samples(all_segs))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        model, seconds, peak = measure(train, train_segs, model_path=Path(tmp) / "model.pkl",
+                                       export_path=Path(tmp) / "model.npz", store=False)
+        results["train"] = stage_result(seconds, peak, windows=count_windows(train_segs),
+                                        samples=count_samples(train_segs))
+
+        _, seconds, peak = measure(evaluate, model, test_segs, store=False)
+        results["evaluate"] = stage_result(seconds, peak, windows=count_windows(test_segs),
+                                           samples=count_samples(test_segs))
+
+        streamed = test_segs[:stream_segments]
+        latencies = []
+
+        def stream_all():
+            for seg in streamed:
+                latencies.extend(e["latency"] for e in stream_segment(seg, model, speed=None, verbose=False))
+
+        _, seconds, peak = measure(stream_all)
+        results["stream"] = stage_result(seconds, peak, windows=len(latencies),
+                                         samples=count_samples(streamed),
+                                         segments=len(streamed), **latency_percentiles(latencies))
+
+        _, seconds, peak = measure(midi, train_segs, out_dir=Path(tmp) / "midi", store=False)
+        # One track per set whatever the scale, so this stage doesn't grow with it
+        results["midi"] = stage_result(seconds, peak, tracks=len({s["set_name"] for s in train_segs}),
+                                       scaled=False)
+
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def bench(scales=(1,), output=BENCH_OUTPUT_PATH, stream_segments=20):
+    """
+    Run the benchmark at each scale, print a table and write the JSON report
+    """
+    report = {
+        "commit": git_commit(),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "scales": {},
+    }
+
+    for factor in scales:
+        print(f"\nBenchmarking at {factor}x the dataset...")
+        results = bench_scale(factor, stream_segments)
+        report["scales"][str(factor)] = results
+
+        print(f"  {'stage':12s} {'seconds':>9s} {'windows/s':>11s} {'samples/s':>12s} {'peak MB':>9s}")
+        for stage, r in results.items():
+            wps = f"{r['windows_per_s']:.0f}" if r.get("windows_per_s") else "-"
+            sps = f"{r['samples_per_s']:.0f}" if r.get("samples_per_s") else "-"
+            print(f"  {stage:12s} {r['seconds']:9.3f} {wps:>11s} {sps:>12s} {r['peak_mb']:9.1f}"
+                  f"{'  (unscaled)' if r.get('scaled') is False else ''}")
+        s = results["stream"]
+        print(f"  stream latency per window: p50={s['p50_ms']:.2f}ms p95={s['p95_ms']:.2f}ms "
+              f"p99={s['p99_ms']:.2f}ms")
+
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nBenchmark results written to {output}")
+    return report
@@ -2,52 +2,68 @@
 Trains a simple Random Forest classifier.
 - Extracts features from windows of training segments. 
 - Scales features and trains a Random Forest.
-- Saves the trained model for later use.
+- Saves the trained model for later use, and exports it as flat NumPy arrays for fast loading.
 - Provides a function to load the model from disk.
+- Every model classifier() uses is also kept in the versioned model registry (see registry.py),
+    with its feature config, training data hash and metrics.
 """
 
 from pathlib import Path
 import pickle
-import numpy as np
 from sklearn.ensemble import RandomForestClassifier
 from sklearn.preprocessing import StandardScaler
 from sklearn.pipeline import Pipeline
 from sklearn.metrics import confusion_matrix
 
-from features import features
-from windows import windows
+from feature_store import window_matrix
+from forest import export_model
 
-from variables import MODEL_PATH
+from variables import MODEL_PATH, EXPORT_PATH
 
-def window_features(segments):
+def window_features(segments, store=None):
     """
     Extract features from every window across a list of segments. This is just for training
+    Features come from the feature store, so only segments it hasn't seen are computed.
     """
-    x, y = [], []
-    for segment in segments:
-        for window, label in windows(segment):
-            x.append(features(window))
-            y.append(label)
-    return np.array(x), np.array(y)
+    matrix = window_matrix(segments, store=store)
+    return matrix["X"], matrix["y"]
 
 
-def train(train_segs):
+def build_pipeline(n_jobs=-1, n_estimators=100, random_state=None):
     """
-    Train a Random Forest classifier on the training segments. Saves and returns the model
+    The (untrained) scaler + Random Forest pipeline
     """
-    print("Training classifier...")
-    x_train, y_train = window_features(train_segs)
-
-    pipeline = Pipeline([
+    return Pipeline([
         ("scaler", StandardScaler()),
-        ("clf",    RandomForestClassifier(n_estimators=100, n_jobs=-1)),
+        ("clf",    RandomForestClassifier(n_estimators=n_estimators, n_jobs=n_jobs, random_state=random_state)),
     ])
 
-    pipeline.fit(x_train, y_train)
 
-    with open(MODEL_PATH, "wb") as f:
+def save_model(pipeline, model_path=MODEL_PATH, export_path=EXPORT_PATH):
+    """
+    Pickle the pipeline and export it as flat arrays
+    """
+    with open(model_path, "wb") as f:
         pickle.dump(pipeline, f)
-    print(f"Classifier model saved to {MODEL_PATH}")
+    print(f"Classifier model saved to {model_path}")
+    export_model(pipeline, export_path)
+
+
+def train(train_segs, model_path=MODEL_PATH, export_path=EXPORT_PATH, store=None, out_of_core=False):
+    """
+    Train a Random Forest classifier on the training segments. Saves and returns the model
+    out_of_core=True trains per shard without building the whole feature matrix (see sharded.py)
+    """
+    print("Training classifier...")
+    if out_of_core:
+        from sharded import train_sharded
+        pipeline = train_sharded(train_segs, store=store)
+    else:
+        x_train, y_train = window_features(train_segs, store)
+        pipeline = build_pipeline()
+        pipeline.fit(x_train, y_train)
+
+    save_model(pipeline, model_path, export_path)
     return pipeline
 
 
@@ -59,13 +75,15 @@ def load_model():
         return pickle.load(f)
 
 
-def evaluate(model, test_segs):
+def evaluate(model, test_segs, store=None):
     """
-    Evaluate the model on the test segments and report a confusion matrix
-    Evaluation is at window level so might be optimistic!!
+    Evaluate the model on the test segments and report a confusion matrix.
+    Window level evaluation might be optimistic, so segment and alert level metrics are reported too
+    (see evaluation.py)
     """
+    from evaluation import evaluate_model, print_report
 
-    x_test, y_test = window_features(test_segs)
+    x_test, y_test = window_features(test_segs, store)
 
     y_pred = model.predict(x_test)
 
@@ -78,17 +96,29 @@ def evaluate(model, test_segs):
     print(f"  False Negatives (missed seizure)       : {fn}")
     print(f"  True Positives  (correct seizure)      : {tp}")
 
+    metrics = evaluate_model(model, test_segs, store)
+    print_report(metrics)
+    return metrics
+
 
-def classifier(train_segs, test_segs):
+def classifier(train_segs, test_segs, out_of_core=False):
     """
     Loads the model if it already exists. If not, trains a new one
     """
+    from registry import register_model, model_hash, export_hash
+
     if Path(MODEL_PATH).exists():
         print(f"Loading existing model from {MODEL_PATH}...")
         model = load_model()
     else:
-        model = train(train_segs)
+        model = train(train_segs, out_of_core=out_of_core)
+
+    # The export (what load_forest serves) has to be the model that was loaded, not an older one
+    digest = model_hash(model)
+    if not Path(EXPORT_PATH).exists() or export_hash(EXPORT_PATH) != digest:
+        export_model(model)
 
-    evaluate(model, test_segs)
+    metrics = evaluate(model, test_segs)
+    register_model(model, train_segs, metrics, digest=digest)
 
     return model
@@ -0,0 +1,267 @@
+"""
+Evaluates the detector at three levels, and runs cross-validation.
+- Window level: confusion matrix of every window's prediction.
+- Segment level: a segment is called a seizure if its mean P(seizure) is at least PROB_THRESHOLD.
+- Event level: what the alerting actually does, using the same alert logic as the detector (see replay.py).
+    Every Bonn S segment is ictal from its first sample, so detection latency is the time to the first alert.
+    Sensitivity is the proportion of seizure segments with at least one alert, and
+    false alarms per hour counts alerts raised during non-seizure segments.
+- cross_validate() runs k-fold CV with every window of a segment kept in the same fold, stratified by set
+    (Z/O/N/F/S). Windows are featurized once (through the feature store) and handed to a process pool
+    that trains and scores one fold per task.
+"""
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from feature_store import many_segment_features
+from inference import fast_scorer
+from replay import alert_windows, window_end_times
+
+from variables import (SAMPLING_RATE, WINDOW_SIZE, STEP_SIZE, PROB_THRESHOLD, ALERT_THRESHOLD, CV_FOLDS, CV_WORKERS)
+
+CV_RANDOM_STATE = 2
+
+
+def _ratio(num, den):
+    return num / den if den else None
+
+
+def binary_metrics(y_true, y_pred):
+    """
+    Confusion matrix counts plus sensitivity, specificity, precision and accuracy
+    """
+    y_true = np.asarray(y_true, dtype=bool)
+    y_pred = np.asarray(y_pred, dtype=bool)
+    tp = int(np.sum(y_true & y_pred))
+    tn = int(np.sum(~y_true & ~y_pred))
+    fp = int(np.sum(~y_true & y_pred))
+    fn = int(np.sum(y_true & ~y_pred))
+    return {
+        "tn": tn, "fp": fp, "fn": fn, "tp": tp,
+        "sensitivity": _ratio(tp, tp + fn),
+        "specificity": _ratio(tn, tn + fp),
+        "precision": _ratio(tp, tp + fp),
+        "accuracy": _ratio(tp + tn, len(y_true)),
+    }
+
+
+def score_recordings(probs, labels, n_samples, prob_threshold=PROB_THRESHOLD, alert_threshold=ALERT_THRESHOLD,
+                     first_windows=None, window_size=WINDOW_SIZE, step_size=STEP_SIZE):
+    """
+    Window, segment and event level metrics from each recording's per-window P(seizure).
+    probs is a list of arrays (one per recording), labels and n_samples are per recording.
+    first_windows is the window index each recording's probs start at, if not 0 (used for latency).
+    window_size/step_size are what the probs were computed with (used for latency).
+    """
+    labels = np.asarray(labels)
+    counts = [len(p) for p in probs]
+    window_probs = np.concatenate(probs) if probs else np.empty(0)
+    window = binary_metrics(np.repeat(labels, counts), window_probs >= prob_threshold)
+
+    mean_probs = np.array([p.mean() if len(p) else 0.0 for p in probs])
+    segment = binary_metrics(labels, mean_probs >= prob_threshold)
+
+    latencies = []
+    false_alarms = 0
+    background_s = 0.0
+    if first_windows is None:
+        first_windows = [0] * len(probs)
+    for p, label, n, first in zip(probs, labels, n_samples, first_windows):
+        alerts = alert_windows(p >= prob_threshold, alert_threshold)
+        if label == 1:
+            if len(alerts):
+                latencies.append(window_end_times(first + len(p), window_size, step_size)[first + alerts[0]])
+        else:
+            false_alarms += len(alerts)
+            background_s += n / SAMPLING_RATE
+
+    n_seizure = int(np.sum(labels == 1))
+    event = {
+        "seizure_segments": n_seizure,
+        "detected": len(latencies),
+        "sensitivity": _ratio(len(latencies), n_seizure),
+        "latency_mean_s": float(np.mean(latencies)) if latencies else None,
+        "latency_median_s": float(np.median(latencies)) if latencies else None,
+        "latency_max_s": float(np.max(latencies)) if latencies else None,
+        "false_alarms": false_alarms,
+        "background_hours": background_s / 3600,
+        "false_alarms_per_hour": _ratio(false_alarms, background_s / 3600),
+    }
+    return {"window": window, "segment": segment, "event": event}
+
+
+def evaluate_model(model, segments, store=None):
+    """
+    All three levels of metrics for a trained model on a list of segments
+    """
+    feats = [f for f, _ in many_segment_features([s["signal"] for s in segments], store=store)]
+    counts = [len(f) for f in feats]
+    probs = fast_scorer(model).predict_proba(np.concatenate(feats))[:, 1]
+    return score_recordings(np.split(probs, np.cumsum(counts)[:-1]),
+                            [s["label"] for s in segments],
+                            [len(s["signal"]) for s in segments])
+
+
+def _fmt(value, spec=".3f"):
+    return "-" if value is None else format(value, spec)
+
+
+def print_report(metrics, alert_threshold=ALERT_THRESHOLD):
+    """
+    Print the segment and event level metrics
+    """
+    seg = metrics["segment"]
+    event = metrics["event"]
+    print("\nSegment level (mean P(seizure) per segment):")
+    print(f"  TN {seg['tn']}  FP {seg['fp']}  FN {seg['fn']}  TP {seg['tp']}  "
+          f"sensitivity {_fmt(seg['sensitivity'])}  specificity {_fmt(seg['specificity'])}")
+    print(f"Alert level (alert after {alert_threshold} consecutive windows):")
+    print(f"  detected {event['detected']}/{event['seizure_segments']} seizure segments "
+          f"(sensitivity {_fmt(event['sensitivity'])}), "
+          f"latency mean {_fmt(event['latency_mean_s'], '.2f')}s / max {_fmt(event['latency_max_s'], '.2f')}s")
+    print(f"  {event['false_alarms']} false alarms in {event['background_hours']:.2f}h of non-seizure EEG "
+          f"({_fmt(event['false_alarms_per_hour'], '.2f')} per hour)")
+
+
+# Shared with the CV worker processes once, instead of being sent with every fold
+_fold_data = {}
+
+
+def _init_fold_worker(data):
+    _fold_data.update(data)
+
+
+def _run_fold(fold):
+    """
+    Train on one fold's training segments and score its test segments
+    """
+    from classifier import build_pipeline
+
+    train_idx, test_idx = fold
+    X, y, row_segment = _fold_data["X"], _fold_data["y"], _fold_data["row_segment"]
+    counts, labels, n_samples = _fold_data["counts"], _fold_data["labels"], _fold_data["n_samples"]
+
+    model = build_pipeline(n_jobs=1)  # the folds are already spread across cores
+    train_rows = np.isin(row_segment, train_idx)
+    model.fit(X[train_rows], y[train_rows])
+
+    test_idx = np.sort(test_idx)  # so the rows below come out in segment order
+    probs = fast_scorer(model).predict_proba(X[np.isin(row_segment, test_idx)])[:, 1]
+    return score_recordings(np.split(probs, np.cumsum(counts[test_idx])[:-1]),
+                            labels[test_idx], n_samples[test_idx])
+
+
+def summarise_folds(folds):
+    """
+    Mean and standard deviation of the main metrics across folds
+    """
+    keys = {
+        "window_sensitivity": ("window", "sensitivity"),
+        "window_specificity": ("window", "specificity"),
+        "segment_accuracy": ("segment", "accuracy"),
+        "event_sensitivity": ("event", "sensitivity"),
+        "latency_mean_s": ("event", "latency_mean_s"),
+        "false_alarms_per_hour": ("event", "false_alarms_per_hour"),
+    }
+    summary = {}
+    for name, (level, key) in keys.items():
+        values = [f[level][key] for f in folds if f[level][key] is not None]
+        summary[name] = {
+            "mean": float(np.mean(values)) if values else None,
+            "std": float(np.std(values)) if values else None,
+        }
+    return summary
+
+
+def cross_validate(segments, n_folds=CV_FOLDS, workers=CV_WORKERS, store=None):
+    """
+    k-fold CV over segments, stratified by set. Returns {"folds": [...], "summary": {...}}
+    """
+    from sklearn.model_selection import StratifiedKFold
+
+    print(f"\nCross-validating over {len(segments)} segments ({n_folds} folds)...")
+    feats = [f for f, _ in many_segment_features([s["signal"] for s in segments], store=store)]
+    counts = np.array([len(f) for f in feats])
+    labels = np.array([s["label"] for s in segments])
+    data = {
+        "X": np.concatenate(feats),
+        "y": np.repeat(labels, counts),
+        "row_segment": np.repeat(np.arange(len(segments)), counts),
+        "counts": counts,
+        "labels": labels,
+        "n_samples": np.array([len(s["signal"]) for s in segments]),
+    }
+
+    # Splitting segments (not windows) keeps every window of a segment in the same fold
+    splitter = StratifiedKFold(n_splits=n_folds, shuffle=True, random_state=CV_RANDOM_STATE)
+    set_names = [s["set_name"] for s in segments]
+    folds = list(splitter.split(np.zeros(len(segments)), set_names))
+
+    workers = min(workers or os.cpu_count() or 1, n_folds)
+    if workers <= 1:
+        _init_fold_worker(data)
+        results = [_run_fold(fold) for fold in folds]
+    else:
+        with ProcessPoolExecutor(workers, initializer=_init_fold_worker, initargs=(data,)) as pool:
+            results = list(pool.map(_run_fold, folds))
+
+    for i, r in enumerate(results):
+        w, e = r["window"], r["event"]
+        print(f"  fold {i + 1}: window sens {_fmt(w['sensitivity'])} spec {_fmt(w['specificity'])} | "
+              f"alerts sens {_fmt(e['sensitivity'])} latency {_fmt(e['latency_mean_s'], '.2f')}s "
+              f"FA/h {_fmt(e['false_alarms_per_hour'], '.2f')}")
+
+    summary = summarise_folds(results)
+    print("Mean (std) across folds:")
+    for name, s in summary.items():
+        print(f"  {name:22s} {_fmt(s['mean'])} ({_fmt(s['std'])})")
+
+    return {"folds": results, "summary": summary}
+
+
+def feature_report(segments, names=None):
+    """
+    Cost and usefulness of every registered feature, to decide what the live path can drop.
+    - Cost: time per window of the feature itself, plus the intermediates it needs (shared ones
+        are listed, since dropping the feature only saves them if nothing else uses them),
+        and the bytes per window of its output.
+    - Value: impurity importance in a forest trained on all of the features at once.
+    """
+    from sklearn.ensemble import RandomForestClassifier
+    from feature_store import window_matrix
+    from features import REGISTRY, ALL_FEATURE_NAMES
+
+    names = list(names or ALL_FEATURE_NAMES)
+    REGISTRY.costs.clear()
+    matrix = window_matrix(segments, store=False, feature_names=names)  # store=False so every feature is computed
+    forest = RandomForestClassifier(n_estimators=100, n_jobs=-1, random_state=CV_RANDOM_STATE)
+    forest.fit(matrix["X"], matrix["y"])
+    importance = dict(zip(names, forest.feature_importances_))
+
+    def us_per_window(node):
+        cost = REGISTRY.costs[node]
+        return cost["seconds"] / cost["windows"] * 1e6
+
+    print(f"\nFeature costs over {len(matrix['X'])} windows:")
+    print(f"  {'feature':20s} {'us/window':>10s} {'bytes/window':>13s} {'importance':>11s}  needs")
+    rows = []
+    for name in names:
+        node = REGISTRY.columns[name][0]
+        deps = [d for d in REGISTRY.plan_nodes([node]) if d != node]
+        cost = REGISTRY.costs[node]
+        rows.append({
+            "feature": name,
+            "node": node,
+            "us_per_window": us_per_window(node),
+            "bytes_per_window": cost["bytes"] / cost["windows"],
+            "needs": {d: us_per_window(d) for d in deps},
+            "importance": float(importance[name]),
+        })
+        needs = ", ".join(f"{d} ({us_per_window(d):.1f}us)" for d in deps) or "-"
+        print(f"  {name:20s} {rows[-1]['us_per_window']:10.2f} {rows[-1]['bytes_per_window']:13.0f} "
+              f"{importance[name]:11.3f}  {needs}")
+    print("  (a node with several output columns, like band_powers or hjorth, is timed once for all of them)")
+    return rows
@@ -0,0 +1,332 @@
+"""
+On-disk store for per-window feature matrices, so features are only computed once
+for each (signal, feature configuration) pair.
+- Entries are keyed by a hash of the signal's samples plus everything the features depend on
+    (WINDOW_SIZE, STEP_SIZE, BANDS, SAMPLING_RATE, which features, FEATURE_DTYPE if not float64).
+- New entries are written together as a "pack": a directory of .npy columns (features,
+    window_index) for many signals, plus the keys and row ranges of each signal. Packs are written
+    atomically and never changed, and are memory-mapped when read. One file per signal would spend
+    more time opening files than computing the features.
+- Total size is capped at FEATURE_STORE_MAX_BYTES. The least recently used packs are evicted first.
+    A pack holds at most a quarter of that, so a big batch is split rather than evicted as soon as it is written.
+- Multi-resolution features (multires.py) are stored the same way, under their own config.
+- segment_features()/window_matrix() are what training, evaluation, MIDI and replay call.
+    They use the store if FEATURE_STORE_DIR is set and compute directly otherwise.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import uuid
+from pathlib import Path
+
+import numpy as np
+
+from features import batch_features, FEATURE_NAMES
+from loader import batched
+from windows import window_view
+
+from variables import (FEATURE_STORE_DIR, FEATURE_STORE_MAX_BYTES, WINDOW_SIZE, STEP_SIZE,
+                       BANDS, SAMPLING_RATE, MULTIRES_NPERSEG, MULTIRES_HOP, FEATURE_DTYPE)
+
+STORE_VERSION = 1
+
+
+def feature_config(window_size=WINDOW_SIZE, step_size=STEP_SIZE, resolutions=None, feature_names=None,
+                   dtype=FEATURE_DTYPE):
+    """
+    Everything a feature matrix depends on apart from the signal itself.
+    window_size=None means one feature vector for the whole signal (as midi uses).
+    resolutions is a list of window lengths for multi-resolution features (see multires.py).
+    feature_names picks features from the registry in features.py (default FEATURE_NAMES).
+    dtype is what the features are computed in. Only non-float64 dtypes go in the config, so
+    existing float64 entries stay valid (multi-resolution features are always float64).
+    """
+    config = {
+        "version": STORE_VERSION,
+        "window_size": window_size,
+        "step_size": step_size if window_size is not None else None,
+        "bands": {name: list(band) for name, band in BANDS.items()},
+        "sampling_rate": SAMPLING_RATE,
+        "features": list(feature_names or FEATURE_NAMES),
+    }
+    if resolutions is not None:
+        config["resolutions"] = list(resolutions)
+        config["nperseg"] = MULTIRES_NPERSEG
+        config["hop"] = MULTIRES_HOP
+        config["frame_offset"] = (window_size - MULTIRES_NPERSEG) % MULTIRES_HOP  # see multires.frame_offset
+    elif np.dtype(dtype) != np.float64:
+        config["dtype"] = np.dtype(dtype).name
+    return config
+
+
+def config_digest(config):
+    """
+    Short hash of a feature config
+    """
+    return hashlib.blake2b(json.dumps(config, sort_keys=True).encode(), digest_size=20).digest()
+
+
+def signal_key(signal, config):
+    """
+    Content hash of a signal and a feature config
+    """
+    signal = np.ascontiguousarray(signal)
+    h = hashlib.blake2b(config_digest(config), digest_size=20)
+    h.update(f"{signal.dtype.str}{signal.shape}".encode())
+    h.update(signal.data)
+    return h.hexdigest()
+
+
+def compute_features(signal, config):
+    """
+    Compute the (features, window_index) columns for a signal without the store
+    """
+    if config.get("resolutions"):
+        from multires import multires_features
+        return multires_features(signal, config["resolutions"], config["nperseg"], config["hop"],
+                                 config["window_size"], config["step_size"])
+    dtype = config.get("dtype", "float64")
+    if config["window_size"] is None:
+        return batch_features(signal, config["features"], dtype)[None, :], np.zeros(1, dtype=np.int64)
+    winds = window_view(signal, config["window_size"], config["step_size"])
+    if len(winds) == 0:
+        return np.empty((0, len(config["features"])), dtype=dtype), np.empty(0, dtype=np.int64)
+    return batch_features(winds, config["features"], dtype), np.arange(len(winds), dtype=np.int64)
+
+
+def compute_features_many(signals, config):
+    """
+    compute_features for a list of signals. Whole-signal features (window_size=None) are computed
+    in one batch_features call per signal length instead of one call per signal.
+    """
+    if config["window_size"] is not None or config.get("resolutions"):
+        return [compute_features(signal, config) for signal in signals]
+
+    results = [None] * len(signals)
+    by_length = {}
+    for i, signal in enumerate(signals):
+        by_length.setdefault(len(signal), []).append(i)
+    for idx in by_length.values():
+        feats = batch_features(np.stack([np.asarray(signals[i]) for i in idx]), config["features"],
+                               config.get("dtype", "float64"))
+        for i, row in zip(idx, feats):
+            results[i] = (row[None, :], np.zeros(1, dtype=np.int64))
+    return results
+
+
+class FeatureStore:
+    """
+    Size-bounded, content-addressed store of feature matrices
+    """
+
+    COLUMNS = ("features", "window_index")
+
+    def __init__(self, root=FEATURE_STORE_DIR, max_bytes=FEATURE_STORE_MAX_BYTES):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+
+        self._index = {}   # key -> (pack name, start row, end row)
+        self._sizes = {}   # pack name -> bytes on disk
+        self._open = {}    # pack name -> memory-mapped columns
+        for pack in sorted(self._packs(), key=lambda p: p.stat().st_mtime):
+            self._add_to_index(pack)
+
+    def _packs(self):
+        return [p for p in self.root.iterdir() if p.is_dir() and not p.name.startswith(".")]
+
+    def _add_to_index(self, pack):
+        keys = np.load(pack / "keys.npy")
+        offsets = np.load(pack / "offsets.npy")
+        for key, start, end in zip(keys.tolist(), offsets[:-1].tolist(), offsets[1:].tolist()):
+            self._index[key] = (pack.name, start, end)
+        self._sizes[pack.name] = sum(f.stat().st_size for f in pack.iterdir())
+
+    @property
+    def size(self):
+        return sum(self._sizes.values())
+
+    def _columns(self, name):
+        if name not in self._open:
+            self._open[name] = {
+                col: np.load(self.root / name / f"{col}.npy", mmap_mode="r") for col in self.COLUMNS
+            }
+        return self._open[name]
+
+    def get_many(self, keys):
+        """
+        Stored columns for each key as a dict of arrays (None where a key isn't stored)
+        """
+        results = []
+        used = set()
+        for key in keys:
+            found = self._index.get(key)
+            if found is None:
+                results.append(None)
+                continue
+            name, start, end = found
+            try:
+                columns = self._columns(name)
+            except FileNotFoundError:
+                # Evicted by another process
+                self._forget(name)
+                results.append(None)
+                continue
+            results.append({col: np.array(columns[col][start:end]) for col in self.COLUMNS})
+            used.add(name)
+
+        for name in used:
+            try:
+                os.utime(self.root / name)  # mark as recently used
+            except FileNotFoundError:
+                pass
+        return results
+
+    def put_many(self, items):
+        """
+        Store a list of (key, columns) as new packs of at most a quarter of max_bytes each, evicting as
+        it goes. Anything too big for a pack isn't stored, since it would only push everything else out.
+        """
+        items = [(key, cols) for key, cols in items if key not in self._index]
+        limit = self.max_bytes // 4
+        pack, pack_bytes = [], 0
+        for key, cols in items:
+            nbytes = sum(np.asarray(cols[col]).nbytes for col in self.COLUMNS)
+            if nbytes > limit:
+                continue
+            if pack and pack_bytes + nbytes > limit:
+                self._write_pack(pack)
+                pack, pack_bytes = [], 0
+            pack.append((key, cols))
+            pack_bytes += nbytes
+        if pack:
+            self._write_pack(pack)
+
+    def _write_pack(self, items):
+        lengths = [len(cols["features"]) for _, cols in items]
+
+        tmp = self.root / f".tmp-{uuid.uuid4().hex}"
+        tmp.mkdir()
+        np.save(tmp / "keys.npy", np.array([key for key, _ in items]))
+        np.save(tmp / "offsets.npy", np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64))
+        for col in self.COLUMNS:
+            np.save(tmp / f"{col}.npy", np.concatenate([cols[col] for _, cols in items]))
+        pack = self.root / uuid.uuid4().hex
+        os.replace(tmp, pack)
+
+        self._add_to_index(pack)
+        self.evict()
+
+    def _forget(self, name):
+        self._open.pop(name, None)
+        self._sizes.pop(name, None)
+        self._index = {k: v for k, v in self._index.items() if v[0] != name}
+
+    def evict(self):
+        """
+        Delete least recently used packs until the store fits in max_bytes
+        """
+        if self.size <= self.max_bytes:
+            return
+        packs = sorted(self._packs(), key=lambda p: p.stat().st_mtime)
+        for pack in packs:
+            if self.size <= self.max_bytes:
+                break
+            self._forget(pack.name)
+            shutil.rmtree(pack, ignore_errors=True)
+
+    def features_many(self, signals, config):
+        """
+        (features, window_index) for each signal, only computing the ones not already stored
+        """
+        keys = [signal_key(signal, config) for signal in signals]
+        results = self.get_many(keys)
+
+        missing = [i for i, r in enumerate(results) if r is None]
+        new = []
+        computed = compute_features_many([signals[i] for i in missing], config)
+        for i, (feats, window_index) in zip(missing, computed):
+            results[i] = {"features": feats, "window_index": window_index}
+            new.append((keys[i], results[i]))
+        self.hits += len(keys) - len(new)
+        self.misses += len(new)
+        if new:
+            self.put_many(new)
+
+        return [(r["features"], r["window_index"]) for r in results]
+
+
+_default_store = None
+
+
+def default_store():
+    """
+    The shared store at FEATURE_STORE_DIR, or None if the store is turned off
+    """
+    global _default_store
+    if FEATURE_STORE_DIR is None:
+        return None
+    if _default_store is None:
+        _default_store = FeatureStore()
+    return _default_store
+
+
+def segment_features(signal, window_size=WINDOW_SIZE, step_size=STEP_SIZE, store=None, feature_names=None):
+    """
+    Window features for one signal, through the feature store if there is one.
+    Returns (features, window_index).
+    """
+    return many_segment_features([signal], window_size, step_size, store, feature_names=feature_names)[0]
+
+
+def many_segment_features(signals, window_size=WINDOW_SIZE, step_size=STEP_SIZE, store=None,
+                          resolutions=None, feature_names=None):
+    """
+    segment_features for a list of signals, with one store lookup for all of them
+    """
+    config = feature_config(window_size, step_size, resolutions, feature_names)
+    if store is None:
+        store = default_store()
+    if not store:  # store=False skips the store, e.g. for benchmarking
+        return compute_features_many(signals, config)
+    return store.features_many(signals, config)
+
+
+def window_matrix(segments, window_size=WINDOW_SIZE, step_size=STEP_SIZE, store=None, resolutions=None,
+                  feature_names=None):
+    """
+    Feature matrix for every window across segments, as a dict of columns:
+    X (n_windows, one column per feature, or 7 per resolution), y, segment_id and window_index
+    Segments (a list or a SegmentIndex) are read LOAD_BATCH_SEGMENTS at a time, so only
+    one batch of signals is loaded at once.
+    """
+    feats, window_index, labels, segment_ids = [], [], [], []
+    for batch in batched(segments):
+        for (f, w), seg in zip(many_segment_features([s["signal"] for s in batch], window_size,
+                                                     step_size, store, resolutions, feature_names), batch):
+            feats.append(f)
+            window_index.append(w)
+            labels.append(seg["label"])
+            segment_ids.append(seg["segment_id"])
+
+    if not feats:
+        n_feats = (len(FEATURE_NAMES) * len(resolutions) if resolutions
+                   else len(feature_names or FEATURE_NAMES))
+        return {
+            "X": np.empty((0, n_feats)),
+            "y": np.empty(0, dtype=int),
+            "segment_id": np.empty(0, dtype=str),
+            "window_index": np.empty(0, dtype=np.int64),
+        }
+
+    counts = [len(f) for f in feats]
+    return {
+        "X": np.concatenate(feats),
+        "y": np.repeat(labels, counts),
+        "segment_id": np.repeat(segment_ids, counts),
+        "window_index": np.concatenate(window_index),
+    }
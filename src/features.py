@@ -5,13 +5,22 @@ Extracts features from EEG windows
     - Uses the defined frequency bands to get normalised (relative) band powers
     - Calculates RMS amplitude
     - Returns a total of 7 features: 5 normalised band powers, spectral entropy, and RMS amplitude.
+- Has a batched version that does the same thing for a whole 2D array of windows at once.
+- The batched features come from a registry (REGISTRY), where each feature declares what it needs
+    (e.g. the shared Welch PSD). Besides the 7 default features (FEATURE_NAMES) it has line length,
+    Hjorth parameters and zero-crossing rate (ALL_FEATURE_NAMES), and it records what each one costs.
+- batch_features computes in FEATURE_DTYPE. float32 halves the memory and bandwidth of windows,
+    PSDs and feature matrices; RMS is still summed in float64 (see --part precision for how far
+    float32 features move from float64).
+- scipy is imported on first use, so just importing this module (e.g. for FEATURE_NAMES) is cheap.
 """
 
+import time
+from functools import lru_cache
+
 import numpy as np
-from scipy.signal import welch
-from scipy.stats import entropy as scipy_entropy
 
-from variables import SAMPLING_RATE, BANDS
+from variables import SAMPLING_RATE, BANDS, FEATURE_DTYPE
 
 BAND_NAMES = list(BANDS.keys())
 FEATURE_NAMES = [f"{b}_power_norm" for b in BAND_NAMES] + ["entropy", "rms"]  # 7 features
@@ -22,6 +31,11 @@ def features(window: np.ndarray) -> np.ndarray:
     Extract a feature vector from a single EEG window.
     Features are: normalised band powers (delta, theta, alpha, beta, gamma), spectral entropy, RMS amplitude.
     """
+    from scipy.signal import welch
+    from scipy.special import entr
+
+    window = np.asarray(window, dtype=np.float64)  # e.g. int16 samples from the cache
+
     # Use Welch's method to estimate the power spectral density
     freqs, psd = welch(window, fs=SAMPLING_RATE, nperseg=min(len(window), 128))
 
@@ -39,10 +53,258 @@ def features(window: np.ndarray) -> np.ndarray:
     powers_norm = powers / (total_power + 1e-12)
 
     p = psd / (psd.sum() + 1e-12)
-    raw_entropy = float(scipy_entropy(p))
+    raw_entropy = float(np.sum(entr(p / np.sum(p))))  # same as scipy.stats.entropy(p)
     entropy = raw_entropy / np.log(len(p)) if len(p) > 1 else 0.0
 
     # root mean square amplitude
     rms = float(np.sqrt(np.mean(window ** 2)))
 
     return np.array([*powers_norm, entropy, rms], dtype=np.float64)
+
+
+@lru_cache(maxsize=None)
+def band_slices(nperseg):
+    """
+    Work out which PSD bins belong to each band for a given Welch segment length.
+    Welch frequencies are sorted, so each band is just a contiguous slice of bins.
+    Only done once per nperseg.
+    """
+    freqs = np.fft.rfftfreq(nperseg, 1.0 / SAMPLING_RATE)
+    slices = []
+    for lo, hi in BANDS.values():
+        idx = np.flatnonzero((freqs >= lo) & (freqs <= hi))
+        slices.append(slice(idx[0], idx[-1] + 1) if len(idx) else slice(0, 0))
+    return tuple(slices)
+
+
+@lru_cache(maxsize=None)
+def hann_taper(nperseg):
+    """
+    Periodic Hann window and the density scaling welch() uses with it (without importing scipy.signal)
+    """
+    taper = 0.5 - 0.5 * np.cos(2 * np.pi * np.arange(nperseg) / nperseg)
+    return taper, 1.0 / (SAMPLING_RATE * np.sum(taper * taper))
+
+
+def periodograms(segs):
+    """
+    One-sided PSD of each row of a 2D array of Welch segments (shape (n, nperseg)):
+    mean removed, Hann tapered, density scaled, like each segment inside welch().
+    Averaging rows gives the Welch PSD.
+    """
+    nperseg = segs.shape[-1]
+    taper, scale = hann_taper(nperseg)
+    segs = (segs - segs.mean(axis=-1, keepdims=True)) * taper
+    spec = np.fft.rfft(segs, axis=-1)
+    psd = (spec.real ** 2 + spec.imag ** 2) * scale
+    if nperseg % 2:
+        psd[..., 1:] *= 2
+    else:
+        psd[..., 1:-1] *= 2
+    return psd
+
+
+def band_powers_norm(freqs, psd, nperseg):
+    """
+    Normalised band powers from a 2D array of Welch PSDs (shape (n_windows, n_bins)), shape (n_windows, 5)
+    """
+    df = freqs[1] - freqs[0]
+    powers = np.stack([np.sum(psd[:, s], axis=-1) * df for s in band_slices(nperseg)], axis=-1)
+    total_power = np.sum(psd, axis=-1) * df
+    return powers / (total_power[:, None] + 1e-12)
+
+
+def spectral_entropy(psd):
+    """
+    Normalised spectral entropy of each row of a 2D array of PSDs
+    """
+    from scipy.special import entr
+
+    p = psd / (np.sum(psd, axis=-1)[:, None] + 1e-12)
+    n_bins = p.shape[-1]
+    if n_bins <= 1:
+        return np.zeros(len(psd))
+    # Same sum as scipy.stats.entropy, without its per-call argument handling
+    pk = p / np.sum(p, axis=-1, keepdims=True)
+    return np.sum(entr(pk), axis=-1) / np.log(n_bins)
+
+
+def spectral_features(freqs, psd, nperseg):
+    """
+    Band powers and spectral entropy from a 2D array of Welch PSDs (shape (n_windows, n_bins)).
+    Returns an (n_windows, 6) array: 5 normalised band powers then spectral entropy.
+    """
+    return np.column_stack([band_powers_norm(freqs, psd, nperseg), spectral_entropy(psd)])
+
+
+class FeatureRegistry:
+    """
+    Features, and the intermediates they share, each registered with the nodes it depends on.
+    - compute() runs only the nodes the requested features need, each once, in dependency order,
+        so e.g. every spectral feature shares one Welch PSD.
+    - Every run records each node's time and the size of its output in costs, so the cost of a
+        feature (and of anything it pulls in) can be compared with how useful it is.
+    "windows" is the input: the 2D array of windows.
+    """
+
+    def __init__(self):
+        self.nodes = {}    # node name -> (function, dependency names)
+        self.columns = {}  # feature name -> (node name, column of the node's output or None)
+        self.costs = {}    # node name -> {"windows", "seconds", "bytes"}
+
+    def register(self, name, deps=("windows",), columns=None):
+        """
+        Decorator for a node function taking its dependencies' outputs in order.
+        columns names the features in each column of its output (one name for a 1D output,
+        None for an intermediate that isn't a feature itself).
+        """
+        def decorator(fn):
+            self.nodes[name] = (fn, tuple(deps))
+            if isinstance(columns, str):
+                self.columns[columns] = (name, None)
+            elif columns is not None:
+                for i, column in enumerate(columns):
+                    self.columns[column] = (name, i)
+            return fn
+        return decorator
+
+    def feature_names(self):
+        return list(self.columns)
+
+    def plan(self, names):
+        """
+        Nodes needed for the given features, with every node after its dependencies
+        """
+        for name in names:
+            if name not in self.columns:
+                raise KeyError(f"Unknown feature {name!r}")
+        return self.plan_nodes([self.columns[name][0] for name in names])
+
+    def plan_nodes(self, nodes):
+        """
+        The given nodes and everything they depend on, in dependency order
+        """
+        order = []
+        visiting = set()
+
+        def visit(node):
+            if node == "windows" or node in order:
+                return
+            if node in visiting:
+                raise ValueError(f"Feature dependency cycle at {node!r}")
+            if node not in self.nodes:
+                raise KeyError(f"Unknown feature node {node!r}")
+            visiting.add(node)
+            for dep in self.nodes[node][1]:
+                visit(dep)
+            visiting.discard(node)
+            order.append(node)
+
+        for node in nodes:
+            visit(node)
+        return order
+
+    def compute(self, windows, names):
+        """
+        (n_windows, len(names)) array of the named features
+        """
+        values = {"windows": windows}
+        for node in self.plan(names):
+            fn, deps = self.nodes[node]
+            start = time.perf_counter()
+            out = fn(*(values[d] for d in deps))
+            elapsed = time.perf_counter() - start
+
+            cost = self.costs.setdefault(node, {"windows": 0, "seconds": 0.0, "bytes": 0})
+            cost["windows"] += len(windows)
+            cost["seconds"] += elapsed
+            cost["bytes"] += sum(np.asarray(v).nbytes for v in (out if isinstance(out, tuple) else (out,)))
+            values[node] = out
+
+        cols = []
+        for name in names:
+            node, i = self.columns[name]
+            cols.append(values[node] if i is None else values[node][:, i])
+        return np.column_stack(cols).astype(windows.dtype, copy=False)
+
+
+REGISTRY = FeatureRegistry()
+
+
+@REGISTRY.register("psd")
+def _psd(windows):
+    from scipy.signal import welch
+
+    nperseg = min(windows.shape[-1], 128)
+    # One Welch call for every window (scipy works along the last axis)
+    freqs, psd = welch(windows, fs=SAMPLING_RATE, nperseg=nperseg, axis=-1)
+    return freqs, psd, nperseg
+
+
+@REGISTRY.register("band_powers", deps=("psd",), columns=[f"{b}_power_norm" for b in BAND_NAMES])
+def _band_powers(psd):
+    return band_powers_norm(*psd)
+
+
+@REGISTRY.register("entropy", deps=("psd",), columns="entropy")
+def _entropy(psd):
+    return spectral_entropy(psd[1])
+
+
+@REGISTRY.register("rms", columns="rms")
+def _rms(windows):
+    # Summed in float64 whatever the windows' dtype (the squares are exact in float32 for EEG sized samples)
+    return np.sqrt(np.mean(windows ** 2, axis=-1, dtype=np.float64))
+
+
+@REGISTRY.register("diff")
+def _diff(windows):
+    return np.diff(windows, axis=-1)
+
+
+@REGISTRY.register("diff2", deps=("diff",))
+def _diff2(diff):
+    return np.diff(diff, axis=-1)
+
+
+@REGISTRY.register("line_length", deps=("diff",), columns="line_length")
+def _line_length(diff):
+    # Mean absolute change between samples, so it doesn't depend on the window length
+    return np.mean(np.abs(diff), axis=-1)
+
+
+@REGISTRY.register("hjorth", deps=("windows", "diff", "diff2"),
+                   columns=["hjorth_activity", "hjorth_mobility", "hjorth_complexity"])
+def _hjorth(windows, diff, diff2):
+    var0 = np.var(windows, axis=-1)
+    var1 = np.var(diff, axis=-1)
+    var2 = np.var(diff2, axis=-1)
+    mobility = np.sqrt(var1 / (var0 + 1e-12))
+    complexity = np.sqrt(var2 / (var1 + 1e-12)) / (mobility + 1e-12)
+    return np.column_stack([var0, mobility, complexity])
+
+
+@REGISTRY.register("zero_crossing_rate", columns="zero_crossing_rate")
+def _zero_crossing_rate(windows):
+    # Crossings of the window's own mean, per sample pair
+    centred = windows - windows.mean(axis=-1, keepdims=True)
+    return np.mean(np.signbit(centred[:, 1:]) != np.signbit(centred[:, :-1]), axis=-1)
+
+
+ALL_FEATURE_NAMES = REGISTRY.feature_names()
+
+
+def batch_features(windows: np.ndarray, names=FEATURE_NAMES, dtype=None) -> np.ndarray:
+    """
+    Extract feature vectors for a 2D array of windows (shape (n_windows, window_size)).
+    A 1D array is treated as a single window (e.g. a whole segment).
+    Windows of any dtype (e.g. int16 from the cache) are computed in dtype (default FEATURE_DTYPE).
+    Returns an (n_windows, len(names)) array of that dtype. With the default names and float64 it is
+    identical row for row to calling features() on each window.
+    """
+    windows = np.asarray(windows, dtype=dtype or FEATURE_DTYPE)
+    single = windows.ndim == 1
+    windows = np.atleast_2d(windows)
+
+    feats = REGISTRY.compute(windows, names)
+    return feats[0] if single else feats
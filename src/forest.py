@@ -0,0 +1,137 @@
+"""
+Exports the trained scaler + Random Forest pipeline to flat NumPy arrays, and predicts from them
+with NumPy only (no sklearn import, no unpickling 100 tree objects).
+- Every tree's nodes are stored one after another in shared arrays: feature, threshold,
+    left/right child (as indices into the shared arrays) and class probabilities at each node.
+- Leaves point to themselves, so walking all trees for all rows at once is just
+    repeating the same array lookup max_depth times.
+- Probabilities match the pipeline's predict_proba.
+"""
+
+import numpy as np
+
+from variables import EXPORT_PATH
+
+EXPORT_VERSION = 1
+
+
+def model_arrays(model):
+    """
+    The flat arrays export_model() writes for a fitted Pipeline([scaler, RandomForestClassifier])
+    """
+    scaler = model.named_steps["scaler"]
+    forest = model.named_steps["clf"]
+    n_classes = forest.n_classes_
+
+    features, thresholds, lefts, rights, values, roots = [], [], [], [], [], []
+    offset = 0
+    max_depth = 0
+    for est in forest.estimators_:
+        tree = est.tree_
+        nodes = np.arange(tree.node_count)
+        leaf = tree.children_left < 0
+
+        roots.append(offset)
+        features.append(np.where(leaf, 0, tree.feature))
+        thresholds.append(np.where(leaf, np.inf, tree.threshold))
+        lefts.append(np.where(leaf, nodes, tree.children_left) + offset)
+        rights.append(np.where(leaf, nodes, tree.children_right) + offset)
+        # Older sklearn stores class counts at each node, newer fractions. Normalising gives fractions either way
+        value = tree.value[:, 0, :n_classes]
+        total = value.sum(axis=1, keepdims=True)
+        values.append(value / np.where(total == 0, 1, total))
+
+        offset += tree.node_count
+        max_depth = max(max_depth, tree.max_depth)
+
+    return dict(
+        version=EXPORT_VERSION,
+        mean=scaler.mean_,
+        scale=scaler.scale_,
+        classes=forest.classes_,
+        roots=np.array(roots, dtype=np.int64),
+        feature=np.concatenate(features).astype(np.int64),
+        threshold=np.concatenate(thresholds).astype(np.float64),
+        left=np.concatenate(lefts).astype(np.int64),
+        right=np.concatenate(rights).astype(np.int64),
+        value=np.concatenate(values).astype(np.float64),
+        max_depth=max_depth,
+    )
+
+
+def export_model(model, path=EXPORT_PATH, verbose=True):
+    """
+    Flatten a fitted Pipeline([scaler, RandomForestClassifier]) into one .npz file
+    """
+    np.savez(path, **model_arrays(model))
+    if verbose:
+        print(f"Exported model arrays to {path}")
+
+
+class ForestPredictor:
+    """
+    NumPy-only predict_proba over the arrays written by export_model
+    """
+
+    def __init__(self, arrays):
+        if int(arrays["version"]) != EXPORT_VERSION:
+            raise ValueError(f"Unsupported export version {int(arrays['version'])}")
+        self.mean = arrays["mean"]
+        self.scale = arrays["scale"]
+        self.classes_ = arrays["classes"]
+        self.roots = arrays["roots"]
+        self.feature = arrays["feature"]
+        self.threshold = arrays["threshold"]
+        self.left = arrays["left"]
+        self.right = arrays["right"]
+        self.value = arrays["value"]
+        self.max_depth = int(arrays["max_depth"])
+
+    @classmethod
+    def load(cls, path=EXPORT_PATH):
+        """
+        Load an exported model
+        """
+        with np.load(path) as arrays:
+            return cls({key: arrays[key] for key in arrays.files})
+
+    @property
+    def n_trees(self):
+        return len(self.roots)
+
+    def apply(self, x, trees=None):
+        """
+        Leaf index reached in each tree for each row. Returns an (n_rows, n_trees) array.
+        trees can be a slice/index array to only walk some of the trees.
+        """
+        x = np.atleast_2d(np.asarray(x, dtype=np.float64))
+        # Trees were trained on float32 features, so round the same way sklearn does
+        x = ((x - self.mean) / self.scale).astype(np.float32).astype(np.float64)
+
+        roots = self.roots if trees is None else self.roots[trees]
+        nodes = np.broadcast_to(roots, (len(x), len(roots))).copy()
+        rows = np.arange(len(x))[:, None]
+        for _ in range(self.max_depth):
+            go_left = x[rows, self.feature[nodes]] <= self.threshold[nodes]
+            nodes = np.where(go_left, self.left[nodes], self.right[nodes])
+        return nodes
+
+    def predict_proba(self, x, trees=None):
+        """
+        Class probabilities (n_rows, n_classes), averaged over all trees (or just `trees`)
+        """
+        leaves = self.apply(x, trees)
+        return self.value[leaves].sum(axis=1) / leaves.shape[1]
+
+    def predict(self, x, trees=None):
+        """
+        Predicted class for each row
+        """
+        return self.classes_[np.argmax(self.predict_proba(x, trees), axis=1)]
+
+
+def load_forest(path=EXPORT_PATH):
+    """
+    Load the exported model from EXPORT_PATH
+    """
+    return ForestPredictor.load(path)
@@ -0,0 +1,201 @@
+"""
+Low-overhead inference for the scaler + Random Forest pipeline.
+- SequentialForest scores rows on the calling thread: the scaler is applied by hand and each
+    tree's compiled predict is called directly, skipping the pipeline's input validation
+    and joblib dispatch. This is the fast path for one (or a few) windows.
+- InferenceEngine buffers windows and scores them together once the batch is full or the
+    oldest window has waited max_latency seconds. Every result reports how long its window waited,
+    so the end-to-end latency is bounded by max_latency plus one batch's scoring time.
+- CascadeScorer runs a few trees first and only sends windows that might be seizure to the rest.
+"""
+
+import time
+
+import numpy as np
+
+from variables import (INFERENCE_BATCH_SIZE, INFERENCE_MAX_LATENCY, CASCADE_TREES, CASCADE_MARGIN,
+                       PROB_THRESHOLD)
+
+
+class SequentialForest:
+    """
+    predict_proba for a fitted Pipeline([scaler, RandomForestClassifier]) without joblib.
+    Gives the same probabilities as the pipeline.
+    """
+
+    def __init__(self, model):
+        scaler = model.named_steps["scaler"]
+        forest = model.named_steps["clf"]
+        self.mean = scaler.mean_
+        self.scale = scaler.scale_
+        self.trees = [est.tree_ for est in forest.estimators_]
+        self.n_classes = forest.n_classes_
+        self.classes_ = forest.classes_
+
+    @property
+    def n_trees(self):
+        return len(self.trees)
+
+    def predict_proba(self, x, trees=None):
+        """
+        Class probabilities for an (n, n_features) array (or a single 1D row),
+        averaged over all trees (or just `trees`, a slice or index array as in ForestPredictor)
+        """
+        x = np.atleast_2d(np.asarray(x, dtype=np.float64))
+        # Trees compare float32 features, same as sklearn's own input check does
+        x = np.ascontiguousarray((x - self.mean) / self.scale, dtype=np.float32)
+
+        selected = self.trees if trees is None else [self.trees[i] for i in np.arange(self.n_trees)[trees]]
+        proba = np.zeros((len(x), self.n_classes))
+        for tree in selected:
+            # Normalised the same way sklearn does, since older versions store class counts in the leaves
+            tree_proba = tree.predict(x)[:, :self.n_classes]
+            total = tree_proba.sum(axis=1, keepdims=True)
+            proba += tree_proba / np.where(total == 0, 1, total)
+        proba /= len(selected)
+        return proba
+
+
+def fast_scorer(model):
+    """
+    Wraps a trained pipeline in a SequentialForest if it is the scaler + forest pipeline
+    that classifier.train() builds, otherwise returns the model unchanged
+    """
+    steps = getattr(model, "named_steps", {})
+    if "scaler" in steps and hasattr(steps.get("clf"), "estimators_"):
+        return SequentialForest(model)
+    return model
+
+
+class CascadeScorer:
+    """
+    Two-stage scoring: the first `stage1_trees` trees score every window, and only windows that
+    aren't clearly normal go on to the rest of the forest.
+    - A window is settled by stage 1 if its stage 1 P(seizure) is below prob_threshold - margin and
+        no run of seizure predictions is building (building=True rows always go to the full model).
+    - Escalated windows reuse the stage 1 trees, so their probability is the full forest's.
+    - Counts how many tree evaluations were skipped (compute_saved).
+    Works with a fitted pipeline (through SequentialForest) or an exported ForestPredictor.
+    """
+
+    def __init__(self, model, stage1_trees=CASCADE_TREES, margin=CASCADE_MARGIN, prob_threshold=PROB_THRESHOLD):
+        self.forest = fast_scorer(model)
+        self.classes_ = self.forest.classes_
+        self.n = self.forest.n_trees
+        self.k = min(stage1_trees, self.n)
+        self.settle_below = prob_threshold - margin
+        self.windows = 0
+        self.escalated = 0
+
+    def predict_proba(self, x, building=False):
+        x = np.atleast_2d(x)
+        proba = self.forest.predict_proba(x, trees=slice(0, self.k))
+        escalate = (proba[:, 1] >= self.settle_below) | np.asarray(building, dtype=bool)
+        if self.k < self.n and escalate.any():
+            rest = self.forest.predict_proba(x[escalate], trees=slice(self.k, self.n))
+            proba[escalate] = (proba[escalate] * self.k + rest * (self.n - self.k)) / self.n
+        self.windows += len(x)
+        self.escalated += int(escalate.sum())
+        return proba
+
+    @property
+    def compute_saved(self):
+        """
+        Fraction of tree evaluations skipped compared with always running the full forest
+        """
+        if not self.windows:
+            return 0.0
+        evaluated = self.windows * self.k + self.escalated * (self.n - self.k)
+        return 1.0 - evaluated / (self.windows * self.n)
+
+
+class InferenceEngine:
+    """
+    Micro-batching scorer. submit() queues a feature row and returns any results that were
+    scored because the batch filled up or the deadline passed. poll() should be called
+    regularly when no new windows arrive, so waiting windows still meet the deadline.
+    Results are (tag, prob, latency) tuples, where latency is seconds from submit to scored.
+    """
+
+    def __init__(self, model, batch_size=INFERENCE_BATCH_SIZE, max_latency=INFERENCE_MAX_LATENCY):
+        self.model = model
+        self.scorer = fast_scorer(model)
+        self.batch_size = batch_size
+        self.max_latency = max_latency
+
+        self._rows = []
+        self._tags = []
+        self._times = []
+        self.latencies = []
+        self.batches = 0
+        self.last_batch_seconds = 0.0   # time spent scoring the most recent batch
+
+    def __len__(self):
+        return len(self._rows)
+
+    def due(self):
+        """
+        True if the queued windows should be scored now
+        """
+        if not self._rows:
+            return False
+        if len(self._rows) >= self.batch_size:
+            return True
+        return time.perf_counter() - self._times[0] >= self.max_latency
+
+    def submit(self, feats, tag=None):
+        """
+        Queue one feature row (any tag can be attached to find it again in the results)
+        """
+        self._rows.append(feats)
+        self._tags.append(tag)
+        self._times.append(time.perf_counter())
+        return self.flush() if self.due() else []
+
+    def poll(self):
+        """
+        Score the queue if the oldest window is past its deadline
+        """
+        return self.flush() if self.due() else []
+
+    def flush(self):
+        """
+        Score everything queued in one call
+        """
+        if not self._rows:
+            return []
+
+        start = time.perf_counter()
+        probs = self.scorer.predict_proba(np.vstack(self._rows))[:, 1]
+
+        now = time.perf_counter()
+        self.last_batch_seconds = now - start
+        latencies = [now - t for t in self._times]
+        results = list(zip(self._tags, probs.tolist(), latencies))
+        self.latencies.extend(latencies)
+        self.batches += 1
+
+        self._rows, self._tags, self._times = [], [], []
+        return results
+
+    def predict_one(self, feats):
+        """
+        Score a single feature row straight away on the sequential path. Returns P(seizure)
+        """
+        return float(self.scorer.predict_proba(feats)[0, 1])
+
+    def latency_summary(self):
+        """
+        p50/p95/p99/max of the per-window latencies seen so far, in milliseconds
+        """
+        if not self.latencies:
+            return {}
+        lat = np.array(self.latencies) * 1000
+        return {
+            "windows": len(lat),
+            "batches": self.batches,
+            "p50_ms": float(np.percentile(lat, 50)),
+            "p95_ms": float(np.percentile(lat, 95)),
+            "p99_ms": float(np.percentile(lat, 99)),
+            "max_ms": float(lat.max()),
+        }
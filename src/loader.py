@@ -3,18 +3,43 @@
     adding them to a dataset with their labels and set names.
 - Then splits the dataset into train/test sets, 
     preserving the proportion of segments from each set in both splits.
+- Raw files are parsed across a process pool (order is kept so the split doesn't change).
+- The parsed dataset is cached in CACHE_DIR as flat binary arrays, which later runs memory-map
+    instead of re-parsing the text files. The cache is rebuilt if any source file changes.
+    The train/test split indices are cached too, so sklearn is only imported when they change.
+- lazy_loader() returns SegmentIndexes instead of lists: just the metadata of each segment, with signals
+    read (or sliced from the cache) only when something uses them.
 """
 
+import json
+import os
+import shutil
+from collections import deque
+from collections.abc import Mapping
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
 from pathlib import Path
-from sklearn.model_selection import StratifiedShuffleSplit
 import numpy as np
 
-from variables import DATA_DIR, TEST_SIZE, SET_LABELS
+from variables import (DATA_DIR, TEST_SIZE, SET_LABELS, CACHE_DIR, CACHE_DTYPE, LOADER_WORKERS,
+                       LOAD_BATCH_SEGMENTS)
+
+CACHE_VERSION = 2
+SPLIT_RANDOM_STATE = 2
 
 def load_segment(filepath):
     """
     Load a single .txt EEG segment
+    Parses the whole file with numpy's C parser, and only falls back to line by line
+    (skipping lines that aren't numbers) if that fails.
     """
+    try:
+        samples = np.loadtxt(filepath, dtype=np.float64, ndmin=1, encoding="utf-8")
+        if samples.ndim == 1:
+            return samples
+    except ValueError:
+        pass
+
     samples = []
     with open(filepath, "r", encoding="utf-8") as f:
         for line in f:
@@ -26,40 +51,380 @@ def load_segment(filepath):
     return np.array(samples)
 
 
-def split_segments(dataset):
+def _load_chunk(filepaths):
+    return [load_segment(fp) for fp in filepaths]
+
+
+def iter_segments(filepaths, workers=LOADER_WORKERS, max_pending=None):
     """
-    Split segments into train/test, preserving set proportions
+    Load many segment files across one process pool, yielding each signal (in filepaths order)
+    as soon as it is parsed. max_pending caps how many files are parsed ahead of the consumer,
+    so a slow consumer doesn't end up with the whole dataset in memory (None = no cap).
     """
-    segments = np.array(dataset)
-    set_names = np.array([s["set_name"] for s in dataset])
+    filepaths = list(filepaths)
+    workers = workers or os.cpu_count() or 1
+    workers = min(workers, len(filepaths))
+    if workers <= 1:
+        yield from map(load_segment, filepaths)
+        return
 
-    splitter = StratifiedShuffleSplit(n_splits=1, test_size=TEST_SIZE, random_state=2)
-    train_idx, test_idx = next(splitter.split(segments, set_names))
-    return segments[train_idx].tolist(), segments[test_idx].tolist()
+    # Big chunks so each worker gets a run of files rather than one at a time
+    chunksize = max(1, len(filepaths) // (workers * 4))
+    if max_pending is not None:
+        chunksize = max(1, min(chunksize, max_pending // (workers * 2)))
+        max_chunks = max(workers * 2, max_pending // chunksize)
+    else:
+        max_chunks = len(filepaths)
 
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        for start in range(0, len(filepaths), chunksize):
+            pending.append(pool.submit(_load_chunk, filepaths[start:start + chunksize]))
+            if len(pending) >= max_chunks:
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
 
-def loader():
+
+def load_segments(filepaths, workers=LOADER_WORKERS):
     """
-    Load all segments from all sets into a list of dicts: {signal, label, set_name, segment_id}
-    Then split into train/test sets, preserving 
-    the proportion of segments from each set in both splits.
+    Load many segment files, spreading them across a process pool.
+    Results come back in the same order as filepaths.
     """
-    data_dir = Path(DATA_DIR)
-    dataset = []
+    return list(iter_segments(filepaths, workers))
 
+
+def segment_files(data_dir=DATA_DIR):
+    """
+    List every segment file as (filepath, set_name, label), in the order the dataset is built.
+    """
+    data_dir = Path(data_dir)
+    files = []
     for set_name, label in SET_LABELS.items():
         set_dir = data_dir / set_name
         if not set_dir.exists():
             print(f"Warning: {set_dir} not found, skipping.")
             continue
         for filepath in sorted(set_dir.glob("*.txt")) + sorted(set_dir.glob("*.TXT")): # For some reason just the files in the N folder are TXT?
-            signal = load_segment(filepath)
-            dataset.append({
-                "signal": signal,
-                "label": label,
-                "set_name": set_name,
-                "segment_id": filepath.stem,
-            })
+            files.append((filepath, set_name, label))
+    return files
+
+
+def _fingerprint(files):
+    """
+    Name, size and mtime of every source file. If any of these change the cache is stale.
+    """
+    fingerprint = []
+    for filepath, _, _ in files:
+        stat = filepath.stat()
+        fingerprint.append([str(filepath), stat.st_size, stat.st_mtime_ns])
+    return fingerprint
+
+
+def build_cache(files, cache_dir=CACHE_DIR, batch_size=LOAD_BATCH_SEGMENTS):
+    """
+    Parse the source files into cache_dir, writing each signal as it is parsed. At most batch_size
+    files are parsed ahead of the writer (so memory use doesn't grow with the size of the dataset):
+    - samples.bin: every signal concatenated into one contiguous raw array of CACHE_DTYPE
+        (int16 only if it is lossless, i.e. every sample is a whole number in range, as in the Bonn data)
+    - offsets.npy: where each segment starts/ends in samples
+    - labels.npy, set_names.npy, segment_ids.npy
+    - manifest.json: the source fingerprint. Written last, so a half written cache is never used
+    """
+    cache_dir = Path(cache_dir)
+    if cache_dir.exists():
+        shutil.rmtree(cache_dir)
+    cache_dir.mkdir(parents=True)
+
+    lengths = []
+    with open(cache_dir / "samples.bin", "wb") as f:
+        signals = iter_segments([filepath for filepath, _, _ in files], max_pending=batch_size)
+        for (filepath, _, _), signal in zip(files, signals):
+            stored = np.asarray(signal).astype(CACHE_DTYPE)
+            if stored.dtype.kind == "i" and not np.array_equal(stored, signal):
+                raise ValueError(f"{filepath} can't be stored as {CACHE_DTYPE} without losing samples, "
+                                 f"use a float CACHE_DTYPE")
+            stored.tofile(f)
+            lengths.append(len(signal))
+
+    np.save(cache_dir / "offsets.npy", np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64))
+    np.save(cache_dir / "labels.npy", np.array([label for _, _, label in files], dtype=np.int64))
+    np.save(cache_dir / "set_names.npy", np.array([set_name for _, set_name, _ in files]))
+    np.save(cache_dir / "segment_ids.npy", np.array([filepath.stem for filepath, _, _ in files]))
+
+    manifest = {"version": CACHE_VERSION, "dtype": CACHE_DTYPE, "files": _fingerprint(files)}
+    with open(cache_dir / "manifest.json", "w", encoding="utf-8") as f:
+        json.dump(manifest, f)
+
+
+def _cache_valid(files, cache_dir=CACHE_DIR):
+    manifest_path = Path(cache_dir) / "manifest.json"
+    if not files or not manifest_path.exists():
+        return False
+    with open(manifest_path, "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+    return manifest == {"version": CACHE_VERSION, "dtype": CACHE_DTYPE, "files": _fingerprint(files)}
+
+
+def _cached_samples(cache_dir=CACHE_DIR):
+    """
+    The memory-mapped samples and their offsets
+    """
+    cache_dir = Path(cache_dir)
+    offsets = np.load(cache_dir / "offsets.npy")
+    if offsets[-1] == 0:
+        return np.empty(0, dtype=CACHE_DTYPE), offsets
+    samples = np.memmap(cache_dir / "samples.bin", dtype=CACHE_DTYPE, mode="r").view(np.ndarray)
+    return samples, offsets
+
+
+class LazySegment(Mapping):
+    """
+    One segment of a SegmentIndex, used like the dicts loader() returns.
+    The signal is only read the first time seg["signal"] is looked up.
+    """
+
+    KEYS = ("signal", "label", "set_name", "segment_id")
+
+    def __init__(self, index, i):
+        self._index = index
+        self._i = i
+        self._signal = None
+
+    def __getitem__(self, key):
+        if key == "signal":
+            if self._signal is None:
+                self._signal = self._index.signal(self._i)
+            return self._signal
+        if key == "label":
+            return int(self._index.labels[self._i])
+        if key == "set_name":
+            return str(self._index.set_names[self._i])
+        if key == "segment_id":
+            return str(self._index.segment_ids[self._i])
+        raise KeyError(key)
+
+    def __iter__(self):
+        return iter(self.KEYS)
+
+    def __len__(self):
+        return len(self.KEYS)
+
+
+class SegmentIndex:
+    """
+    Index of (path, set_name, label, segment_id) for every segment, without the signals.
+    Signals are read on demand: sliced out of the memory-mapped cache if there is one,
+    otherwise parsed from the text file.
+    - Indexing with an int gives a LazySegment, with a slice or index array a smaller SegmentIndex
+    - Iterating gives LazySegments, batches() gives lists of loaded segment dicts
+    """
+
+    def __init__(self, paths, set_names, labels, segment_ids, samples=None, offsets=None, rows=None):
+        self.paths = paths
+        self.set_names = set_names
+        self.labels = labels
+        self.segment_ids = segment_ids
+        self._samples = samples
+        self._offsets = offsets
+        # Row of each segment in the cache (subsets keep pointing at the full cache)
+        self._rows = rows if rows is not None else np.arange(len(paths))
+
+    @classmethod
+    def from_files(cls, files, cache_dir=CACHE_DIR, build=False):
+        """
+        Index the files from segment_files(). Uses the cache if it is up to date
+        (and builds it first if build=True), otherwise signals come from the text files.
+        """
+        if build and files and not _cache_valid(files, cache_dir):
+            build_cache(files, cache_dir)
+            print(f"Cached dataset to {cache_dir}")
+
+        samples = offsets = None
+        if _cache_valid(files, cache_dir):
+            print(f"Using cached dataset in {cache_dir}")
+            samples, offsets = _cached_samples(cache_dir)
+
+        return cls(
+            np.array([str(filepath) for filepath, _, _ in files]),
+            np.array([set_name for _, set_name, _ in files]),
+            np.array([label for _, _, label in files], dtype=np.int64),
+            np.array([filepath.stem for filepath, _, _ in files]),
+            samples, offsets,
+        )
+
+    def __len__(self):
+        return len(self.paths)
+
+    def signal(self, i):
+        if self._samples is not None:
+            row = self._rows[i]
+            return self._samples[self._offsets[row]:self._offsets[row + 1]]
+        return load_segment(self.paths[i])
+
+    def subset(self, idx):
+        """
+        A SegmentIndex of just the segments at idx
+        """
+        idx = np.arange(len(self))[idx]
+        return SegmentIndex(self.paths[idx], self.set_names[idx], self.labels[idx], self.segment_ids[idx],
+                            self._samples, self._offsets, self._rows[idx])
+
+    def __getitem__(self, i):
+        if isinstance(i, (int, np.integer)):
+            if i < 0:
+                i += len(self)
+            if not 0 <= i < len(self):
+                raise IndexError(i)
+            return LazySegment(self, int(i))
+        return self.subset(i)
+
+    def __iter__(self):
+        return (LazySegment(self, i) for i in range(len(self)))
+
+    def batches(self, batch_size=LOAD_BATCH_SEGMENTS):
+        """
+        Yield lists of at most batch_size segment dicts with their signals loaded
+        (files are parsed across one process pool when there's no cache, at most batch_size ahead)
+        """
+        parsed = None
+        if self._samples is None:
+            parsed = iter_segments(self.paths, max_pending=batch_size)
+        for start in range(0, len(self), batch_size):
+            idx = range(start, min(start + batch_size, len(self)))
+            if parsed is None:
+                signals = [self.signal(i) for i in idx]
+            else:
+                signals = list(islice(parsed, len(idx)))
+            yield [
+                {
+                    "signal": signal,
+                    "label": int(self.labels[i]),
+                    "set_name": str(self.set_names[i]),
+                    "segment_id": str(self.segment_ids[i]),
+                }
+                for i, signal in zip(idx, signals)
+            ]
+
+
+def batched(segments, batch_size=LOAD_BATCH_SEGMENTS):
+    """
+    Yield lists of at most batch_size segments from a SegmentIndex or any iterable of segments
+    """
+    if isinstance(segments, SegmentIndex):
+        yield from segments.batches(batch_size)
+        return
+    batch = []
+    for seg in segments:
+        batch.append(seg)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def load_cache(files, cache_dir=CACHE_DIR):
+    """
+    Memory-map the cached dataset. Returns None if there is no cache or it doesn't match the source files.
+    Each signal is a view into the mapped samples array, so nothing is read until it is used.
+    """
+    if not _cache_valid(files, cache_dir):
+        return None
+
+    cache_dir = Path(cache_dir)
+    samples, offsets = _cached_samples(cache_dir)
+    labels = np.load(cache_dir / "labels.npy")
+    set_names = np.load(cache_dir / "set_names.npy")
+    segment_ids = np.load(cache_dir / "segment_ids.npy")
+
+    return [
+        {
+            "signal": samples[start:end],
+            "label": int(label),
+            "set_name": str(set_name),
+            "segment_id": str(segment_id),
+        }
+        for start, end, label, set_name, segment_id
+        in zip(offsets[:-1], offsets[1:], labels, set_names, segment_ids)
+    ]
+
+
+def load_dataset(data_dir=DATA_DIR, cache_dir=CACHE_DIR):
+    """
+    Load all segments as a list of dicts: {signal, label, set_name, segment_id}
+    Uses the binary cache if it is up to date, otherwise parses the text files and rebuilds it first.
+    """
+    files = segment_files(data_dir)
+    if not files:
+        return []
+
+    dataset = load_cache(files, cache_dir)
+    if dataset is not None:
+        print(f"Using cached dataset in {cache_dir}")
+        return dataset
+
+    build_cache(files, cache_dir)
+    print(f"Cached dataset to {cache_dir}")
+    return load_cache(files, cache_dir)
+
+
+def _load_split(set_names, cache_dir=CACHE_DIR):
+    """
+    Cached (train_idx, test_idx) for these set names, or None if there isn't a matching one
+    """
+    path = Path(cache_dir) / "split.npz"
+    if not path.exists():
+        return None
+    with np.load(path) as split:
+        if (float(split["test_size"]) != TEST_SIZE
+                or int(split["random_state"]) != SPLIT_RANDOM_STATE
+                or not np.array_equal(split["set_names"], set_names)):
+            return None
+        return split["train_idx"], split["test_idx"]
+
+
+def _save_split(set_names, train_idx, test_idx, cache_dir=CACHE_DIR):
+    """
+    Save split indices next to the dataset cache
+    """
+    cache_dir = Path(cache_dir)
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    np.savez(cache_dir / "split.npz", set_names=set_names, test_size=TEST_SIZE,
+             random_state=SPLIT_RANDOM_STATE, train_idx=train_idx, test_idx=test_idx)
+
+
+def split_index(set_names, cache_dir=CACHE_DIR):
+    """
+    (train_idx, test_idx) preserving set proportions. Only needs each segment's set name
+    """
+    set_names = np.asarray(set_names)
+    split = _load_split(set_names, cache_dir)
+    if split is None:
+        # Only needed when the split isn't cached, and slow to import
+        from sklearn.model_selection import StratifiedShuffleSplit
+
+        splitter = StratifiedShuffleSplit(n_splits=1, test_size=TEST_SIZE, random_state=SPLIT_RANDOM_STATE)
+        split = next(splitter.split(np.zeros(len(set_names)), set_names))
+        _save_split(set_names, *split, cache_dir=cache_dir)
+    return split
+
+
+def split_segments(dataset):
+    """
+    Split segments into train/test, preserving set proportions
+    """
+    train_idx, test_idx = split_index([s["set_name"] for s in dataset])
+    return [dataset[i] for i in train_idx], [dataset[i] for i in test_idx]
+
+
+def loader():
+    """
+    Load all segments from all sets into a list of dicts: {signal, label, set_name, segment_id}
+    Then split into train/test sets, preserving 
+    the proportion of segments from each set in both splits.
+    """
+    dataset = load_dataset()
 
     print(f"Loaded {len(dataset)} segments.")
 
@@ -68,3 +433,19 @@ def loader():
     print(f"  {len(train_segs)} train segments, {len(test_segs)} test segments")
 
     return train_segs, test_segs
+
+
+def lazy_loader(data_dir=DATA_DIR, cache_dir=CACHE_DIR, build=True):
+    """
+    Like loader(), but returns (train, test) SegmentIndexes, so signals are only read when used.
+    build=False never parses files that aren't asked for (e.g. midi only needs one per set).
+    """
+    index = SegmentIndex.from_files(segment_files(data_dir), cache_dir, build=build)
+
+    print(f"Indexed {len(index)} segments.")
+
+    train_idx, test_idx = split_index(index.set_names, cache_dir)
+    train_segs, test_segs = index.subset(train_idx), index.subset(test_idx)
+    print(f"  {len(train_segs)} train segments, {len(test_segs)} test segments")
+
+    return train_segs, test_segs
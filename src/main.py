@@ -5,16 +5,54 @@ Usage:
     python main.py                      #   run everything
     python main.py --part model         #   train/load model
     python main.py --part midi          #   generate the MIDI files only
+    python main.py --part midi-catalogue
+                                        #   one MIDI file per segment, rendered in parallel
     python main.py --part stream-demo   #   stream demo only (this will create and 
                                             train model as well if it isn't found)
+    python main.py --part monitor --streams 200
+                                        #   replay 200 test segments concurrently and
+                                            report monitoring throughput
+    python main.py --part hot-swap --streams 50
+                                        #   promote a new model version halfway through a monitor
+                                            replay; the server swaps to it without pausing the streams
+    python main.py --part stream-demo --quiet --metrics prometheus
+                                        #   stream demo without per-window printing, with
+                                            metrics written to METRICS_PROMETHEUS_PATH
+    python main.py --part replay        #   replay the test set (and all of it joined end to end)
+                                            with no sleeping and print the alert timelines
+    python main.py --part replay --recording long.txt --recording night.f32 --dtype float32 --mmap
+                                        #   replay long recordings (text, or raw binary samples of
+                                            --dtype) chunk by chunk with flat memory use
+    python main.py --part sonify        #   MIDI track that follows the test set window by window,
+                                            with alerts marked (also takes --recording files)
+    python main.py --part multires      #   train/evaluate the classifier on 0.5 s + 1 s + 4 s features
+                                            (printed after the single resolution model, to compare)
+    python main.py --part features      #   time/memory cost and importance of every registered feature
+    python main.py --part cascade       #   check the two-stage cascade against the full model on the
+                                            test set (compute saved, alert timing)
+    python main.py --part stream-demo --cascade
+                                        #   stream demo scored with the cascade
+    python main.py --part cv            #   5-fold cross-validation over every segment, with
+                                            window, segment and alert level metrics
+    python main.py --part search        #   search window/step, forest size and thresholds in parallel,
+                                            ranked by alert latency vs false alarms (see search.py)
+    python main.py --part precision     #   how far int16/float32 storage and float32 features move
+                                            features and predictions from float64 (see CACHE_DTYPE,
+                                            FEATURE_DTYPE in variables.py)
+    python main.py --part model --out-of-core
+                                        #   train in shards with bounded memory (if no model exists yet)
+    python main.py --part bench --scale 1,10
+                                        #   benchmark every stage at 1x and 10x the dataset,
+                                            results written to BENCH_OUTPUT_PATH as JSON
+    python main.py --part startup       #   time from a cold start to first prediction for each part
+    python main.py --part midi --import-profile
+                                        #   run a part and print the slowest imports
+
+Each part only imports the modules it uses, so e.g. --part midi never imports sklearn.
 """
 
 import argparse
-
-from loader import loader
-from classifier import classifier
-from streamer import streamer_demo
-from midi import midi
+import sys
 
 def main():
     """
@@ -23,27 +61,160 @@ def main():
     parser = argparse.ArgumentParser(description="EEG seizure detection + MIDI generation")
     parser.add_argument(
         "--part",
-        choices=["model", "stream-demo", "midi", "all"],
+        choices=["model", "stream-demo", "monitor", "hot-swap", "replay", "multires", "cascade", "sonify", "search", "precision", "cv", "features", "midi", "midi-catalogue", "bench", "startup", "all"],
         default="all",
     )
+    parser.add_argument(
+        "--streams",
+        type=int,
+        default=100,
+        help="Number of concurrent streams for --part monitor",
+    )
+    parser.add_argument(
+        "--metrics",
+        choices=["memory", "prometheus", "jsonl"],
+        default=None,
+        help="Record detector metrics for stream-demo/monitor and send them to this sink",
+    )
+    parser.add_argument(
+        "--quiet",
+        action="store_true",
+        help="Don't print every window in stream-demo (alerts are still printed)",
+    )
+    parser.add_argument(
+        "--recording",
+        action="append",
+        help="Long recording file for --part replay or sonify (can be given more than once)",
+    )
+    parser.add_argument(
+        "--dtype",
+        default=None,
+        help="Sample dtype of raw binary --recording files (default RECORDING_DTYPE)",
+    )
+    parser.add_argument(
+        "--mmap",
+        action="store_true",
+        help="Memory-map raw binary --recording files instead of reading them",
+    )
+    parser.add_argument(
+        "--out-of-core",
+        action="store_true",
+        help="When training, featurize in batches and train one forest per shard (bounded memory)",
+    )
+    parser.add_argument(
+        "--cascade",
+        action="store_true",
+        help="Score stream-demo windows with the two-stage cascade (a few trees first)",
+    )
+    parser.add_argument(
+        "--scale",
+        default="1",
+        help="Comma separated dataset multipliers for --part bench, e.g. 1,10,100",
+    )
+    parser.add_argument(
+        "--import-profile",
+        action="store_true",
+        help="Run under python -X importtime and print the slowest imports",
+    )
 
     args = parser.parse_args()
 
+    if args.import_profile:
+        from startup import import_profile
+        sys.exit(import_profile([a for a in sys.argv[1:] if a != "--import-profile"]))
+
+    if args.part == "bench":
+        from bench import bench
+        bench([int(s) for s in args.scale.split(",")])
+        return
+
+    if args.part == "startup":
+        from startup import startup_bench
+        startup_bench()
+        return
+
+    from loader import lazy_loader
+
+    # Only the metadata is loaded here, signals are read as each part needs them.
+    # midi only needs one segment per set, so it doesn't build the dataset cache either.
     print("Loading dataset...")
-    train_segs, test_segs = loader()
+    train_segs, test_segs = lazy_loader(build=args.part != "midi")
 
     if not train_segs:
         print("No training data found. Check DATA_DIR in variables.py.")
         return
 
-    if args.part in ("model", "stream-demo", "all"):
+    if args.part == "features":
+        from evaluation import feature_report
+        feature_report(train_segs)
+        return
+
+    if args.part == "search":
+        from search import search
+        search(train_segs, test_segs)
+        return
+
+    if args.part == "cv":
+        from evaluation import cross_validate
+        cross_validate(list(train_segs) + list(test_segs))
+        return
+
+    if args.part in ("model", "stream-demo", "monitor", "hot-swap", "replay", "multires", "cascade", "sonify", "precision", "all"):
+        from classifier import classifier
 
-        model = classifier(train_segs, test_segs)
+        model = classifier(train_segs, test_segs, out_of_core=args.out_of_core)
+
+        metrics = None
+        if args.metrics:
+            from metrics import DetectorMetrics, make_sink
+            metrics = DetectorMetrics(make_sink(args.metrics))
 
         if args.part in ("stream-demo", "all"):
-            streamer_demo(test_segs, model)
+            from streamer import streamer_demo
+            streamer_demo(test_segs, model, metrics=metrics, verbose=not args.quiet, cascade=args.cascade)
+
+        if args.part == "monitor":
+            from monitor import monitor_demo
+            monitor_demo(test_segs, model, args.streams, metrics=metrics)
+
+        if args.part == "hot-swap":
+            from monitor import hot_swap_demo
+            hot_swap_demo(train_segs, test_segs, model, args.streams)
+
+        if args.part == "cascade":
+            from streamer import cascade_report
+            cascade_report(test_segs, model)
+
+        if args.part == "multires":
+            from multires import multires_classifier
+            multires_classifier(train_segs, test_segs)
+
+        if args.part == "precision":
+            from precision import precision_report
+            precision_report(test_segs, model)
+
+        if args.part == "sonify":
+            from sonify import sonify_demo
+            sonify_demo(test_segs, model, paths=args.recording, dtype=args.dtype, mmap=args.mmap)
+
+        if args.part == "replay":
+            if args.recording:
+                from replay import replay_files
+                replay_files(args.recording, model, dtype=args.dtype, mmap=args.mmap)
+            else:
+                from replay import replay_demo
+                replay_demo(test_segs, model)
+
+        if metrics is not None:
+            metrics.close()
+
+    if args.part == "midi-catalogue":
+        from midi import midi_catalogue
+        midi_catalogue(list(train_segs) + list(test_segs))
+        return
 
     if args.part in ("midi", "all"):
+        from midi import midi
         midi(train_segs)
 
 
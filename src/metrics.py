@@ -0,0 +1,272 @@
+"""
+Lightweight instrumentation for the live detector.
+- DetectorMetrics counts windows, alerts and missed deadlines, and keeps fixed-bucket histograms
+    of feature time, inference time, latency against the real-time deadline and P(seizure).
+    Recording a window is a handful of integer/float updates, so it can stay on all the time.
+- Sinks decide where the numbers go:
+    - MemorySink keeps snapshots in memory
+    - PrometheusSink writes the Prometheus text format to a file (e.g. for node_exporter's textfile collector)
+    - JsonLinesSink appends one JSON line per window plus one per snapshot
+"""
+
+import json
+import os
+import time
+from bisect import bisect_left
+
+from variables import (SAMPLING_RATE, STEP_SIZE, SIMULATED_SPEED, METRICS_PROMETHEUS_PATH,
+                       METRICS_JSONL_PATH)
+
+# Upper bounds (seconds) of the timing histogram buckets
+TIME_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+PROB_BUCKETS = 10  # P(seizure) histogram has this many equal-width bins
+
+
+class _Histogram:
+    """
+    Cumulative-bucket histogram with a running sum, like a Prometheus histogram
+    """
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # last bucket is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def snapshot(self):
+        return {
+            "buckets": list(self.buckets),
+            "counts": list(self.counts),
+            "sum": self.sum,
+            "count": self.count,
+        }
+
+
+class DetectorMetrics:
+    """
+    Metrics for one detector (or a whole server of them).
+    deadline is how long a window can take before the detector falls behind real time:
+    one hop of signal, sped up by SIMULATED_SPEED.
+    """
+
+    def __init__(self, sink=None, deadline=None):
+        self.sink = sink
+        self.deadline = deadline if deadline is not None else (STEP_SIZE / SAMPLING_RATE) / SIMULATED_SPEED
+        self.started = time.time()
+
+        self.windows = 0
+        self.seizure_windows = 0
+        self.alerts = 0
+        self.missed_deadlines = 0
+        self.feature_time = _Histogram(TIME_BUCKETS)
+        self.inference_time = _Histogram(TIME_BUCKETS)
+        self.lag = _Histogram(TIME_BUCKETS)
+        self.prob_counts = [0] * PROB_BUCKETS
+        self.prob_sum = 0.0
+
+    def record(self, feature_s, inference_s, lag_s, prob, prediction, alert, stream_id=None):
+        """
+        Record one scored window. lag_s is the time from the window's last sample arriving
+        to its prediction being ready.
+        """
+        self.windows += 1
+        self.seizure_windows += prediction
+        self.alerts += alert
+        if lag_s > self.deadline:
+            self.missed_deadlines += 1
+        self.feature_time.observe(feature_s)
+        self.inference_time.observe(inference_s)
+        self.lag.observe(lag_s)
+        self.prob_counts[min(int(prob * PROB_BUCKETS), PROB_BUCKETS - 1)] += 1
+        self.prob_sum += prob
+
+        if self.sink is not None and self.sink.per_window:
+            self.sink.window({
+                "stream_id": stream_id,
+                "feature_s": feature_s,
+                "inference_s": inference_s,
+                "lag_s": lag_s,
+                "prob": prob,
+                "prediction": prediction,
+                "alert": alert,
+            })
+
+    def snapshot(self):
+        """
+        All metrics as a plain dict
+        """
+        return {
+            "time": time.time(),
+            "uptime_s": time.time() - self.started,
+            "deadline_s": self.deadline,
+            "windows": self.windows,
+            "seizure_windows": self.seizure_windows,
+            "alerts": self.alerts,
+            "missed_deadlines": self.missed_deadlines,
+            "feature_seconds": self.feature_time.snapshot(),
+            "inference_seconds": self.inference_time.snapshot(),
+            "lag_seconds": self.lag.snapshot(),
+            "probability_counts": list(self.prob_counts),
+            "probability_sum": self.prob_sum,
+        }
+
+    def flush(self):
+        """
+        Send a snapshot to the sink
+        """
+        snapshot = self.snapshot()
+        if self.sink is not None:
+            self.sink.snapshot(snapshot)
+        return snapshot
+
+    def close(self):
+        """
+        Close the sink, writing anything it still has buffered
+        """
+        if self.sink is not None:
+            self.sink.close()
+
+    def summary(self):
+        """
+        One line human readable summary
+        """
+        def mean_ms(hist):
+            return hist.sum / hist.count * 1000 if hist.count else 0.0
+        return (f"{self.windows} windows, {self.alerts} alerts, "
+                f"{self.missed_deadlines} missed deadlines ({self.deadline*1000:.0f}ms) | "
+                f"mean features {mean_ms(self.feature_time):.3f}ms, "
+                f"inference {mean_ms(self.inference_time):.3f}ms, lag {mean_ms(self.lag):.3f}ms")
+
+
+class MemorySink:
+    """
+    Keeps every snapshot in a list
+    """
+
+    per_window = False
+
+    def __init__(self):
+        self.snapshots = []
+
+    def window(self, record):
+        pass
+
+    def snapshot(self, snapshot):
+        self.snapshots.append(snapshot)
+
+    def close(self):
+        pass
+
+
+class PrometheusSink:
+    """
+    Writes the latest snapshot to a file in the Prometheus text exposition format.
+    The file is replaced atomically so a scraper never sees half of it.
+    """
+
+    per_window = False
+
+    def __init__(self, path, prefix="seizure_detector"):
+        self.path = path
+        self.prefix = prefix
+
+    def window(self, record):
+        pass
+
+    def _histogram(self, lines, name, help_text, hist):
+        name = f"{self.prefix}_{name}"
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} histogram")
+        cumulative = 0
+        bounds = [str(b) for b in hist["buckets"]] + ["+Inf"]
+        for bound, count in zip(bounds, hist["counts"]):
+            cumulative += count
+            lines.append(f'{name}_bucket{{le="{bound}"}} {cumulative}')
+        lines.append(f"{name}_sum {hist['sum']}")
+        lines.append(f"{name}_count {hist['count']}")
+
+    def snapshot(self, snapshot):
+        p = self.prefix
+        lines = []
+        for key, help_text in (("windows", "Windows scored"),
+                               ("seizure_windows", "Windows predicted as seizure"),
+                               ("alerts", "Seizure alerts raised"),
+                               ("missed_deadlines", "Windows that took longer than the real-time deadline")):
+            lines.append(f"# HELP {p}_{key}_total {help_text}")
+            lines.append(f"# TYPE {p}_{key}_total counter")
+            lines.append(f"{p}_{key}_total {snapshot[key]}")
+
+        self._histogram(lines, "feature_seconds", "Feature extraction time per window",
+                        snapshot["feature_seconds"])
+        self._histogram(lines, "inference_seconds", "Model inference time per window",
+                        snapshot["inference_seconds"])
+        self._histogram(lines, "lag_seconds", "Time from a window's last sample to its prediction",
+                        snapshot["lag_seconds"])
+
+        probs = snapshot["probability_counts"]
+        self._histogram(lines, "probability", "P(seizure) per window", {
+            "buckets": [round((i + 1) / len(probs), 3) for i in range(len(probs) - 1)],
+            "counts": probs,
+            "sum": snapshot["probability_sum"],
+            "count": sum(probs),
+        })
+
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(tmp, self.path)
+
+    def close(self):
+        pass
+
+
+class JsonLinesSink:
+    """
+    Appends one JSON line per window and one per snapshot (buffered, written every buffer_lines
+    lines, on snapshot and on close)
+    """
+
+    per_window = True
+
+    def __init__(self, path, buffer_lines=1000):
+        self.path = path
+        self.buffer_lines = buffer_lines
+        self._buffer = []
+
+    def window(self, record):
+        self._buffer.append(json.dumps({"type": "window", **record}))
+        if len(self._buffer) >= self.buffer_lines:
+            self._write()
+
+    def snapshot(self, snapshot):
+        self._buffer.append(json.dumps({"type": "snapshot", **snapshot}))
+        self._write()
+
+    def close(self):
+        if self._buffer:
+            self._write()
+
+    def _write(self):
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write("\n".join(self._buffer) + "\n")
+        self._buffer = []
+
+
+def make_sink(kind, path=None):
+    """
+    Build a sink by name: "memory", "prometheus" or "jsonl" (None for no sink)
+    """
+    if kind is None:
+        return None
+    if kind == "memory":
+        return MemorySink()
+    if kind == "prometheus":
+        return PrometheusSink(path or METRICS_PROMETHEUS_PATH)
+    if kind == "jsonl":
+        return JsonLinesSink(path or METRICS_JSONL_PATH)
+    raise ValueError(f"Unknown metrics sink {kind!r}")
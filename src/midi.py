@@ -3,20 +3,32 @@ This module generates MIDI files based on the extracted EEG features.
 - It maps the features to musical parameters such as tempo, scale, root note, 
     and rhythmic complexity, then creates short melodies that reflect the underlying 
     brain activity patterns.
+- midi() makes one track per set. midi_catalogue() makes one per segment: the feature vectors
+    for every segment are computed in one pass, and the melodies are generated and rendered in a
+    process pool, each with its own seed taken from the segment id.
 """
 
+import io
+import json
+import os
 import random
+import time
+import zlib
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 from midiutil import MIDIFile
 
-from features import features
-from variables import SET_LABELS, MIDI_OUTPUT_DIR
+from feature_store import segment_features, many_segment_features
+from features import FEATURE_NAMES
+from variables import SET_LABELS, MIDI_OUTPUT_DIR, MIDI_CATALOGUE_DIR, MIDI_WORKERS
 
 SET_NAMES = list(SET_LABELS.keys())
+MIDI_FEATURES = FEATURE_NAMES  # Looked up by name, so features can be added without breaking the mapping
 
-def generate_midi_vectors(segments):
+def generate_midi_vectors(segments, store=None):
     """
     Generate MIDI feature vectors for each class based on the first segment seen for that class.
+    Each vector is a dict of feature name -> value.
     """
     # Get the first segment seen for each class
     # (we don't know what name the first files are because they have
@@ -34,9 +46,10 @@ def generate_midi_vectors(segments):
     midi_vectors = {}
 
     for name, seg in first_segments.items():
-        feats = features(seg["signal"])
+        # One feature vector for the whole segment (window_size=None)
+        feats = segment_features(seg["signal"], window_size=None, store=store, feature_names=MIDI_FEATURES)[0][0]
 
-        midi_vectors[name] = feats
+        midi_vectors[name] = {feature: float(value) for feature, value in zip(MIDI_FEATURES, feats)}
 
     return midi_vectors
 
@@ -60,8 +73,13 @@ RMS_MAX = 250.0
 def features_to_musical_params(fv):
     """
     Generates values for a set of musical parameters based on a feature vector
+    (a dict of feature name -> value)
     """
-    delta, _, _, beta, gamma, entropy, rms = fv
+    delta   = fv["delta_power_norm"]
+    beta    = fv["beta_power_norm"]
+    gamma   = fv["gamma_power_norm"]
+    entropy = fv["entropy"]
+    rms     = fv["rms"]
 
     # Gotta normalise RMS to a 0-1 range for it to be useful
     rms_norm = max(0.0, min(1.0, (rms - RMS_MIN) / (RMS_MAX - RMS_MIN)))
@@ -133,85 +151,115 @@ def features_to_musical_params(fv):
 # ---------------------------------------------------------------------------
 # Melody generator
 # ---------------------------------------------------------------------------
+class Melody:
+    """
+    Melody generator state: its own random.Random(seed) plus the current scale position.
+    notes() can be called again with new parameters to carry on the same melody (see sonify.py).
+    """
+
+    def __init__(self, seed=123):
+        self.rng = random.Random(seed)
+        self.scale_idx = 0
+        self.last_idx = 0
+
+    def notes(self, params, beat, end):
+        """
+        Notes starting from `beat` until `end` (in beats).
+        Returns (list of (beat, pitch, duration, velocity), the beat the next note would start at).
+        """
+        rng = self.rng
+
+        scale       = params["scale"]
+        root        = params["root"]
+        base_dur    = params["base_duration"]
+        vel_base    = params["base_velocity"]
+        vel_var     = params["velocity_variance"]
+        rest_prob   = params["rest_probability"]
+        rep_prob    = params["repeat_probability"]
+        max_jump    = params["max_scale_jump"]
+        entropy     = params["entropy"]
+
+        notes       = []
+        # The scale may have shrunk since the last call
+        scale_idx   = min(self.scale_idx, len(scale) * 2 - 1)
+        last_idx    = min(self.last_idx, len(scale) * 2 - 1)
+
+        while beat < end:
+            # Decide on a rest
+            if rng.random() < rest_prob:
+                beat += base_dur * rng.choice([0.5, 1.0])
+                continue
+
+            # Choose next pitch: repeat last or move by jump
+            if rng.random() < rep_prob:
+                scale_idx = last_idx
+            else:
+                jump = rng.randint(-max_jump, max_jump)
+                scale_idx = max(0, min(len(scale) * 2 - 1, scale_idx + jump))
+
+            # Get MIDI pitch using scale and root, allowing for octave shifts
+            last_idx = scale_idx
+            octave_shift = (scale_idx // len(scale)) * 12
+            degree = scale[scale_idx % len(scale)]
+            pitch = root + degree + octave_shift
+            pitch = max(21, min(108, pitch))  # Keep within MIDI range
+
+            # Duration variation based on entropy
+            if entropy < 0.55:
+                dur_mult = rng.choice([1.0, 1.0, 1.0, 0.5, 2.0])
+            else:
+                dur_mult = rng.choice([0.25, 0.5, 0.5, 1.0, 1.0, 1.5, 2.0])
+
+            duration = max(0.1, base_dur * dur_mult)
+
+            # Velocity with variance
+            velocity = vel_base + rng.randint(-vel_var, vel_var)
+            velocity = max(20, min(127, velocity))
+
+            # Append the note
+            notes.append((beat, pitch, duration, velocity))
+            beat += duration
+
+        self.scale_idx, self.last_idx = scale_idx, last_idx
+        return notes, beat
+
+
 def generate_melody(params, num_bars=4, time_sig=4, seed=123):
     """
     Generate a short melody using the musical parameters.
     Returns a list of (beat, pitch, duration, velocity) note events.
+    Uses its own random.Random(seed), so melodies can be generated in parallel.
     """
-    random.seed(seed)
-
-    scale       = params["scale"]
-    root        = params["root"]
-    base_dur    = params["base_duration"]
-    vel_base    = params["base_velocity"]
-    vel_var     = params["velocity_variance"]
-    rest_prob   = params["rest_probability"]
-    rep_prob    = params["repeat_probability"]
-    max_jump    = params["max_scale_jump"]
-    entropy     = params["entropy"]
-
-    notes       = []
-    beat        = 0.0
-    total_beats = num_bars * time_sig
-    scale_idx   = 0
-    last_idx    = 0
-
-    while beat < total_beats:
-        # Decide on a rest
-        if random.random() < rest_prob:
-            beat += base_dur * random.choice([0.5, 1.0])
-            continue
-
-        # Choose next pitch: repeat last or move by jump
-        if random.random() < rep_prob:
-            scale_idx = last_idx
-        else:
-            jump = random.randint(-max_jump, max_jump)
-            scale_idx = max(0, min(len(scale) * 2 - 1, scale_idx + jump))
-
-        # Get MIDI pitch using scale and root, allowing for octave shifts
-        last_idx = scale_idx
-        octave_shift = (scale_idx // len(scale)) * 12
-        degree = scale[scale_idx % len(scale)]
-        pitch = root + degree + octave_shift
-        pitch = max(21, min(108, pitch))  # Keep within MIDI range
-
-        # Duration variation based on entropy
-        if entropy < 0.55:
-            dur_mult = random.choice([1.0, 1.0, 1.0, 0.5, 2.0])
-        else:
-            dur_mult = random.choice([0.25, 0.5, 0.5, 1.0, 1.0, 1.5, 2.0])
-
-        duration = max(0.1, base_dur * dur_mult)
-
-        # Velocity with variance
-        velocity = vel_base + random.randint(-vel_var, vel_var)
-        velocity = max(20, min(127, velocity))
-
-        # Append the note
-        notes.append((beat, pitch, duration, velocity))
-        beat += duration
-
+    notes, _ = Melody(seed).notes(params, 0.0, num_bars * time_sig)
     return notes
 
 
 # ---------------------------------------------------------------------------
 # Write MIDI file
 # ---------------------------------------------------------------------------
-def create_midi(name, params, notes, filename):
+def midi_bytes(name, params, notes):
     """
-    Create the midi file
+    The MIDI file for a melody, as bytes
     """
     mid = MIDIFile(1)
     mid.addTempo(0, 0, params["tempo"])
     mid.addTrackName(0, 0, name)
-    for (time, pitch, duration, velocity) in notes:
-        mid.addNote(0, 0, pitch, time, duration, velocity)
+    for (beat, pitch, duration, velocity) in notes:
+        mid.addNote(0, 0, pitch, beat, duration, velocity)
+    buf = io.BytesIO()
+    mid.writeFile(buf)
+    return buf.getvalue()
+
+
+def create_midi(name, params, notes, filename):
+    """
+    Create the midi file
+    """
     with open(filename, "wb") as f:
-        mid.writeFile(f)
+        f.write(midi_bytes(name, params, notes))
     print(f"  Saved: {filename}")
 
-def midi(segments):
+def midi(segments, out_dir=MIDI_OUTPUT_DIR, store=None):
     """
     Accepts EEG segments, maps EEG features to musical qualities and then
     creates MIDI files using these qualities 
@@ -219,7 +267,7 @@ def midi(segments):
 
     print("Generating MIDI tracks from EEG features...")
 
-    midi_vectors = generate_midi_vectors(segments)
+    midi_vectors = generate_midi_vectors(segments, store)
 
     print("\nMIDI feature vectors:")
     print(midi_vectors)
@@ -237,7 +285,77 @@ def midi(segments):
 
         # Generate notes and save to output dir
         notes = generate_melody(params, num_bars=4)
-        out_dir = Path(MIDI_OUTPUT_DIR)
-        out_dir.mkdir(parents=True, exist_ok=True)
-        filename = out_dir / f"{label}.mid"
+        out_path = Path(out_dir)
+        out_path.mkdir(parents=True, exist_ok=True)
+        filename = out_path / f"{label}.mid"
         create_midi(label, params, notes, filename)
+
+
+# ---------------------------------------------------------------------------
+# Catalogue: one track per segment
+# ---------------------------------------------------------------------------
+def segment_seed(segment_id):
+    """
+    Melody seed for a segment. Stable across runs and processes (unlike hash())
+    """
+    return zlib.crc32(str(segment_id).encode())
+
+
+def _render_track(job):
+    """
+    Worker: melody + MIDI bytes for one segment
+    """
+    name, params, seed = job
+    return midi_bytes(name, params, generate_melody(params, num_bars=4, seed=seed))
+
+
+def midi_catalogue(segments, out_dir=MIDI_CATALOGUE_DIR, workers=MIDI_WORKERS, store=None):
+    """
+    One MIDI file per segment, plus an index.json of each track's musical parameters.
+    Returns the index.
+    """
+    segments = list(segments)
+    out_path = Path(out_dir)
+    out_path.mkdir(parents=True, exist_ok=True)
+    print(f"Generating a MIDI catalogue of {len(segments)} segments...")
+    start = time.perf_counter()
+
+    # Every segment's feature vector in one pass
+    feats = many_segment_features([s["signal"] for s in segments], window_size=None,
+                                  feature_names=MIDI_FEATURES, store=store)
+    params = [features_to_musical_params(dict(zip(MIDI_FEATURES, f[0].tolist()))) for f, _ in feats]
+    jobs = [(s["segment_id"], p, segment_seed(s["segment_id"])) for s, p in zip(segments, params)]
+
+    workers = workers or os.cpu_count() or 1
+    if workers <= 1:
+        tracks = map(_render_track, jobs)
+    else:
+        pool = ProcessPoolExecutor(workers)
+        tracks = pool.map(_render_track, jobs, chunksize=max(1, len(jobs) // (workers * 4)))
+
+    index = []
+    try:
+        for seg, p, (name, _, seed), data in zip(segments, params, jobs, tracks):
+            with open(out_path / f"{name}.mid", "wb", buffering=len(data) + 1) as f:
+                f.write(data)  # one write per file
+            index.append({
+                "segment_id": name,
+                "set_name": seg["set_name"],
+                "label": seg["label"],
+                "seed": seed,
+                "tempo": p["tempo"],
+                "scale": p["scale_name"],
+                "root": p["root"],
+                "bytes": len(data),
+            })
+    finally:
+        if workers > 1:
+            pool.shutdown()
+
+    with open(out_path / "index.json", "w", encoding="utf-8") as f:
+        json.dump(index, f, indent=1)
+
+    elapsed = time.perf_counter() - start
+    print(f"Wrote {len(index)} tracks to {out_path} in {elapsed:.2f}s "
+          f"({len(index) / elapsed:.0f} tracks/s, {workers} workers)")
+    return index
@@ -0,0 +1,336 @@
+"""
+Concurrent monitoring of many EEG channels/patients with asyncio.
+- Each stream has its own ring buffer (OnlineFeatures) and consecutive-detection state (AlertState).
+- Samples can be pushed into any stream at any time. Finished windows from every stream go into one
+    InferenceEngine and are scored together on the next tick (or sooner if the batch fills up).
+- Events and alerts are passed to per-stream async callbacks.
+- Optionally records per-window timings, lag and alerts in a DetectorMetrics (see metrics.py).
+- Scores through a registry.ModelHandle, so the model can be swapped without stopping ingestion.
+    watch_registry() polls the model registry and swaps to each newly promoted version: the new
+    model is loaded and warmed up in a worker thread while streams keep going, then switched
+    to between two batches. Every stream keeps its buffer and consecutive count across the swap.
+- Has a demo that replays N test segments at once at SIMULATED_SPEED and reports throughput,
+    and one that swaps the model halfway through such a replay.
+"""
+
+import asyncio
+import time
+
+import numpy as np
+
+from inference import InferenceEngine
+from registry import ModelHandle
+from streamer import OnlineFeatures, AlertState
+
+from variables import SIMULATED_SPEED, SAMPLING_RATE, STEP_SIZE, MODEL_RELOAD_INTERVAL
+
+
+class _Stream:
+    """
+    Per-stream state kept by the server
+    """
+
+    def __init__(self, stream_id, on_event, on_alert):
+        self.stream_id = stream_id
+        self.features = OnlineFeatures()
+        self.state = AlertState()
+        self.on_event = on_event
+        self.on_alert = on_alert
+        self.alerts = 0
+
+
+class MonitorServer:
+    """
+    Runs any number of streams in one event loop, batching inference across streams every tick.
+    """
+
+    def __init__(self, model, tick=None, batch_size=1024, metrics=None):
+        # model can be a ModelHandle shared with other servers/detectors
+        self.handle = model if isinstance(model, ModelHandle) else ModelHandle(model, warmup=False)
+        self.metrics = metrics
+        # Default tick is one hop of real time (scaled by SIMULATED_SPEED)
+        self.tick = tick if tick is not None else (STEP_SIZE / SAMPLING_RATE) / SIMULATED_SPEED
+        self.engine = InferenceEngine(self.handle, batch_size=batch_size, max_latency=self.tick)
+        # So the first full batch after a swap isn't the one that pays for warming up
+        self.handle.add_warmup_batch(batch_size)
+        self.streams = {}
+        self._scored = []   # (result, inference seconds) the engine returned early because a batch filled up
+
+        self.windows_scored = 0
+        self.predict_time = 0.0
+        self.swap_log = []  # {version, load_s, warmup_s, at} for every swap done by watch_registry
+
+    @property
+    def model(self):
+        return self.handle.model
+
+    def add_stream(self, stream_id, on_event=None, on_alert=None):
+        """
+        Register a stream. on_event/on_alert are async callbacks that get an event dict:
+        {stream_id, window, prob, prediction, consecutive, alert, latency, model_version}
+        """
+        if stream_id in self.streams:
+            raise ValueError(f"Stream {stream_id!r} already exists")
+        self.streams[stream_id] = _Stream(stream_id, on_event, on_alert)
+
+    def remove_stream(self, stream_id):
+        """
+        Stop monitoring a stream (anything still pending for it is dropped)
+        """
+        self.streams.pop(stream_id, None)
+
+    def push(self, stream_id, samples):
+        """
+        Add samples to a stream. Features for completed windows are computed now,
+        the model is only run on the next tick.
+        """
+        stream = self.streams[stream_id]
+        start = time.perf_counter()
+        feats = stream.features.push(samples)
+        if len(feats) == 0:
+            return
+        feature_s = (time.perf_counter() - start) / len(feats)
+        first = stream.features.windows_done - len(feats)
+        for i, row in enumerate(feats):
+            self._scored.extend(self._timed(self.engine.submit, row, (stream_id, first + i, feature_s)))
+
+    def _timed(self, fn, *args):
+        """
+        Call an engine method, keeping track of time spent in the model.
+        Returns the engine's results, each paired with its share of the batch's scoring time
+        and the model version that scored it (swaps only happen between calls, on the event loop).
+        """
+        results = fn(*args)
+        if not results:
+            return []
+        self.predict_time += self.engine.last_batch_seconds
+        inference_s = self.engine.last_batch_seconds / len(results)
+        version = self.handle.version
+        return [(result, inference_s, version) for result in results]
+
+    async def process_pending(self):
+        """
+        Score every window still waiting in the engine in one call, then update each
+        stream's state in window order and run its callbacks.
+        """
+        results = self._scored + self._timed(self.engine.flush)
+        self._scored = []
+        if not results:
+            return
+        self.windows_scored += len(results)
+
+        callbacks = []
+        for ((stream_id, window, feature_s), prob, latency), inference_s, version in results:
+            stream = self.streams.get(stream_id)
+            if stream is None:
+                continue
+            prediction, consecutive, alert = stream.state.update(prob)
+            event = {
+                "stream_id": stream_id,
+                "window": window,
+                "prob": prob,
+                "prediction": prediction,
+                "consecutive": consecutive,
+                "alert": alert,
+                "latency": latency,
+                "model_version": version,
+            }
+            if self.metrics is not None:
+                self.metrics.record(feature_s, inference_s, latency, prob, prediction, alert, stream_id)
+            if stream.on_event:
+                callbacks.append(stream.on_event(event))
+            if alert:
+                stream.alerts += 1
+                if stream.on_alert:
+                    callbacks.append(stream.on_alert(event))
+
+        if callbacks:
+            await asyncio.gather(*callbacks)
+
+    async def run(self, stop):
+        """
+        Tick until the stop event is set, then score whatever is left
+        """
+        while not stop.is_set():
+            try:
+                await asyncio.wait_for(stop.wait(), timeout=self.tick)
+            except asyncio.TimeoutError:
+                pass
+            await self.process_pending()
+        await self.process_pending()
+
+    async def watch_registry(self, registry, stop, interval=MODEL_RELOAD_INTERVAL):
+        """
+        Swap to the registry's current version whenever it changes, until the stop event is set.
+        Loading and warm-up run in a worker thread, so ticks and pushes carry on meanwhile.
+        """
+        refused = set()
+        while not stop.is_set():
+            version = registry.current()
+            if version is not None and version != self.handle.version and version not in refused:
+                start = time.perf_counter()
+                try:
+                    prepared = await asyncio.to_thread(self.handle.prepare_version, registry, version)
+                except (OSError, KeyError, ValueError) as e:
+                    refused.add(version)
+                    print(f"  Not swapping to model {version}: {e}")
+                else:
+                    self.handle.install(prepared)
+                    self.swap_log.append({
+                        "version": version,
+                        "load_s": time.perf_counter() - start,
+                        "warmup_s": prepared["warmup_s"],
+                        "at": time.perf_counter(),
+                    })
+                    print(f"  Swapped to model {version} (loaded and warmed up in "
+                          f"{self.swap_log[-1]['load_s'] * 1000:.0f}ms without pausing the streams)")
+            try:
+                await asyncio.wait_for(stop.wait(), timeout=interval)
+            except asyncio.TimeoutError:
+                pass
+
+
+async def replay_segment(server, stream_id, signal, speed=SIMULATED_SPEED):
+    """
+    Feed a recorded signal into a stream STEP_SIZE samples at a time, at speed x real time
+    """
+    sleep_time = (STEP_SIZE / SAMPLING_RATE) / speed
+    for start in range(0, len(signal), STEP_SIZE):
+        server.push(stream_id, signal[start:start + STEP_SIZE])
+        await asyncio.sleep(sleep_time)
+
+
+async def _monitor(test_segs, model, n_streams, metrics):
+    """
+    Replay n_streams test segments concurrently through one MonitorServer
+    """
+    server = MonitorServer(model, metrics=metrics)
+
+    async def on_alert(event):
+        print(f"  🚨  {event['stream_id']}: SEIZURE ALERT at window {event['window']+1}")
+
+    feeders = []
+    for i in range(n_streams):
+        seg = test_segs[i % len(test_segs)]
+        stream_id = f"{i:03d}-{seg['segment_id']}"
+        server.add_stream(stream_id, on_alert=on_alert)
+        feeders.append(replay_segment(server, stream_id, seg["signal"]))
+
+    stop = asyncio.Event()
+    server_task = asyncio.create_task(server.run(stop))
+
+    start = time.perf_counter()
+    await asyncio.gather(*feeders)
+    stop.set()
+    await server_task
+    elapsed = time.perf_counter() - start
+
+    return server, elapsed
+
+
+def monitor_demo(test_segs, model, n_streams=100, metrics=None):
+    """
+    Monitors n_streams test segments at the same time (cycling through the test set
+    if there are more streams than segments) and reports throughput
+    """
+    print("\n" + "=" * 50)
+    print(f"Concurrent Monitoring Demo ({n_streams} streams, {SIMULATED_SPEED}x real time)")
+    print("=" * 50)
+
+    server, elapsed = asyncio.run(_monitor(test_segs, model, n_streams, metrics))
+
+    alerts = sum(s.alerts for s in server.streams.values())
+    latency = server.engine.latency_summary()
+    print(f"\nScored {server.windows_scored} windows from {len(server.streams)} streams "
+          f"in {elapsed:.2f}s ({server.windows_scored / elapsed:.0f} windows/s)")
+    print(f"  {server.engine.batches} model calls, "
+          f"{server.windows_scored / max(server.engine.batches, 1):.1f} windows per call, "
+          f"{server.predict_time:.2f}s spent in the model")
+    if latency:
+        print(f"  Window latency: p50={latency['p50_ms']:.1f}ms p99={latency['p99_ms']:.1f}ms "
+              f"max={latency['max_ms']:.1f}ms")
+    print(f"  {alerts} alerts raised")
+    if metrics is not None:
+        metrics.flush()
+        print(f"  Metrics: {metrics.summary()}")
+
+
+async def _hot_swap(test_segs, registry, base, challenger, n_streams):
+    """
+    Replay n_streams test segments through a server watching the registry,
+    and promote the challenger halfway through
+    """
+    server = MonitorServer(ModelHandle.from_registry(registry, base))
+    events = {}
+
+    async def on_event(event):
+        events.setdefault(event["stream_id"], []).append(event)
+
+    feeders = []
+    for i in range(n_streams):
+        seg = test_segs[i % len(test_segs)]
+        stream_id = f"{i:03d}-{seg['segment_id']}"
+        server.add_stream(stream_id, on_event=on_event)
+        feeders.append(replay_segment(server, stream_id, seg["signal"]))
+
+    async def promote_halfway():
+        duration = min(len(test_segs[i % len(test_segs)]["signal"]) for i in range(n_streams))
+        await asyncio.sleep(duration / SAMPLING_RATE / SIMULATED_SPEED / 2)
+        print(f"  Promoting {challenger}...")
+        registry.promote(challenger)
+
+    stop = asyncio.Event()
+    tasks = [asyncio.create_task(server.run(stop)),
+             asyncio.create_task(server.watch_registry(registry, stop, interval=server.tick))]
+    await asyncio.gather(promote_halfway(), *feeders)
+    stop.set()
+    await asyncio.gather(*tasks)
+    return server, events
+
+
+def hot_swap_demo(train_segs, test_segs, model, n_streams=100):
+    """
+    Swaps the model of a running MonitorServer halfway through a replay, and checks that
+    no window was dropped or scored twice and what the swap did to latency
+    """
+    from classifier import window_features, build_pipeline
+    from registry import ModelRegistry, register_model
+
+    print("\n" + "=" * 50)
+    print(f"Hot Model Swap Demo ({n_streams} streams, {SIMULATED_SPEED}x real time)")
+    print("=" * 50)
+
+    registry = ModelRegistry()
+    base = register_model(model, train_segs, registry=registry)
+    # A smaller forest as the challenger. Fixed seed, so reruns find it already registered
+    challenger_model = build_pipeline(n_estimators=50, random_state=0)
+    challenger_model.fit(*window_features(train_segs))
+    challenger = register_model(challenger_model, train_segs, registry=registry, promote=False)
+    registry.promote(base)
+    print(f"Starting on {base}, {challenger} is promoted halfway through")
+
+    try:
+        server, events = asyncio.run(_hot_swap(test_segs, registry, base, challenger, n_streams))
+    finally:
+        registry.promote(base)
+
+    by_version = {}
+    for stream_events in events.values():
+        for event in stream_events:
+            by_version.setdefault(event["model_version"], []).append(event["latency"])
+    # Every stream should see windows 0..n-1 once each, in order, whichever model scored them
+    gaps = sum(
+        [e["window"] for e in stream_events] != list(range(server.streams[s].features.windows_done))
+        for s, stream_events in events.items()
+    )
+
+    print(f"\nScored {server.windows_scored} windows from {len(server.streams)} streams")
+    for version, latencies in by_version.items():
+        latencies = np.array(latencies) * 1000
+        print(f"  {version}: {len(latencies)} windows, latency p50={np.percentile(latencies, 50):.1f}ms "
+              f"p99={np.percentile(latencies, 99):.1f}ms max={latencies.max():.1f}ms")
+    for swap in server.swap_log:
+        print(f"  Swap to {swap['version']}: loaded in {swap['load_s'] * 1000:.0f}ms "
+              f"(warm-up {swap['warmup_s'] * 1000:.0f}ms), done off the event loop")
+    print(f"  {len(events) - gaps}/{len(events)} streams kept every window in order across the swap")
+    return {"by_version": {v: len(l) for v, l in by_version.items()}, "swaps": server.swap_log, "gaps": gaps}
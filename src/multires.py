@@ -0,0 +1,156 @@
+"""
+Multi-resolution features: the same 7 features for several window lengths at once
+(MULTIRES_WINDOWS, e.g. 0.5 s, 1 s and 4 s), all ending at the same decision times.
+- The signal's short-time spectrum is computed once: periodograms of MULTIRES_NPERSEG-sample frames
+    every MULTIRES_HOP samples. Each resolution's Welch PSD is the mean of the frames inside its
+    window, taken from a running sum over frames, so no resolution reruns Welch.
+- The frame grid is offset by frame_offset() samples so that frames end exactly at decision times.
+    MULTIRES_HOP divides STEP_SIZE, so every decision time is the end of a frame, each window
+    averages the newest frames, and every window at a resolution averages the same number of frames.
+- Decisions are on the usual window grid: decision i is made when window i (of WINDOW_SIZE, every
+    STEP_SIZE) ends. The first few are skipped, until the longest window has enough signal.
+- The feature blocks are concatenated (7 * number of resolutions) and fed to their own classifier.
+"""
+
+from pathlib import Path
+import pickle
+
+import numpy as np
+
+from features import periodograms, spectral_features, FEATURE_NAMES
+from windows import window_view
+
+from variables import (SAMPLING_RATE, WINDOW_SIZE, STEP_SIZE, MULTIRES_WINDOWS, MULTIRES_NPERSEG,
+                       MULTIRES_HOP, MULTIRES_MODEL_PATH)
+
+
+def multires_feature_names(windows=MULTIRES_WINDOWS):
+    return [f"{name}_{w}" for w in windows for name in FEATURE_NAMES]
+
+
+def frame_offset(window_size=WINDOW_SIZE, nperseg=MULTIRES_NPERSEG, hop=MULTIRES_HOP):
+    """
+    Where the first frame starts, so frame ends land on the decision times (window_size + i * step_size)
+    """
+    return (window_size - nperseg) % hop
+
+
+def frame_ranges(ends, window_size, nperseg=MULTIRES_NPERSEG, hop=MULTIRES_HOP, offset=0):
+    """
+    First and last+1 frame that fit inside each window [end - window_size, end),
+    with frame k covering [offset + k * hop, offset + k * hop + nperseg)
+    """
+    lo = -((window_size + offset - ends) // hop)  # ceil((end - window_size - offset) / hop)
+    hi = (ends - nperseg - offset) // hop + 1
+    if np.any(hi <= lo):
+        raise ValueError(f"A {window_size}-sample window doesn't fit a whole {nperseg}-sample frame")
+    return lo, hi
+
+
+def multires_features(signal, windows=MULTIRES_WINDOWS, nperseg=MULTIRES_NPERSEG, hop=MULTIRES_HOP,
+                      window_size=WINDOW_SIZE, step_size=STEP_SIZE):
+    """
+    Multi-resolution features for one signal.
+    Returns (features (n_decisions, 7 * len(windows)), window_index), where window_index is the
+    index of the ordinary window each decision lines up with.
+    """
+    signal = np.asarray(signal, dtype=np.float64)
+    n_feats = len(FEATURE_NAMES) * len(windows)
+
+    # Decision i happens when ordinary window i ends
+    n_windows = len(window_view(signal, window_size, step_size))
+    ends = np.arange(n_windows) * step_size + window_size
+    keep = ends >= max(windows)
+    ends, window_index = ends[keep], np.flatnonzero(keep)
+    if len(ends) == 0:
+        return np.empty((0, n_feats)), window_index
+
+    # Shared short-time spectrum, with a running sum over frames (row k = sum of frames before k)
+    offset = frame_offset(window_size, nperseg, hop)
+    frames = periodograms(window_view(signal[offset:], nperseg, hop))
+    cumulative = np.concatenate([np.zeros((1, frames.shape[1])), np.cumsum(frames, axis=0)])
+    freqs = np.fft.rfftfreq(nperseg, 1.0 / SAMPLING_RATE)
+
+    blocks = []
+    for w in windows:
+        lo, hi = frame_ranges(ends, w, nperseg, hop, offset)
+        psd = (cumulative[hi] - cumulative[lo]) / (hi - lo)[:, None]
+        rms = np.sqrt(np.mean(window_view(signal, w, 1)[ends - w] ** 2, axis=-1))
+        blocks.append(np.column_stack([spectral_features(freqs, psd, nperseg), rms]))
+
+    return np.concatenate(blocks, axis=1), window_index
+
+
+def multires_matrix(segments, store=None):
+    """
+    Like feature_store.window_matrix, with the multi-resolution features
+    """
+    from feature_store import window_matrix
+    return window_matrix(segments, store=store, resolutions=MULTIRES_WINDOWS)
+
+
+def train_multires(train_segs, model_path=MULTIRES_MODEL_PATH, store=None):
+    """
+    Train the scaler + Random Forest pipeline on the multi-resolution features
+    """
+    from classifier import build_pipeline
+
+    print("Training multi-resolution classifier...")
+    matrix = multires_matrix(train_segs, store)
+    pipeline = build_pipeline()
+    pipeline.fit(matrix["X"], matrix["y"])
+
+    with open(model_path, "wb") as f:
+        pickle.dump(pipeline, f)
+    print(f"Multi-resolution model saved to {model_path}")
+    return pipeline
+
+
+def evaluate_multires(model, test_segs, store=None):
+    """
+    Window, segment and alert level metrics for the multi-resolution model
+    """
+    from evaluation import binary_metrics, score_recordings, print_report
+    from inference import fast_scorer
+
+    test_segs = list(test_segs)
+    matrix = multires_matrix(test_segs, store)
+    probs = fast_scorer(model).predict_proba(matrix["X"])[:, 1]
+
+    window = binary_metrics(matrix["y"], model.predict(matrix["X"]))
+    print(f"\nMulti-resolution ({', '.join(f'{w / SAMPLING_RATE:.1f}s' for w in MULTIRES_WINDOWS)}) "
+          f"window level: TN {window['tn']}  FP {window['fp']}  FN {window['fn']}  TP {window['tp']}")
+
+    counts = [np.sum(matrix["segment_id"] == s["segment_id"]) for s in test_segs]
+    first = [int(matrix["window_index"][matrix["segment_id"] == s["segment_id"]][0]) if c else 0
+             for s, c in zip(test_segs, counts)]
+    metrics = score_recordings(np.split(probs, np.cumsum(counts)[:-1]),
+                               [s["label"] for s in test_segs],
+                               [len(s["signal"]) for s in test_segs],
+                               first_windows=first)
+    print_report(metrics)
+
+    forest = getattr(model, "named_steps", {}).get("clf")
+    if hasattr(forest, "feature_importances_"):
+        importance = dict(zip(multires_feature_names(), forest.feature_importances_))
+        by_window = {w: sum(v for k, v in importance.items() if k.endswith(f"_{w}")) for w in MULTIRES_WINDOWS}
+        print("Importance by window length: "
+              + ", ".join(f"{w / SAMPLING_RATE:.1f}s {v:.2f}" for w, v in by_window.items()))
+        top = sorted(importance.items(), key=lambda item: -item[1])[:5]
+        print("Most important features: " + ", ".join(f"{name} {v:.3f}" for name, v in top))
+    return metrics
+
+
+def multires_classifier(train_segs, test_segs):
+    """
+    Loads the multi-resolution model if it exists (trains it if not), then evaluates it
+    """
+    if Path(MULTIRES_MODEL_PATH).exists():
+        print(f"Loading existing multi-resolution model from {MULTIRES_MODEL_PATH}...")
+        with open(MULTIRES_MODEL_PATH, "rb") as f:
+            model = pickle.load(f)
+    else:
+        model = train_multires(train_segs)
+
+    evaluate_multires(model, test_segs)
+    return model
@@ -0,0 +1,117 @@
+"""
+Checks how far the compact data paths move from the float64 one, to pick CACHE_DTYPE and FEATURE_DTYPE.
+- Storage: signals as float64 (8 bytes per sample), float32 (4) or int16 (2). The Bonn samples are
+    whole numbers well inside the int16 range, so int16 (and float32) storage is lossless for them.
+- Features: computed in float64 or float32. float32 halves the windows, PSDs and feature matrices.
+- precision_report() runs each (storage, features) mode over the same segments and compares every
+    window's features and P(seizure) with the float64 path: the largest error of each feature
+    (relative to that feature's largest value), window predictions that flip at PROB_THRESHOLD,
+    and segments whose alerts move.
+"""
+
+import time
+
+import numpy as np
+
+from feature_store import compute_features_many, feature_config
+from features import FEATURE_NAMES
+from inference import fast_scorer
+from replay import alert_windows
+
+from variables import PROB_THRESHOLD, ALERT_THRESHOLD
+
+# (storage dtype, feature dtype), the first one is the reference
+PRECISION_MODES = (
+    ("float64", "float64"),
+    ("float32", "float32"),
+    ("int16", "float32"),
+    ("int16", "float64"),
+)
+
+
+def store_signal(signal, dtype):
+    """
+    The signal as it would be stored in dtype, and the largest sample error that causes
+    """
+    signal = np.asarray(signal, dtype=np.float64)
+    stored = signal.astype(dtype)
+    error = float(np.max(np.abs(stored - signal))) if len(signal) else 0.0
+    return stored, error
+
+
+def run_mode(signals, scorer, storage, feature_dtype):
+    """
+    Features and P(seizure) for every window, with signals stored as `storage` and
+    features computed in `feature_dtype`
+    """
+    stored = [store_signal(signal, storage) for signal in signals]
+    start = time.perf_counter()
+    feats = compute_features_many([s for s, _ in stored], feature_config(dtype=feature_dtype))
+    seconds = time.perf_counter() - start
+
+    X = np.concatenate([f for f, _ in feats])
+    probs = scorer.predict_proba(X)[:, 1]
+    return {
+        "X": X,
+        "probs": np.split(probs, np.cumsum([len(f) for f, _ in feats])[:-1]),
+        "feature_seconds": seconds,
+        "storage_error": max((error for _, error in stored), default=0.0),
+    }
+
+
+def precision_report(segments, model, modes=PRECISION_MODES):
+    """
+    Compare each mode with the first one (float64 storage and features). Returns one dict per mode.
+    """
+    print("\n" + "=" * 50)
+    print("Precision modes against float64")
+    print("=" * 50)
+
+    signals = [s["signal"] for s in segments]
+    scorer = fast_scorer(model)
+    compute_features_many(signals[:1], feature_config())  # so the first mode isn't timed with scipy's imports
+    reference = None
+    rows = []
+    for storage, feature_dtype in modes:
+        result = run_mode(signals, scorer, storage, feature_dtype)
+        if reference is None:
+            reference = result
+        X, ref_X = result["X"], reference["X"]
+        scale = np.max(np.abs(ref_X), axis=0) + 1e-12
+        rel_error = np.max(np.abs(X.astype(np.float64) - ref_X), axis=0) / scale
+
+        probs = np.concatenate(result["probs"])
+        ref_probs = np.concatenate(reference["probs"])
+        moved = sum(
+            not np.array_equal(alert_windows(p >= PROB_THRESHOLD, ALERT_THRESHOLD),
+                               alert_windows(r >= PROB_THRESHOLD, ALERT_THRESHOLD))
+            for p, r in zip(result["probs"], reference["probs"])
+        )
+        rows.append({
+            "storage": storage,
+            "features": feature_dtype,
+            "bytes_per_sample": np.dtype(storage).itemsize,
+            "storage_max_error": result["storage_error"],
+            "bytes_per_window": X.shape[1] * X.dtype.itemsize,
+            "feature_us_per_window": result["feature_seconds"] / len(X) * 1e6,
+            "feature_rel_error": dict(zip(FEATURE_NAMES, rel_error.tolist())),
+            "prob_max_error": float(np.max(np.abs(probs - ref_probs))),
+            "prob_mean_error": float(np.mean(np.abs(probs - ref_probs))),
+            "prediction_flips": int(np.sum((probs >= PROB_THRESHOLD) != (ref_probs >= PROB_THRESHOLD))),
+            "segments_alerts_moved": int(moved),
+        })
+
+    print(f"{len(reference['X'])} windows from {len(signals)} segments")
+    print(f"  {'storage':>8s} {'features':>8s} {'B/sample':>8s} {'sample err':>10s} {'B/window':>8s} "
+          f"{'us/window':>9s} {'feat err':>9s} {'max dP':>8s} {'flips':>5s} {'alerts moved':>12s}")
+    for r in rows:
+        print(f"  {r['storage']:>8s} {r['features']:>8s} {r['bytes_per_sample']:8d} "
+              f"{r['storage_max_error']:10.2g} {r['bytes_per_window']:8d} {r['feature_us_per_window']:9.2f} "
+              f"{max(r['feature_rel_error'].values()):9.1e} {r['prob_max_error']:8.3f} "
+              f"{r['prediction_flips']:5d} {r['segments_alerts_moved']:12d}")
+
+    print("Largest error of each feature (relative to its largest float64 value):")
+    print(f"  {'feature':18s}" + "".join(f" {r['storage'] + '/' + r['features']:>16s}" for r in rows[1:]))
+    for name in FEATURE_NAMES:
+        print(f"  {name:18s}" + "".join(f" {r['feature_rel_error'][name]:16.1e}" for r in rows[1:]))
+    return rows
@@ -0,0 +1,80 @@
+"""
+Readers for long continuous recordings (hours of EEG in one file) that never load the whole file.
+- Single-column text files are parsed RECORDING_CHUNK_SAMPLES lines at a time.
+- Raw binary files (headerless samples of one dtype) are read in chunks, or memory-mapped
+    so each chunk is just a view.
+- Feed the chunks to windows.chunked_windows to get the same windows as the in-memory path.
+"""
+
+from itertools import islice
+from pathlib import Path
+
+import numpy as np
+
+from variables import RECORDING_CHUNK_SAMPLES, RECORDING_DTYPE
+
+TEXT_SUFFIXES = (".txt", ".csv")
+
+
+def _parse_lines(lines):
+    """
+    Parse a list of text lines as floats, skipping any that aren't numbers (same rules as load_segment)
+    """
+    try:
+        samples = np.loadtxt(lines, dtype=np.float64, ndmin=1)
+        if samples.ndim == 1:
+            return samples
+    except ValueError:
+        pass
+
+    samples = []
+    for line in lines:
+        try:
+            samples.append(float(line.strip()))
+        except ValueError:
+            continue
+    return np.array(samples)
+
+
+def read_text_chunks(path, chunk_samples=RECORDING_CHUNK_SAMPLES):
+    """
+    Yield a single-column text file as float64 arrays of up to chunk_samples samples
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        while True:
+            lines = list(islice(f, chunk_samples))
+            if not lines:
+                return
+            samples = _parse_lines(lines)
+            if len(samples):
+                yield samples
+
+
+def read_binary_chunks(path, dtype=RECORDING_DTYPE, chunk_samples=RECORDING_CHUNK_SAMPLES, mmap=False):
+    """
+    Yield a raw binary file of dtype samples as float64 arrays of up to chunk_samples samples.
+    mmap=True maps the file and converts one chunk at a time, instead of reading each chunk.
+    """
+    dtype = np.dtype(dtype)
+    n = Path(path).stat().st_size // dtype.itemsize
+    if mmap:
+        if n == 0:
+            return
+        samples = np.memmap(path, dtype=dtype, mode="r", shape=(n,))
+        for start in range(0, n, chunk_samples):
+            yield np.asarray(samples[start:start + chunk_samples], dtype=np.float64)
+        return
+
+    with open(path, "rb") as f:
+        for _ in range(0, n, chunk_samples):
+            yield np.fromfile(f, dtype=dtype, count=chunk_samples).astype(np.float64)
+
+
+def read_chunks(path, dtype=RECORDING_DTYPE, chunk_samples=RECORDING_CHUNK_SAMPLES, mmap=False):
+    """
+    Text or binary reader, chosen by file extension
+    """
+    if Path(path).suffix.lower() in TEXT_SUFFIXES:
+        return read_text_chunks(path, chunk_samples)
+    return read_binary_chunks(path, dtype, chunk_samples, mmap)
+
@@ -0,0 +1,292 @@
+"""
+Versioned model registry, and hot swapping the model of a running detector.
+- Every model is stored in MODEL_REGISTRY_DIR as its own version directory (v0001, v0002, ...)
+    holding the pickled pipeline, its flat NumPy export (see forest.py) and meta.json:
+    the feature config it was trained with, a hash of its training data, its forest size and
+    its evaluation metrics. A version is written to a temporary directory and renamed into place,
+    so a half written version is never seen.
+- CURRENT names the version detectors should use. It is replaced atomically by promote().
+- ModelHandle is what detectors score through. swap() builds the new scorer and warms it up
+    with dummy batches first, then replaces the old one in a single assignment, so windows
+    are never scored by a half loaded model and the first real windows don't pay for warm-up.
+    Per-stream state (ring buffers, consecutive counts) lives in the detectors, so it carries
+    straight over to the new model.
+- A model trained with a different feature config than the running detectors is refused.
+"""
+
+import hashlib
+import json
+import os
+import pickle
+import shutil
+import time
+import uuid
+from pathlib import Path
+
+import numpy as np
+
+from feature_store import feature_config
+from inference import fast_scorer
+
+from variables import MODEL_REGISTRY_DIR, INFERENCE_BATCH_SIZE
+
+REGISTRY_VERSION = 1
+WARMUP_BATCHES = (1, INFERENCE_BATCH_SIZE)  # default rows in each dummy batch (servers add their own batch size)
+
+
+def training_data_hash(segments):
+    """
+    Hash of the training segments (ids, labels and samples), whatever dtype they are stored in
+    """
+    h = hashlib.blake2b(digest_size=20)
+    for seg in sorted(segments, key=lambda s: s["segment_id"]):
+        h.update(f"{seg['segment_id']}:{seg['label']}:".encode())
+        h.update(np.ascontiguousarray(seg["signal"], dtype=np.float64).data)
+    return h.hexdigest()
+
+
+def arrays_hash(arrays):
+    """
+    Hash of a dict of arrays (names, dtypes, shapes and contents)
+    """
+    h = hashlib.blake2b(digest_size=20)
+    for key in sorted(arrays):
+        a = np.asarray(arrays[key])
+        h.update(f"{key}:{a.dtype.str}:{a.shape}:".encode())
+        h.update(a.tobytes())
+    return h.hexdigest()
+
+
+def model_hash(model):
+    """
+    Hash of what the model computes: its scaler and tree arrays (see forest.model_arrays).
+    Unlike a hash of the pickle, it's the same for a model and the same model loaded back from disk.
+    """
+    if hasattr(model, "named_steps"):
+        from forest import model_arrays
+        return arrays_hash(model_arrays(model))
+    return hashlib.blake2b(pickle.dumps(model), digest_size=20).hexdigest()
+
+
+def export_hash(path):
+    """
+    model_hash of an exported model, from its .npz file alone
+    """
+    with np.load(path) as arrays:
+        return arrays_hash({key: arrays[key] for key in arrays.files})
+
+
+def model_metadata(model, train_segs, metrics=None, digest=None):
+    """
+    Everything meta.json records about a model, apart from its version and creation time
+    """
+    forest = getattr(model, "named_steps", {}).get("clf")
+    return {
+        "feature_config": feature_config(),
+        "training_data_hash": training_data_hash(train_segs),
+        "training_segments": len(train_segs),
+        "model_hash": digest or model_hash(model),
+        "n_estimators": len(forest.estimators_) if forest is not None else None,
+        "metrics": metrics,
+    }
+
+
+class ModelRegistry:
+    """
+    Model versions on disk, and which one is current
+    """
+
+    def __init__(self, root=MODEL_REGISTRY_DIR):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    def versions(self):
+        return sorted(p.name for p in self.root.glob("v[0-9]*") if (p / "meta.json").exists())
+
+    def metadata(self, version):
+        with open(self.root / version / "meta.json", "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def find(self, digest):
+        """
+        The version holding a model with this hash, if any
+        """
+        for version in self.versions():
+            if self.metadata(version).get("model_hash") == digest:
+                return version
+        return None
+
+    def register(self, model, metadata, promote=True):
+        """
+        Store a new version of a model. Returns its version name
+        """
+        from forest import export_model
+
+        tmp = self.root / f".tmp-{uuid.uuid4().hex}"
+        tmp.mkdir()
+        try:
+            with open(tmp / "model.pkl", "wb") as f:
+                pickle.dump(model, f)
+            if hasattr(model, "named_steps"):
+                export_model(model, tmp / "model.npz", verbose=False)
+
+            # Claim the next free version name; rename fails if another process got there first
+            while True:
+                existing = self.versions()
+                number = int(existing[-1][1:]) + 1 if existing else 1
+                version = f"v{number:04d}"
+                meta = {"registry_version": REGISTRY_VERSION, "version": version, "created": time.time(),
+                        **metadata}
+                with open(tmp / "meta.json", "w", encoding="utf-8") as f:
+                    json.dump(meta, f, indent=1)
+                try:
+                    os.rename(tmp, self.root / version)
+                    break
+                except OSError:
+                    if not (self.root / version).exists():
+                        raise
+        except BaseException:
+            shutil.rmtree(tmp, ignore_errors=True)
+            raise
+
+        print(f"Registered model {version} in {self.root}")
+        if promote:
+            self.promote(version)
+        return version
+
+    def promote(self, version):
+        """
+        Make version the current one
+        """
+        if not (self.root / version / "meta.json").exists():
+            raise KeyError(f"No model version {version!r} in {self.root}")
+        tmp = self.root / f"CURRENT.{uuid.uuid4().hex}.tmp"
+        tmp.write_text(version, encoding="utf-8")
+        os.replace(tmp, self.root / "CURRENT")
+
+    def current(self):
+        path = self.root / "CURRENT"
+        return path.read_text(encoding="utf-8").strip() if path.exists() else None
+
+    def load(self, version=None):
+        """
+        (model, metadata) for a version (default the current one)
+        """
+        version = version or self.current()
+        if version is None:
+            raise KeyError(f"No current model in {self.root}")
+        with open(self.root / version / "model.pkl", "rb") as f:
+            model = pickle.load(f)
+        return model, self.metadata(version)
+
+
+def register_model(model, train_segs, metrics=None, registry=None, promote=True, digest=None):
+    """
+    Register a trained model unless the registry already has it. Returns its version.
+    promote=True makes a newly registered model current (or an already registered one,
+    if nothing is current yet). digest is the model's model_hash, if it is already known.
+    The training data is only hashed for a model that isn't registered yet.
+    """
+    registry = registry or ModelRegistry()
+    digest = digest or model_hash(model)
+    version = registry.find(digest)
+    if version is None:
+        version = registry.register(model, model_metadata(model, train_segs, metrics, digest), promote=promote)
+    elif promote and registry.current() is None:
+        registry.promote(version)
+    return version
+
+
+def warm_up(scorer, batches=WARMUP_BATCHES):
+    """
+    Score dummy batches so the first real windows don't pay for cold caches and lazy setup
+    """
+    n_features = len(scorer.mean) if hasattr(scorer, "mean") else scorer.n_features_in_
+    for rows in batches:
+        scorer.predict_proba(np.zeros((rows, n_features)))
+
+
+class ModelHandle:
+    """
+    The model a running detector scores with. Detectors and InferenceEngines take a handle
+    in place of a model, and always score with whatever model it holds at the time.
+    """
+
+    def __init__(self, model, version=None, metadata=None, warmup=True, warmup_batches=WARMUP_BATCHES):
+        self._current = None
+        self.swaps = 0
+        self.warmup_batches = tuple(warmup_batches)
+        self.install(self.prepare(model, version, metadata, warmup))
+
+    @classmethod
+    def from_registry(cls, registry=None, version=None):
+        registry = registry or ModelRegistry()
+        version = version or registry.current()
+        model, metadata = registry.load(version)
+        return cls(model, version, metadata)
+
+    def add_warmup_batch(self, rows):
+        """
+        Also warm up models swapped in later with a rows-row batch (e.g. a server's batch size)
+        """
+        self.warmup_batches = tuple(sorted(set(self.warmup_batches) | {rows}))
+
+    def prepare(self, model, version=None, metadata=None, warmup=True):
+        """
+        Check and warm up a model without touching the handle (safe to run in another thread).
+        Returns what install() takes.
+        """
+        if metadata is not None and metadata.get("feature_config") != feature_config():
+            raise ValueError(f"Model {version} was trained with a different feature config "
+                             f"than this detector uses")
+        scorer = fast_scorer(model)
+        start = time.perf_counter()
+        if warmup:
+            warm_up(scorer, self.warmup_batches)
+        return {"version": version, "model": model, "scorer": scorer, "metadata": metadata,
+                "warmup_s": time.perf_counter() - start}
+
+    def install(self, prepared):
+        """
+        Switch to a prepared model. One assignment, so every batch is scored by one model or the other
+        """
+        if self._current is not None:
+            self.swaps += 1
+        self._current = prepared
+
+    def swap(self, model, version=None, metadata=None, warmup=True):
+        self.install(self.prepare(model, version, metadata, warmup))
+
+    def prepare_version(self, registry, version=None):
+        """
+        prepare() for a registry version (default the current one)
+        """
+        version = version or registry.current()
+        model, metadata = registry.load(version)
+        return self.prepare(model, version, metadata)
+
+    @property
+    def current(self):
+        """
+        {version, model, scorer, metadata, warmup_s} of the model in use
+        """
+        return self._current
+
+    @property
+    def version(self):
+        return self._current["version"]
+
+    @property
+    def model(self):
+        return self._current["model"]
+
+    @property
+    def scorer(self):
+        return self._current["scorer"]
+
+    @property
+    def classes_(self):
+        return self._current["scorer"].classes_
+
+    def predict_proba(self, x):
+        return self._current["scorer"].predict_proba(x)
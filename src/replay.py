@@ -0,0 +1,202 @@
+"""
+Faster-than-real-time replay of recorded EEG (whole segments or long concatenated recordings).
+- Uses the same windows, features, PROB_THRESHOLD and ALERT_THRESHOLD logic as the live detector,
+    but vectorised end to end: features for every window come from the feature store in one pass,
+    every window across every recording is scored in one model call, and the consecutive-detection
+    state machine is solved with array operations instead of a per-window loop.
+- Returns an alert timeline per recording.
+- replay_file() does the same for one long recording on disk, reading it in chunks (see recording.py).
+"""
+
+import time
+from collections.abc import Mapping
+
+from pathlib import Path
+
+import numpy as np
+
+from feature_store import many_segment_features
+from features import batch_features
+from inference import fast_scorer
+from recording import read_chunks
+from windows import chunked_windows
+
+from variables import (SAMPLING_RATE, WINDOW_SIZE, STEP_SIZE, ALERT_THRESHOLD, PROB_THRESHOLD,
+                       RECORDING_CHUNK_SAMPLES, RECORDING_DTYPE)
+
+
+def alert_windows(predictions, alert_threshold=ALERT_THRESHOLD):
+    """
+    Window indices where AlertState would raise an alert, for a whole array of 0/1 predictions.
+    Within a run of L consecutive seizure windows starting at s, the count reaches the threshold
+    (and resets) at s + T - 1, s + 2T - 1, ... for L // T alerts.
+    """
+    predictions = np.asarray(predictions, dtype=np.int8)
+    if len(predictions) == 0:
+        return np.empty(0, dtype=np.int64)
+
+    edges = np.diff(np.concatenate([[0], predictions, [0]]))
+    starts = np.flatnonzero(edges == 1)
+    ends = np.flatnonzero(edges == -1)
+    n_alerts = (ends - starts) // alert_threshold
+
+    total = n_alerts.sum()
+    if total == 0:
+        return np.empty(0, dtype=np.int64)
+    run_start = np.repeat(starts, n_alerts)
+    # k = 1, 2, ... within each run
+    k = np.arange(total) - np.repeat(np.cumsum(n_alerts) - n_alerts, n_alerts) + 1
+    return run_start + k * alert_threshold - 1
+
+
+def carry_alert_windows(predictions, consecutive=0, alert_threshold=ALERT_THRESHOLD):
+    """
+    alert_windows for one chunk of a longer recording, given the consecutive count carried
+    over from the previous chunk. Returns (alert window indices within the chunk, count at the end)
+    """
+    predictions = np.concatenate([np.ones(consecutive, dtype=np.int8),
+                                  np.asarray(predictions, dtype=np.int8)])
+    alerts = alert_windows(predictions, alert_threshold) - consecutive
+    zeros = np.flatnonzero(predictions == 0)
+    run = len(predictions) - (zeros[-1] + 1 if len(zeros) else 0)
+    return alerts, run % alert_threshold
+
+
+def window_end_times(n_windows, window_size=WINDOW_SIZE, step_size=STEP_SIZE):
+    """
+    Time (s from the start of the recording) at which each window is complete,
+    i.e. when the live detector would have produced its prediction
+    """
+    return (np.arange(n_windows) * step_size + window_size) / SAMPLING_RATE
+
+
+def replay(recordings, model, prob_threshold=PROB_THRESHOLD, alert_threshold=ALERT_THRESHOLD, probs=None):
+    """
+    Replay recordings (segment dicts, or plain 1D signals) through the detector with no sleeping.
+    probs can be passed in to reuse already computed P(seizure) values (one array per recording).
+    Returns a list of dicts, one per recording:
+        {recording_id, n_windows, duration_s, probs, predictions, alert_windows, alert_times_s}
+    """
+    recordings = [r if isinstance(r, Mapping) else {"signal": r, "segment_id": str(i)}
+                  for i, r in enumerate(recordings)]
+
+    if probs is None:
+        feats = [f for f, _ in many_segment_features([r["signal"] for r in recordings])]
+        counts = [len(f) for f in feats]
+        if sum(counts):
+            # Every window from every recording in one model call
+            all_probs = fast_scorer(model).predict_proba(np.concatenate(feats))[:, 1]
+        else:
+            all_probs = np.empty(0)
+        probs = np.split(all_probs, np.cumsum(counts)[:-1])
+
+    results = []
+    for rec, rec_probs in zip(recordings, probs):
+        predictions = (rec_probs >= prob_threshold).astype(np.int8)
+        alerts = alert_windows(predictions, alert_threshold)
+        results.append({
+            "recording_id": rec["segment_id"],
+            "label": rec.get("label"),
+            "n_windows": len(rec_probs),
+            "duration_s": len(rec["signal"]) / SAMPLING_RATE,
+            "probs": rec_probs,
+            "predictions": predictions,
+            "alert_windows": alerts,
+            "alert_times_s": window_end_times(len(rec_probs))[alerts],
+        })
+    return results
+
+
+def replay_file(path, model, dtype=RECORDING_DTYPE, mmap=False, chunk_samples=RECORDING_CHUNK_SAMPLES,
+                prob_threshold=PROB_THRESHOLD, alert_threshold=ALERT_THRESHOLD):
+    """
+    Replay one long recording file (text or raw binary, see recording.py) chunk by chunk.
+    Only the alerts are kept, so memory stays flat however long the recording is.
+    Returns the same kind of dict as replay(), without the per-window probs/predictions.
+    """
+    scorer = fast_scorer(model)
+    n_samples = 0
+
+    def counted(chunks):
+        nonlocal n_samples
+        for chunk in chunks:
+            n_samples += len(chunk)
+            yield chunk
+
+    alerts = []
+    consecutive = 0
+    n_windows = 0
+    for start, winds in chunked_windows(counted(read_chunks(path, dtype, chunk_samples, mmap))):
+        probs = scorer.predict_proba(batch_features(winds))[:, 1]
+        chunk_alerts, consecutive = carry_alert_windows(probs >= prob_threshold, consecutive, alert_threshold)
+        alerts.append(start + chunk_alerts)
+        n_windows = start + len(winds)
+
+    alerts = np.concatenate(alerts) if alerts else np.empty(0, dtype=np.int64)
+    return {
+        "recording_id": Path(path).name,
+        "label": None,
+        "n_windows": n_windows,
+        "duration_s": n_samples / SAMPLING_RATE,
+        "alert_windows": alerts,
+        "alert_times_s": (alerts * STEP_SIZE + WINDOW_SIZE) / SAMPLING_RATE,
+    }
+
+
+def replay_demo(test_segs, model, concat=True):
+    """
+    Replays every test segment, plus (optionally) all of them joined into one long recording,
+    and reports the alert timelines and throughput
+    """
+    print("\n" + "=" * 50)
+    print("Offline Replay")
+    print("=" * 50)
+
+    recordings = list(test_segs)
+    if concat:
+        recordings.append({
+            "signal": np.concatenate([s["signal"] for s in test_segs]),
+            "segment_id": "all-test-concatenated",
+            "label": None,
+        })
+
+    start = time.perf_counter()
+    results = replay(recordings, model)
+    elapsed = time.perf_counter() - start
+
+    signal_seconds = sum(r["duration_s"] for r in results)
+    windows = sum(r["n_windows"] for r in results)
+    print(f"Replayed {len(results)} recordings ({signal_seconds / 3600:.2f} h of signal, {windows} windows) "
+          f"in {elapsed:.2f}s ({signal_seconds / elapsed:.0f}x real time)")
+
+    print_timelines(results)
+    return results
+
+
+def print_timelines(results, show=8):
+    """
+    One line per recording with alerts: how many, and the first few alert times
+    """
+    for r in results:
+        if len(r["alert_times_s"]) == 0:
+            continue
+        times = ", ".join(f"{t:.1f}s" for t in r["alert_times_s"][:show])
+        more = f" (+{len(r['alert_times_s']) - show} more)" if len(r["alert_times_s"]) > show else ""
+        print(f"  {r['recording_id']:>22s}: {len(r['alert_times_s'])} alerts at {times}{more}")
+
+
+def replay_files(paths, model, dtype=None, mmap=False):
+    """
+    replay_file for each path, reporting the alert timelines and throughput
+    """
+    dtype = dtype or RECORDING_DTYPE
+    results = []
+    for path in paths:
+        start = time.perf_counter()
+        result = replay_file(path, model, dtype=dtype, mmap=mmap)
+        elapsed = time.perf_counter() - start
+        print(f"Replayed {path} ({result['duration_s'] / 3600:.2f} h, {result['n_windows']} windows) "
+              f"in {elapsed:.2f}s ({result['duration_s'] / elapsed:.0f}x real time)")
+        results.append(result)
+    print_timelines(results)
+    return results
@@ -0,0 +1,253 @@
+"""
+Search over the window configuration, forest size and alert thresholds, without editing variables.py.
+- Candidates are trained on part of the training segments and scored on the rest (the validation
+    segments, stratified by set). The test set is only used once, to report the winner.
+- Features are computed once per (window size, step size), through the feature store, and shared
+    with a process pool that handles one window configuration per task.
+- Each task fits one forest with the most trees asked for. A forest's first k trees are exactly the
+    forest sklearn fits with n_estimators=k (same random_state), so smaller forests are just slices
+    (see inference.SequentialForest) and are never trained separately.
+- P(seizure) for the validation windows is computed once per forest size; every
+    (prob threshold, alert threshold) pair is then just scored on those probabilities.
+- Candidates are ranked by detection latency against false alarms:
+    cost = mean latency (s) + SEARCH_FALSE_ALARM_COST_S * false alarms per hour,
+    after the ones that detect at least SEARCH_MIN_SENSITIVITY of the seizure segments.
+    The mean latency is over every seizure segment, a missed one counting as its whole length,
+    so a candidate can't buy a lower latency by missing the seizures it would detect late.
+    Candidates no other candidate beats on sensitivity, latency and false alarms at once are marked pareto.
+- Writes a ranked JSON report to SEARCH_OUTPUT_PATH and the winner (refit on every training
+    segment) to SEARCH_MODEL_PATH.
+"""
+
+import json
+import os
+import pickle
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from evaluation import score_recordings
+from feature_store import many_segment_features
+from inference import fast_scorer
+
+from variables import (SEARCH_WINDOWS, SEARCH_N_ESTIMATORS, SEARCH_PROB_THRESHOLDS, SEARCH_ALERT_THRESHOLDS,
+                       SEARCH_VALIDATION_SIZE, SEARCH_MIN_SENSITIVITY, SEARCH_FALSE_ALARM_COST_S,
+                       SEARCH_WORKERS, SEARCH_OUTPUT_PATH, SEARCH_MODEL_PATH, SAMPLING_RATE)
+
+SEARCH_RANDOM_STATE = 2
+
+
+def featurize(segments, window_size, step_size, store=None):
+    """
+    Feature matrix for a window configuration: {X, y, counts, labels, n_samples}
+    """
+    feats = [f for f, _ in many_segment_features([s["signal"] for s in segments], window_size, step_size,
+                                                 store=store)]
+    counts = np.array([len(f) for f in feats])
+    labels = np.array([s["label"] for s in segments])
+    return {
+        "X": np.concatenate(feats),
+        "y": np.repeat(labels, counts),
+        "counts": counts,
+        "labels": labels,
+        "n_samples": np.array([len(s["signal"]) for s in segments]),
+    }
+
+
+# Shared with the worker processes once: {(window size, step size): {"train": ..., "val": ...}}
+_search_data = {}
+
+
+def _init_search_worker(data):
+    _search_data.update(data)
+
+
+def _run_config(config):
+    """
+    Fit the biggest forest for one window configuration and score every candidate that uses it
+    """
+    from classifier import build_pipeline
+
+    window_size, step_size = config
+    train, val = _search_data[config]["train"], _search_data[config]["val"]
+    # What a missed seizure costs in the mean latency: the length of its segment
+    miss_s = float(np.mean(val["n_samples"][val["labels"] == 1])) / SAMPLING_RATE
+
+    start = time.perf_counter()
+    model = build_pipeline(n_jobs=1, n_estimators=max(SEARCH_N_ESTIMATORS), random_state=SEARCH_RANDOM_STATE)
+    model.fit(train["X"], train["y"])
+    fit_s = time.perf_counter() - start
+    scorer = fast_scorer(model)
+
+    rows = []
+    for n_estimators in SEARCH_N_ESTIMATORS:
+        start = time.perf_counter()
+        probs = scorer.predict_proba(val["X"], trees=slice(0, n_estimators))[:, 1]
+        us_per_window = (time.perf_counter() - start) / len(probs) * 1e6
+        probs = np.split(probs, np.cumsum(val["counts"])[:-1])
+
+        for prob_threshold in SEARCH_PROB_THRESHOLDS:
+            for alert_threshold in SEARCH_ALERT_THRESHOLDS:
+                metrics = score_recordings(probs, val["labels"], val["n_samples"], prob_threshold,
+                                           alert_threshold, window_size=window_size, step_size=step_size)
+                rows.append({
+                    "window_size": window_size,
+                    "step_size": step_size,
+                    "n_estimators": n_estimators,
+                    "prob_threshold": prob_threshold,
+                    "alert_threshold": alert_threshold,
+                    # Time from a seizure's start to the earliest possible alert
+                    "alert_after_s": ((alert_threshold - 1) * step_size + window_size) / SAMPLING_RATE,
+                    "miss_latency_s": miss_s,
+                    "score_us_per_window": us_per_window,
+                    "fit_s": fit_s,
+                    "metrics": metrics,
+                })
+    return rows
+
+
+def candidate_cost(row):
+    """
+    Mean latency over every seizure segment (misses count as miss_latency_s) + false alarm cost.
+    Lower is better
+    """
+    event = row["metrics"]["event"]
+    missed = event["seizure_segments"] - event["detected"]
+    total = (event["latency_mean_s"] or 0.0) * event["detected"] + row["miss_latency_s"] * missed
+    latency = total / event["seizure_segments"] if event["seizure_segments"] else 0.0
+    fa_per_hour = event["false_alarms_per_hour"] or 0.0
+    return latency + SEARCH_FALSE_ALARM_COST_S * fa_per_hour
+
+
+def rank_candidates(rows):
+    """
+    Sort candidates best first, adding their cost, rank and whether they're on the pareto front
+    """
+    def point(row):
+        event = row["metrics"]["event"]
+        latency = event["latency_mean_s"] if event["latency_mean_s"] is not None else float("inf")
+        return -(event["sensitivity"] or 0.0), latency, event["false_alarms_per_hour"] or 0.0
+
+    points = np.array([point(r) for r in rows])
+    for row, p in zip(rows, points):
+        row["cost"] = candidate_cost(row)
+        dominated = np.any(np.all(points <= p, axis=1) & np.any(points < p, axis=1))
+        row["pareto"] = not bool(dominated)
+
+    def key(row):
+        sensitivity = row["metrics"]["event"]["sensitivity"] or 0.0
+        # Ties go to the more sensitive, then the cheaper to score
+        return sensitivity < SEARCH_MIN_SENSITIVITY, row["cost"], -sensitivity, row["score_us_per_window"]
+
+    rows.sort(key=key)
+    for i, row in enumerate(rows):
+        row["rank"] = i + 1
+    return rows
+
+
+def _fmt(value, spec=".2f"):
+    return "-" if value is None else format(value, spec)
+
+
+def print_candidates(rows, show=10):
+    print(f"  {'rank':>4s} {'window':>6s} {'step':>5s} {'trees':>5s} {'P':>4s} {'alert':>5s} "
+          f"{'sens':>5s} {'latency':>8s} {'FA/h':>6s} {'cost':>7s}")
+    for r in rows[:show]:
+        e = r["metrics"]["event"]
+        print(f"  {r['rank']:4d} {r['window_size']:6d} {r['step_size']:5d} {r['n_estimators']:5d} "
+              f"{r['prob_threshold']:4.2f} {r['alert_threshold']:5d} {_fmt(e['sensitivity'], '.3f'):>5s} "
+              f"{_fmt(e['latency_mean_s']):>7s}s {_fmt(e['false_alarms_per_hour']):>6s} {r['cost']:7.2f}"
+              f"{'  pareto' if r['pareto'] else ''}")
+
+
+def _json_default(value):
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError(f"Can't serialise {type(value).__name__}")
+
+
+def search(train_segs, test_segs, workers=SEARCH_WORKERS, out_path=SEARCH_OUTPUT_PATH,
+           model_path=SEARCH_MODEL_PATH, store=None):
+    """
+    Run the search, print the best candidates and the winner's test set metrics.
+    Returns the report that is written to out_path.
+    """
+    from sklearn.model_selection import StratifiedShuffleSplit
+    from classifier import build_pipeline
+    from evaluation import print_report
+
+    train_segs, test_segs = list(train_segs), list(test_segs)
+    splitter = StratifiedShuffleSplit(n_splits=1, test_size=SEARCH_VALIDATION_SIZE,
+                                      random_state=SEARCH_RANDOM_STATE)
+    fit_idx, val_idx = next(splitter.split(np.zeros(len(train_segs)), [s["set_name"] for s in train_segs]))
+    fit_segs = [train_segs[i] for i in fit_idx]
+    val_segs = [train_segs[i] for i in val_idx]
+
+    n_candidates = (len(SEARCH_WINDOWS) * len(SEARCH_N_ESTIMATORS) * len(SEARCH_PROB_THRESHOLDS)
+                    * len(SEARCH_ALERT_THRESHOLDS))
+    print(f"\nSearching {n_candidates} candidates "
+          f"({len(fit_segs)} training / {len(val_segs)} validation segments)...")
+    start = time.perf_counter()
+
+    # Every window configuration is featurized once, before any candidate is trained
+    data = {}
+    for window_size, step_size in SEARCH_WINDOWS:
+        data[(window_size, step_size)] = {
+            "train": featurize(fit_segs, window_size, step_size, store),
+            "val": featurize(val_segs, window_size, step_size, store),
+        }
+    featurized = time.perf_counter()
+    print(f"  featurized {len(SEARCH_WINDOWS)} window configurations in {featurized - start:.2f}s")
+
+    workers = min(workers or os.cpu_count() or 1, len(SEARCH_WINDOWS))
+    if workers <= 1:
+        _init_search_worker(data)
+        results = [_run_config(config) for config in SEARCH_WINDOWS]
+    else:
+        with ProcessPoolExecutor(workers, initializer=_init_search_worker, initargs=(data,)) as pool:
+            results = list(pool.map(_run_config, SEARCH_WINDOWS))
+    rows = rank_candidates([row for config_rows in results for row in config_rows])
+    print(f"  trained and scored in {time.perf_counter() - featurized:.2f}s ({workers} workers)")
+    print_candidates(rows)
+
+    # Refit the winner on every training segment, and report it on the test set
+    best = rows[0]
+    window_size, step_size = best["window_size"], best["step_size"]
+    train = featurize(train_segs, window_size, step_size, store)
+    test = featurize(test_segs, window_size, step_size, store)
+    model = build_pipeline(n_estimators=best["n_estimators"], random_state=SEARCH_RANDOM_STATE)
+    model.fit(train["X"], train["y"])
+    probs = fast_scorer(model).predict_proba(test["X"])[:, 1]
+    test_metrics = score_recordings(np.split(probs, np.cumsum(test["counts"])[:-1]), test["labels"],
+                                    test["n_samples"], best["prob_threshold"], best["alert_threshold"],
+                                    window_size=window_size, step_size=step_size)
+
+    print(f"\nWinner: window {window_size}, step {step_size}, {best['n_estimators']} trees, "
+          f"P >= {best['prob_threshold']}, alert after {best['alert_threshold']} windows. On the test set:")
+    print_report(test_metrics, best["alert_threshold"])
+
+    with open(model_path, "wb") as f:
+        pickle.dump(model, f)
+    print(f"Winning model saved to {model_path} "
+          f"(it expects WINDOW_SIZE={window_size}, STEP_SIZE={step_size})")
+
+    report = {
+        "grid": {
+            "windows": [list(w) for w in SEARCH_WINDOWS],
+            "n_estimators": list(SEARCH_N_ESTIMATORS),
+            "prob_thresholds": list(SEARCH_PROB_THRESHOLDS),
+            "alert_thresholds": list(SEARCH_ALERT_THRESHOLDS),
+            "min_sensitivity": SEARCH_MIN_SENSITIVITY,
+            "false_alarm_cost_s": SEARCH_FALSE_ALARM_COST_S,
+        },
+        "winner": {key: best[key] for key in ("window_size", "step_size", "n_estimators",
+                                              "prob_threshold", "alert_threshold")},
+        "winner_model_path": str(model_path),
+        "test_metrics": test_metrics,
+        "candidates": rows,
+    }
+    with open(out_path, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=1, default=_json_default)
+    print(f"Ranked report written to {out_path}")
+    return report
@@ -0,0 +1,146 @@
+"""
+Out-of-core training for datasets too big to hold as one feature matrix.
+- Segments are read as an iterable (nothing needs them all in memory at once) and featurized in batches
+    of LOAD_BATCH_SEGMENTS. Each batch updates the scaler (StandardScaler.partial_fit) and is written to
+    disk as a chunk.
+- The chunks are then dealt out to shards of at most SHARD_WINDOWS windows. Each class is dealt
+    round-robin, so every shard gets the same class balance (and never only one class).
+- One small Random Forest is trained per shard and their trees are merged into a single forest.
+    The result is the same scaler + forest Pipeline that train() produces, so everything downstream
+    (export, streaming, replay) works unchanged.
+- Peak memory is about one batch of features plus one shard, whatever the size of the dataset.
+"""
+
+import math
+import shutil
+from pathlib import Path
+
+import numpy as np
+
+from feature_store import many_segment_features
+from loader import batched
+
+from variables import SHARD_DIR, SHARD_WINDOWS
+
+N_ESTIMATORS = 100
+SHARD_RANDOM_STATE = 2
+
+
+def write_chunks(segments, chunk_dir, store=None):
+    """
+    Featurize segments batch by batch into chunk files, fitting the scaler as it goes.
+    Returns (scaler, chunk paths, windows per class)
+    """
+    from sklearn.preprocessing import StandardScaler
+
+    scaler = StandardScaler()
+    chunks = []
+    class_counts = {}
+    for i, batch in enumerate(batched(segments)):
+        feats = [f for f, _ in many_segment_features([s["signal"] for s in batch], store=store)]
+        x = np.concatenate(feats)
+        y = np.repeat([s["label"] for s in batch], [len(f) for f in feats])
+        if len(x) == 0:
+            continue
+        scaler.partial_fit(x)
+
+        path = Path(chunk_dir) / f"chunk-{i:06d}.npz"
+        np.savez(path, x=x, y=y)
+        chunks.append(path)
+        for label, count in zip(*np.unique(y, return_counts=True)):
+            class_counts[int(label)] = class_counts.get(int(label), 0) + int(count)
+    return scaler, chunks, class_counts
+
+
+def deal_shards(chunks, scaler, n_shards, shard_dir):
+    """
+    Scale each chunk and deal its rows out to n_shards shard files, class by class.
+    Rows are stored scaled and as float32, which is what the trees train on anyway.
+    Returns the shard paths as (x path, y path)
+    """
+    rng = np.random.default_rng(SHARD_RANDOM_STATE)
+    paths = [(Path(shard_dir) / f"shard-{k:04d}-x.bin", Path(shard_dir) / f"shard-{k:04d}-y.bin")
+             for k in range(n_shards)]
+    next_shard = {}  # class -> which shard gets its next row
+    files = [(open(px, "wb"), open(py, "wb")) for px, py in paths]
+    try:
+        for chunk in chunks:
+            with np.load(chunk) as data:
+                x = scaler.transform(data["x"]).astype(np.float32)
+                y = data["y"].astype(np.int64)
+            for label in np.unique(y):
+                rows = rng.permutation(np.flatnonzero(y == label))
+                start = next_shard.get(label, 0)
+                shard_of_row = (start + np.arange(len(rows))) % n_shards
+                next_shard[label] = (start + len(rows)) % n_shards
+                for k in np.unique(shard_of_row):
+                    picked = rows[shard_of_row == k]
+                    x[picked].tofile(files[k][0])
+                    y[picked].tofile(files[k][1])
+    finally:
+        for fx, fy in files:
+            fx.close()
+            fy.close()
+    return paths
+
+
+def merge_forests(forests):
+    """
+    One RandomForestClassifier holding every tree of the given (fitted) forests
+    """
+    merged = forests[0]
+    for forest in forests[1:]:
+        if not np.array_equal(forest.classes_, merged.classes_):
+            raise ValueError("Shard forests were trained on different classes")
+        merged.estimators_ += forest.estimators_
+    merged.n_estimators = len(merged.estimators_)
+    return merged
+
+
+def train_sharded(segments, shard_windows=SHARD_WINDOWS, n_estimators=N_ESTIMATORS,
+                  shard_dir=SHARD_DIR, store=None):
+    """
+    Train the scaler + Random Forest pipeline without holding the whole feature matrix in memory.
+    The n_estimators trees are split as evenly as possible between the shards. Returns the fitted pipeline.
+    """
+    from sklearn.ensemble import RandomForestClassifier
+    from sklearn.pipeline import Pipeline
+
+    shard_dir = Path(shard_dir)
+    if shard_dir.exists():
+        shutil.rmtree(shard_dir)
+    shard_dir.mkdir(parents=True)
+
+    try:
+        print("Featurizing training segments in batches...")
+        scaler, chunks, class_counts = write_chunks(segments, shard_dir, store)
+        total = sum(class_counts.values())
+        if len(class_counts) < 2:
+            raise ValueError("Out-of-core training needs windows of both classes")
+
+        # More shards than the rarest class has windows would leave a shard without that class,
+        # and more shards than trees would leave one without a tree
+        n_shards = min(max(1, math.ceil(total / shard_windows)), min(class_counts.values()), n_estimators)
+        trees = [n_estimators // n_shards + (k < n_estimators % n_shards) for k in range(n_shards)]
+        per_shard = f"{min(trees)}-{max(trees)}" if min(trees) != max(trees) else f"{trees[0]}"
+        print(f"  {total} windows -> {n_shards} shards of ~{total // n_shards} windows, {per_shard} trees each")
+
+        n_features = scaler.n_features_in_
+        shard_paths = deal_shards(chunks, scaler, n_shards, shard_dir)
+        for chunk in chunks:
+            chunk.unlink()
+
+        forests = []
+        for k, (px, py) in enumerate(shard_paths):
+            x = np.memmap(px, dtype=np.float32, mode="r").reshape(-1, n_features)
+            y = np.fromfile(py, dtype=np.int64)
+            forest = RandomForestClassifier(n_estimators=trees[k], n_jobs=-1,
+                                            random_state=SHARD_RANDOM_STATE + k)
+            forest.fit(x, y)
+            forests.append(forest)
+            print(f"  shard {k + 1}/{n_shards}: {len(y)} windows")
+            del x
+    finally:
+        shutil.rmtree(shard_dir, ignore_errors=True)
+
+    return Pipeline([("scaler", scaler), ("clf", merge_forests(forests))])
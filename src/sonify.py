@@ -0,0 +1,248 @@
+"""
+Streaming sonification: turns a recording into a MIDI track that evolves window by window,
+instead of one static melody per segment (see midi.py).
+- Uses the detector's windows (WINDOW_SIZE every STEP_SIZE). Each window's features are mapped to
+    musical parameters with midi.features_to_musical_params, and the melody carries on from where
+    the last window left it (midi.Melody), so it changes as the signal does.
+- Every window gets one hop of playback time. Its tempo decides how many beats that is,
+    so the track plays back in step with the recording.
+- MidiStreamWriter writes a standard MIDI file incrementally: events are encoded as they come,
+    note-offs wait in a heap until their time, and the buffer is flushed to disk every
+    SONIFY_FLUSH_BYTES. The track length in the header is patched when the file is closed.
+    Memory stays flat however long the recording is.
+- With a model, every alert (same logic as replay.py) adds a marker and a crash cymbal to the track.
+"""
+
+import heapq
+import time
+from pathlib import Path
+
+from features import batch_features, FEATURE_NAMES
+from inference import fast_scorer
+from midi import Melody, features_to_musical_params, segment_seed
+from recording import read_chunks
+from replay import carry_alert_windows
+from windows import chunked_windows
+
+from variables import (SAMPLING_RATE, STEP_SIZE, PROB_THRESHOLD, ALERT_THRESHOLD, RECORDING_CHUNK_SAMPLES,
+                       RECORDING_DTYPE, SONIFY_OUTPUT_DIR, SONIFY_FLUSH_BYTES)
+
+TICKS_PER_BEAT = 960
+DRUM_CHANNEL = 9   # General MIDI percussion
+ALERT_DRUM = 49    # Crash cymbal
+
+
+def _vlq(n):
+    """
+    MIDI variable-length quantity
+    """
+    out = [n & 0x7F]
+    n >>= 7
+    while n:
+        out.append((n & 0x7F) | 0x80)
+        n >>= 7
+    return bytes(reversed(out))
+
+
+class MidiStreamWriter:
+    """
+    Single-track (format 0) MIDI file written as it goes.
+    Times are in beats and must not go backwards between calls (note-offs are handled here).
+    """
+
+    def __init__(self, path, name="", flush_bytes=SONIFY_FLUSH_BYTES, ticks_per_beat=TICKS_PER_BEAT):
+        self.path = Path(path)
+        self.flush_bytes = flush_bytes
+        self.ticks_per_beat = ticks_per_beat
+        self.bytes_written = 0
+
+        self._file = open(self.path, "wb")
+        self._file.write(b"MThd" + (6).to_bytes(4, "big") + (0).to_bytes(2, "big")
+                         + (1).to_bytes(2, "big") + ticks_per_beat.to_bytes(2, "big"))
+        self._length_at = self._file.tell() + 4
+        self._file.write(b"MTrk" + bytes(4))  # length is patched in close()
+        self._track_start = self._file.tell()
+
+        self._buf = bytearray()
+        self._tick = 0          # time of the last event written
+        self._offs = []         # heap of (tick, channel, pitch) pending note-offs
+        self._sounding = {}     # (channel, pitch) -> tick of its pending note-off
+        if name:
+            self._meta(0, 0x03, name.encode())
+
+    def _ticks(self, beat):
+        return max(self._tick, int(round(beat * self.ticks_per_beat)))
+
+    def _event(self, tick, data):
+        self._buf += _vlq(tick - self._tick) + data
+        self._tick = tick
+        if len(self._buf) >= self.flush_bytes:
+            self.flush()
+
+    def _meta(self, tick, kind, data):
+        self._event(tick, bytes([0xFF, kind]) + _vlq(len(data)) + data)
+
+    def _release(self, tick):
+        """
+        Write every note-off due at or before tick
+        """
+        while self._offs and self._offs[0][0] <= tick:
+            off, channel, pitch = heapq.heappop(self._offs)
+            if self._sounding.get((channel, pitch)) == off:  # not already cut short by a retrigger
+                del self._sounding[(channel, pitch)]
+                self._event(off, bytes([0x80 | channel, pitch, 0]))
+
+    def tempo(self, beat, bpm):
+        tick = self._ticks(beat)
+        self._release(tick)
+        self._meta(tick, 0x51, int(round(60_000_000 / bpm)).to_bytes(3, "big"))
+
+    def marker(self, beat, text):
+        tick = self._ticks(beat)
+        self._release(tick)
+        self._meta(tick, 0x06, text.encode())
+
+    def note(self, beat, pitch, duration, velocity, channel=0):
+        tick = self._ticks(beat)
+        self._release(tick)
+        if (channel, pitch) in self._sounding:
+            # Same pitch still sounding: end it here, or its note-off would cut this one
+            del self._sounding[(channel, pitch)]
+            self._event(tick, bytes([0x80 | channel, pitch, 0]))
+        off = tick + max(1, int(round(duration * self.ticks_per_beat)))
+        self._event(tick, bytes([0x90 | channel, pitch, velocity]))
+        heapq.heappush(self._offs, (off, channel, pitch))
+        self._sounding[(channel, pitch)] = off
+
+    def flush(self):
+        self._file.write(self._buf)
+        self.bytes_written += len(self._buf)
+        self._buf = bytearray()
+
+    def close(self):
+        """
+        Release any notes still sounding, end the track and patch its length
+        """
+        if self._file.closed:
+            return
+        self._release(float("inf"))
+        self._meta(self._tick, 0x2F, b"")
+        self.flush()
+        length = self._file.tell() - self._track_start
+        self._file.seek(self._length_at)
+        self._file.write(length.to_bytes(4, "big"))
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class WindowSonifier:
+    """
+    Appends each window's notes to a MidiStreamWriter. push() takes the feature rows
+    (FEATURE_NAMES columns) of the next windows, and optionally which of them raised an alert.
+    """
+
+    def __init__(self, writer, seed=123, hop_seconds=STEP_SIZE / SAMPLING_RATE):
+        self.writer = writer
+        self.melody = Melody(seed)
+        self.hop_seconds = hop_seconds
+        self.beat = 0.0         # where this window's playback starts
+        self.next_note = 0.0    # where the melody carries on from
+        self.tempo = None
+        self.windows = 0
+        self.notes = 0
+
+    def push(self, feats, alerts=()):
+        alerts = set(int(a) for a in alerts)
+        for i, row in enumerate(feats):
+            params = features_to_musical_params(dict(zip(FEATURE_NAMES, row.tolist())))
+            if params["tempo"] != self.tempo:
+                self.tempo = params["tempo"]
+                self.writer.tempo(self.beat, self.tempo)
+
+            end = self.beat + self.hop_seconds * self.tempo / 60
+            notes, self.next_note = self.melody.notes(params, max(self.next_note, self.beat), end)
+            for beat, pitch, duration, velocity in notes:
+                self.writer.note(beat, pitch, duration, velocity)
+            self.notes += len(notes)
+
+            if i in alerts:
+                # The alert is raised when the window ends
+                self.writer.marker(end, f"SEIZURE ALERT (window {self.windows})")
+                self.writer.note(end, ALERT_DRUM, 1.0, 127, channel=DRUM_CHANNEL)
+            self.beat = end
+            self.windows += 1
+
+
+def sonify_chunks(chunks, out_path, name="", model=None, seed=None,
+                  prob_threshold=PROB_THRESHOLD, alert_threshold=ALERT_THRESHOLD):
+    """
+    Sonify a recording that arrives as a sequence of sample chunks (see recording.py).
+    With a model, alerts are marked in the track.
+    Returns {path, n_windows, notes, alerts, bytes}
+    """
+    scorer = fast_scorer(model) if model is not None else None
+    consecutive = 0
+    n_alerts = 0
+    seed = segment_seed(name) if seed is None else seed
+
+    with MidiStreamWriter(out_path, name) as writer:
+        sonifier = WindowSonifier(writer, seed)
+        for _, winds in chunked_windows(chunks):
+            feats = batch_features(winds)
+            alerts = ()
+            if scorer is not None:
+                probs = scorer.predict_proba(feats)[:, 1]
+                alerts, consecutive = carry_alert_windows(probs >= prob_threshold, consecutive, alert_threshold)
+                n_alerts += len(alerts)
+            sonifier.push(feats, alerts)
+
+    return {
+        "path": str(out_path),
+        "n_windows": sonifier.windows,
+        "notes": sonifier.notes,
+        "alerts": n_alerts,
+        "bytes": writer.bytes_written,
+    }
+
+
+def sonify_file(path, out_path=None, model=None, dtype=RECORDING_DTYPE, mmap=False,
+                chunk_samples=RECORDING_CHUNK_SAMPLES):
+    """
+    sonify_chunks for one recording file, read chunk by chunk
+    """
+    if out_path is None:
+        out_path = Path(SONIFY_OUTPUT_DIR) / f"{Path(path).stem}.mid"
+    return sonify_chunks(read_chunks(path, dtype, chunk_samples, mmap), out_path, Path(path).name, model)
+
+
+def sonify_demo(test_segs, model=None, paths=None, dtype=None, mmap=False, out_dir=SONIFY_OUTPUT_DIR):
+    """
+    Sonifies each recording file in paths, or (without paths) all the test segments
+    joined into one long recording. Reports the throughput.
+    """
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+
+    results = []
+    for path in paths or [None]:
+        start = time.perf_counter()
+        if path is None:
+            name = "all-test-concatenated"
+            result = sonify_chunks((s["signal"] for s in test_segs), out_dir / f"{name}.mid", name, model)
+        else:
+            name = Path(path).name
+            result = sonify_file(path, out_dir / f"{Path(path).stem}.mid", model,
+                                 dtype=dtype or RECORDING_DTYPE, mmap=mmap)
+        elapsed = time.perf_counter() - start
+
+        seconds = result["n_windows"] * STEP_SIZE / SAMPLING_RATE
+        print(f"Sonified {name} ({seconds / 3600:.2f} h, {result['n_windows']} windows) -> {result['path']}: "
+              f"{result['notes']} notes, {result['alerts']} alerts marked, {result['bytes'] / 1024:.0f} KiB "
+              f"in {elapsed:.2f}s ({seconds / elapsed:.0f}x real time)")
+        results.append(result)
+    return results
@@ -0,0 +1,116 @@
+"""
+Startup/cold-start measurements.
+- startup_bench() runs each part in a fresh interpreter, doing only what that part needs up to
+    its first prediction (or first output for midi), and reports the wall time.
+- import_profile() re-runs main.py under `python -X importtime` and prints which imports took longest.
+"""
+
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+from variables import MODEL_PATH, EXPORT_PATH
+
+SRC_DIR = Path(__file__).resolve().parent
+
+# What each part does before its first prediction, run in a fresh interpreter
+STARTUP_SNIPPETS = {
+    "model": """
+from loader import loader
+from classifier import load_model
+from features import batch_features
+from windows import window_view
+train_segs, test_segs = loader()
+model = load_model()
+model.predict_proba(batch_features(window_view(test_segs[0]["signal"])[:1]))
+""",
+    "stream-demo": """
+from loader import loader
+from classifier import load_model
+from streamer import OnlineDetector
+from variables import WINDOW_SIZE
+train_segs, test_segs = loader()
+detector = OnlineDetector(load_model())
+detector.push(test_segs[0]["signal"][:WINDOW_SIZE])
+""",
+    "stream-demo (exported model)": """
+from loader import loader
+from forest import load_forest
+from streamer import OnlineDetector
+from variables import WINDOW_SIZE
+train_segs, test_segs = loader()
+detector = OnlineDetector(load_forest())
+detector.push(test_segs[0]["signal"][:WINDOW_SIZE])
+""",
+    "midi": """
+from loader import lazy_loader
+from midi import generate_midi_vectors
+train_segs, test_segs = lazy_loader(build=False)
+generate_midi_vectors(train_segs[:1])
+""",
+}
+
+# Parts that need a trained model on disk
+NEEDS = {
+    "model": MODEL_PATH,
+    "stream-demo": MODEL_PATH,
+    "stream-demo (exported model)": EXPORT_PATH,
+}
+
+
+def _run_snippet(code):
+    """
+    Run a snippet in a new interpreter from the src dir. Returns wall time in seconds
+    """
+    start = time.perf_counter()
+    subprocess.run([sys.executable, "-c", code], cwd=SRC_DIR, check=True,
+                   stdout=subprocess.DEVNULL)
+    return time.perf_counter() - start
+
+
+def startup_bench(repeats=3):
+    """
+    Wall time from interpreter start to first prediction for each part (best of `repeats`)
+    """
+    print("\nStartup benchmark (fresh interpreter -> first prediction, best of "
+          f"{repeats}):")
+    results = {}
+    for part, code in STARTUP_SNIPPETS.items():
+        needed = NEEDS.get(part)
+        if needed and not (SRC_DIR / needed).exists():
+            print(f"  {part:30s}: skipped ({needed} not found, run --part model first)")
+            continue
+        results[part] = min(_run_snippet(code) for _ in range(repeats))
+        print(f"  {part:30s}: {results[part]*1000:7.0f} ms")
+    return results
+
+
+def import_profile(argv, top=15):
+    """
+    Re-run main.py with the given arguments under -X importtime, then print the slowest
+    top-level imports
+    """
+    cmd = [sys.executable, "-X", "importtime", str(SRC_DIR / "main.py"), *argv]
+    result = subprocess.run(cmd, cwd=SRC_DIR, stderr=subprocess.PIPE, text=True, check=False)
+
+    imports = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:"):
+            if line.strip():
+                print(line, file=sys.stderr)  # a real error from the run
+            continue
+        fields = line[len("import time:"):].split("|")
+        if len(fields) != 3 or not fields[0].strip().isdigit():
+            continue  # header
+        # Nested imports are indented, only keep the ones main.py's run triggered directly
+        if fields[2].startswith("  "):
+            continue
+        imports.append((int(fields[1]), fields[2].strip()))
+
+    imports.sort(reverse=True)
+    total = sum(us for us, _ in imports)
+    print(f"\nImport time: {total / 1e6:.2f}s total. Slowest top-level imports:")
+    for us, name in imports[:top]:
+        print(f"  {us / 1000:8.1f} ms  {name}")
+    return result.returncode
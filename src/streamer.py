@@ -1,59 +1,296 @@
 """
-- Simulates real-time EEG streaming for a single segment. (Doesn't actually stream data).
-- Processes windows at the real-world rate and prints a seizure alert when 
-    ALERT_THRESHOLD consecutive seizure predictions occur in a row.
+- Online detector that takes samples in chunks of any size, keeps a ring buffer
+    and produces predictions/alerts as soon as each window is complete.
+- Simulates real-time EEG streaming for a single segment by feeding it to the
+    online detector STEP_SIZE samples at a time, at the real-world rate.
+- Prints a seizure alert when ALERT_THRESHOLD consecutive seizure predictions occur in a row.
+- Can record timings, lag against the real-time deadline, alerts etc. in a DetectorMetrics
+    (see metrics.py). Per-window printing can be turned off, as it costs as much as the detection.
+- Can score with a two-stage cascade (see inference.CascadeScorer); cascade_report() checks
+    it against the full model on every test segment.
+- Can be given a registry.ModelHandle instead of a model, so the model can be hot swapped while
+    it runs without losing the ring buffer or the consecutive count.
 - Has a demo function to randomly stream 1 non-ictal and 1 ictal segment from the test set, 
     showing the model's predictions and probabilities for each window, and 
     when it triggers an alert.
 """
 
+import copy
 import time
 import random
 
-from features import features
-from windows import windows
+import numpy as np
 
-from variables import SIMULATED_SPEED, SAMPLING_RATE, STEP_SIZE, ALERT_THRESHOLD
+from features import periodograms, spectral_features, FEATURE_NAMES
+from inference import CascadeScorer
+from registry import ModelHandle
+from windows import window_view
 
-def stream_segment(segment, model):
+from variables import (SIMULATED_SPEED, SAMPLING_RATE, WINDOW_SIZE, STEP_SIZE,
+                       ALERT_THRESHOLD, PROB_THRESHOLD)
+
+
+class OnlineFeatures:
     """
-    Stream a single EEG segment window-by-window, predicting and alerting
+    Ring buffer that accepts samples in chunks of any size and returns the feature vector
+    of every window as soon as it is complete. Produces the same windows as window_view.
+    - Every sample is written twice (at i and i + capacity) so each window is a contiguous slice.
+    - The window's sum of squares (for RMS) is updated with only the samples that enter and
+        leave on each hop, and recomputed exactly every RESYNC_EVERY windows to stop drift.
+    - The PSD uses a precomputed Hann taper and one rfft per Welch segment instead of calling welch().
+        (At WINDOW_SIZE=173 Welch only uses the first 128 samples, which don't overlap
+        enough between hops to reuse, so this is a fixed cost per window.)
     """
-    sleep_time = (STEP_SIZE / SAMPLING_RATE) / SIMULATED_SPEED
 
-    true_label = segment["label"]
-    label_str  = "SEIZURE" if true_label == 1 else "normal"
-    print(f"\n{'='*50}")
-    print(f"Streaming segment: {segment['segment_id']} (set={segment['set_name']}, true={label_str})")
-    print(f"{'='*50}")
+    RESYNC_EVERY = 1000
+
+    def __init__(self, window_size=WINDOW_SIZE, step_size=STEP_SIZE):
+        self.window_size = window_size
+        self.step_size = step_size
+        self.capacity = window_size + step_size
+
+        self._buf = np.zeros(2 * self.capacity)
+        self._written = 0      # total samples pushed so far
+        self._next_start = 0   # absolute index of the next window's first sample
+        self._sumsq = 0.0      # sum of squares of the overlap carried into the next window
+        self._carried = False  # whether _sumsq is valid for the next window
+        self.windows_done = 0
+
+        # Same settings welch() uses in features()
+        self.nperseg = min(window_size, 128)
+        hop = self.nperseg - self.nperseg // 2
+        seg_starts = np.arange(0, window_size - self.nperseg + 1, hop)
+        self._seg_idx = seg_starts[:, None] + np.arange(self.nperseg)
+        self._freqs = np.fft.rfftfreq(self.nperseg, 1.0 / SAMPLING_RATE)
 
-    consecutive = 0
-    winds = list(windows(segment))
+    def push(self, samples):
+        """
+        Add samples to the buffer. Returns an (n_windows, 7) array of features for
+        the windows completed by these samples (may be empty).
+        """
+        samples = np.asarray(samples, dtype=np.float64).ravel()
+        feats = []
+        pos = 0
+        while pos < len(samples):
+            # Samples between windows (only when STEP_SIZE > WINDOW_SIZE) are never needed
+            if self._written < self._next_start:
+                skip = min(self._next_start - self._written, len(samples) - pos)
+                self._written += skip
+                pos += skip
+                continue
 
-    for i, (window, _) in enumerate(winds):
-        feats = features(window).reshape(1, -1)
-        prob       = model.predict_proba(feats)[0][1]   # P(seizure)
-        prediction = int(prob >= 0.6)
+            # Don't overwrite samples the next window still needs
+            room = self.capacity - (self._written - self._next_start)
+            take = min(room, len(samples) - pos)
+            self._write(samples[pos:pos + take])
+            pos += take
 
-        if prediction == 1:
-            consecutive += 1
+            while self._written - self._next_start >= self.window_size:
+                feats.append(self._window_features())
+
+        return np.array(feats).reshape(-1, len(FEATURE_NAMES))
+
+    def _write(self, chunk):
+        """
+        Write a chunk (no longer than capacity) into the ring, plus its mirror copy
+        """
+        while len(chunk):
+            i = self._written % self.capacity
+            k = min(len(chunk), self.capacity - i)
+            self._buf[i:i + k] = chunk[:k]
+            self._buf[i + self.capacity:i + self.capacity + k] = chunk[:k]
+            self._written += k
+            chunk = chunk[k:]
+
+    def _window_features(self):
+        """
+        Features for the window starting at _next_start, then move on to the next window
+        """
+        start = self._next_start % self.capacity
+        window = self._buf[start:start + self.window_size]
+        overlap = self.window_size - self.step_size
+
+        if self._carried and self.windows_done % self.RESYNC_EVERY:
+            entering = window[max(overlap, 0):]
+            sumsq = self._sumsq + np.dot(entering, entering)
         else:
-            consecutive = 0
+            sumsq = np.dot(window, window)
+        rms = np.sqrt(sumsq / self.window_size)
 
-        status = "⚡ SEIZURE" if prediction == 1 else "  normal "
-        print(f"  Window {i+1:3d}/{len(winds)} | {status} | P={prob:.2f} |"
-              f" consecutive={consecutive}")
+        # Welch: detrend, taper, periodogram of each segment, then average
+        psd = periodograms(window[self._seg_idx]).mean(axis=0, keepdims=True)
 
-        if consecutive >= ALERT_THRESHOLD:
-            print(f"\n  🚨  SEIZURE ALERT — {consecutive} consecutive detections  🚨\n")
-            consecutive = 0  # reset counter after alert
+        feats = np.append(spectral_features(self._freqs, psd, self.nperseg)[0], rms)
 
-        time.sleep(sleep_time)
+        # Keep the sum of squares of the part this window shares with the next one
+        if overlap > 0:
+            leaving = window[:self.step_size]
+            self._sumsq = sumsq - np.dot(leaving, leaving)
+            self._carried = True
+        self._next_start += self.step_size
+        self.windows_done += 1
+        return feats
 
-    print(f"\nDone. True label: {label_str}")
 
+class AlertState:
+    """
+    Consecutive-detection state for one stream. Alerts once ALERT_THRESHOLD windows
+    in a row are predicted as seizure, then resets the count.
+    """
 
-def streamer_demo(test_segs, model):
+    def __init__(self, alert_threshold=ALERT_THRESHOLD, prob_threshold=PROB_THRESHOLD):
+        self.alert_threshold = alert_threshold
+        self.prob_threshold = prob_threshold
+        self.consecutive = 0
+
+    def update(self, prob):
+        """
+        Update with P(seizure) for the next window. Returns (prediction, consecutive, alert)
+        """
+        prediction = int(prob >= self.prob_threshold)
+        self.consecutive = self.consecutive + 1 if prediction else 0
+        consecutive = self.consecutive
+        alert = consecutive >= self.alert_threshold
+        if alert:
+            self.consecutive = 0  # reset counter after alert
+        return prediction, consecutive, alert
+
+
+class OnlineDetector:
+    """
+    Real online detector for one channel: push(samples) with chunks of any size,
+    get back one event per completed window.
+    Uses the sequential single-thread scorer, since there are only ever a few windows per push.
+    cascade=True scores with a CascadeScorer instead (a few trees first, the full forest only when needed).
+    model can be a ModelHandle, in which case each push is scored by the handle's model at the time.
+    """
+
+    def __init__(self, model, window_size=WINDOW_SIZE, step_size=STEP_SIZE, metrics=None, stream_id=None,
+                 cascade=False):
+        self.handle = model if isinstance(model, ModelHandle) else ModelHandle(model, warmup=False)
+        self.cascade = cascade
+        self._scorer_for = None
+        self.scorer = None
+        self._update_scorer(self.handle.current)
+        self.features = OnlineFeatures(window_size, step_size)
+        self.state = AlertState()
+        self.metrics = metrics
+        self.stream_id = stream_id
+
+    @property
+    def model(self):
+        return self.handle.model
+
+    def _update_scorer(self, current):
+        """
+        Pick up the handle's current scorer (wrapped in a CascadeScorer if cascade=True)
+        """
+        scorer = current["scorer"]
+        if scorer is not self._scorer_for:
+            self._scorer_for = scorer
+            self.scorer = CascadeScorer(scorer) if self.cascade else scorer
+
+    def push(self, samples, arrived=None):
+        """
+        Returns a list of event dicts: {window, prob, prediction, consecutive, alert, latency, model_version}
+        latency is the seconds from the samples arriving (`arrived`, a time.perf_counter()
+        timestamp, default now) to the window being scored.
+        """
+        if arrived is None:
+            arrived = time.perf_counter()
+        start = time.perf_counter()
+        first = self.features.windows_done
+        feats = self.features.push(samples)
+        if len(feats) == 0:
+            return []
+        featurised = time.perf_counter()
+
+        current = self.handle.current  # read once, so a swap can't land halfway through this push
+        self._update_scorer(current)
+        version = current["version"]
+        if self.cascade:
+            # Whether a run is building depends on the window before, so score one window at a time
+            lookahead = copy.copy(self.state)
+            probs = np.empty(len(feats))
+            for i, row in enumerate(feats):
+                probs[i] = self.scorer.predict_proba(row, building=lookahead.consecutive > 0)[0, 1]
+                lookahead.update(probs[i])
+        else:
+            # All windows completed by this chunk are scored in one call
+            probs = self.scorer.predict_proba(feats)[:, 1]   # P(seizure)
+        done = time.perf_counter()
+        latency = done - arrived
+
+        events = []
+        for i, prob in enumerate(probs):
+            prediction, consecutive, alert = self.state.update(prob)
+            events.append({
+                "window": first + i,
+                "prob": float(prob),
+                "prediction": prediction,
+                "consecutive": consecutive,
+                "alert": alert,
+                "latency": latency,
+                "model_version": version,
+            })
+
+        if self.metrics is not None:
+            feature_s = (featurised - start) / len(probs)
+            inference_s = (done - featurised) / len(probs)
+            for event in events:
+                self.metrics.record(feature_s, inference_s, latency, event["prob"],
+                                    event["prediction"], event["alert"], self.stream_id)
+        return events
+
+
+def stream_segment(segment, model, speed=SIMULATED_SPEED, metrics=None, verbose=True, cascade=False):
+    """
+    Stream a single EEG segment STEP_SIZE samples at a time through an OnlineDetector,
+    predicting and alerting. speed=None streams as fast as possible (no sleeping).
+    Chunks are released on a fixed real-time schedule, so a slow window shows up as lag
+    in the metrics instead of slowing the stream down.
+    verbose=False turns off the per-window lines (alerts are still printed).
+    Returns the list of window events.
+    """
+    sleep_time = (STEP_SIZE / SAMPLING_RATE) / speed if speed else 0.0
+
+    true_label = segment["label"]
+    label_str  = "SEIZURE" if true_label == 1 else "normal"
+    if verbose:
+        print(f"\n{'='*50}")
+        print(f"Streaming segment: {segment['segment_id']} (set={segment['set_name']}, true={label_str})")
+        print(f"{'='*50}")
+
+    signal = segment["signal"]
+    n_windows = len(window_view(signal))
+    detector = OnlineDetector(model, metrics=metrics, stream_id=segment["segment_id"], cascade=cascade)
+    events = []
+
+    started = time.perf_counter()
+    for k, start in enumerate(range(0, len(signal), STEP_SIZE)):
+        due = started + k * sleep_time   # when this chunk "arrives" in real time
+        if sleep_time:
+            time.sleep(max(0.0, due - time.perf_counter()))
+        else:
+            due = None
+        new_events = detector.push(signal[start:start + STEP_SIZE], arrived=due)
+        events.extend(new_events)
+        for event in new_events:
+            if event["alert"]:
+                print(f"\n  🚨  SEIZURE ALERT ({segment['segment_id']}) — "
+                      f"{event['consecutive']} consecutive detections  🚨\n")
+            if not verbose:
+                continue
+            status = "⚡ SEIZURE" if event["prediction"] == 1 else "  normal "
+            print(f"  Window {event['window']+1:3d}/{n_windows} | {status} | P={event['prob']:.2f} |"
+                  f" consecutive={event['consecutive']} | {event['latency']*1000:.1f}ms")
+
+    if verbose:
+        print(f"\nDone. True label: {label_str}")
+    return events
+
+
+def streamer_demo(test_segs, model, metrics=None, verbose=True, cascade=False):
     """
     Streams 1 non-ictal segment and 1 ictal segment from the test set as a demo (randomly chosen)
     """
@@ -65,7 +302,59 @@ def streamer_demo(test_segs, model):
     segments_0  = [s for s in test_segs if s["label"] == 0]
 
     print("\n--- Non-ictal segment example ---")
-    stream_segment(random.choice(segments_0), model)
+    stream_segment(random.choice(segments_0), model, metrics=metrics, verbose=verbose, cascade=cascade)
 
     print("\n--- Ictal segment example ---")
-    stream_segment(random.choice(segments_1), model)
+    stream_segment(random.choice(segments_1), model, metrics=metrics, verbose=verbose, cascade=cascade)
+
+    if metrics is not None:
+        metrics.flush()
+        print(f"\nMetrics: {metrics.summary()}")
+
+
+def cascade_report(test_segs, model):
+    """
+    Streams every test segment (without sleeping) through the full model and through the cascade,
+    then reports how much of the forest the cascade skipped and whether any alert moved
+    """
+    print("\n" + "=" * 50)
+    print("Cascade inference check")
+    print("=" * 50)
+
+    def run(detector, signal):
+        # Pushed one hop at a time, as stream_segment does
+        start = time.perf_counter()
+        events = []
+        for k in range(0, len(signal), STEP_SIZE):
+            events.extend(detector.push(signal[k:k + STEP_SIZE]))
+        return events, time.perf_counter() - start
+
+    full_time = cascade_time = 0.0
+    windows = escalated = evaluated_trees = total_trees = 0
+    moved = []
+    for seg in test_segs:
+        full, seconds = run(OnlineDetector(model), seg["signal"])
+        full_time += seconds
+        detector = OnlineDetector(model, cascade=True)
+        events, seconds = run(detector, seg["signal"])
+        cascade_time += seconds
+
+        scorer = detector.scorer
+        windows += scorer.windows
+        escalated += scorer.escalated
+        total_trees += scorer.windows * scorer.n
+        evaluated_trees += scorer.windows * scorer.k + scorer.escalated * (scorer.n - scorer.k)
+        if [e["window"] for e in full if e["alert"]] != [e["window"] for e in events if e["alert"]]:
+            moved.append(seg["segment_id"])
+
+    print(f"{windows} windows, {escalated} ({escalated / windows:.1%}) went to the full forest")
+    saved = 1.0 - evaluated_trees / total_trees
+    print(f"Tree evaluations saved: {saved:.1%}")
+    print(f"Time per window (features + scoring): full {full_time / windows * 1000:.3f}ms, "
+          f"cascade {cascade_time / windows * 1000:.3f}ms")
+    if moved:
+        print(f"Alert timing CHANGED in {len(moved)} segments: {', '.join(moved)}")
+    else:
+        print(f"Alert timing unchanged in all {len(test_segs)} segments")
+    return {"windows": windows, "escalated": escalated, "compute_saved": saved,
+            "changed_segments": moved}
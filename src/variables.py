@@ -6,11 +6,53 @@ SIMULATED_SPEED = 1.0  # How many times faster than real-time to simulate
 WINDOW_SIZE = 173   # 1 second of EEG data at 173.61 Hz
 STEP_SIZE   = 87    # 50% overlap - window moves 0.5 seconds at a time
 SAMPLING_RATE = 173.61 # Hz
+MULTIRES_WINDOWS = (87, 173, 694) # Window lengths for multi-resolution features: 0.5 s, 1 s and 4 s
+MULTIRES_NPERSEG = 64 # Frame length of the spectrum the multi-resolution features share
+MULTIRES_HOP = 29 # Frame hop (divides STEP_SIZE so decisions line up with frames)
 DATA_DIR = "../data/raw/"
+CACHE_DIR = "../data/cache/" # Binary copy of DATA_DIR so the text files are only parsed once
+CACHE_DTYPE = "float64" # Sample dtype in the cache ("float64", "float32", or "int16" if every sample is a whole number that fits)
+FEATURE_DTYPE = "float64" # Features are computed and stored in this dtype ("float64" or "float32")
+FEATURE_STORE_DIR = "../data/features/" # Cache of computed feature matrices (None to turn off)
+FEATURE_STORE_MAX_BYTES = 256 * 1024 ** 2 # Least recently used entries are evicted above this size
+SHARD_DIR = "../data/shards/" # Scratch space for out-of-core training (emptied afterwards)
+SHARD_WINDOWS = 200_000 # Most windows held in memory at once by out-of-core training
+LOAD_BATCH_SEGMENTS = 64 # Segments loaded/featurized together by the lazy loader and out-of-core training
+RECORDING_CHUNK_SAMPLES = 1_000_000 # Samples read at a time from a long recording (about 1.6 hours)
+RECORDING_DTYPE = "float32" # Sample dtype of raw binary recordings
+LOADER_WORKERS = None # Processes used to parse the raw files (None = all cores, 1 = serial)
 MODEL_PATH = "../model.pkl"
+MODEL_REGISTRY_DIR = "../models/" # Every trained model version with its metadata (see registry.py)
+MODEL_RELOAD_INTERVAL = 1.0 # Seconds between checks for a newly promoted model version
+MULTIRES_MODEL_PATH = "../model_multires.pkl" # Classifier trained on the multi-resolution features
+EXPORT_PATH = "../model.npz" # Model flattened to NumPy arrays for fast loading (see forest.py)
 MIDI_OUTPUT_DIR = "../midi-output" # Where to store generated MIDI files
+MIDI_CATALOGUE_DIR = "../midi-output/catalogue" # Where --part midi-catalogue writes one track per segment
+MIDI_WORKERS = None # Processes rendering the catalogue (None = all cores, 1 = serial)
+SONIFY_OUTPUT_DIR = "../midi-output/stream" # Where --part sonify writes its tracks
+SONIFY_FLUSH_BYTES = 65536 # The sonification writer flushes to disk every this many bytes
+BENCH_OUTPUT_PATH = "../bench.json" # Where --part bench writes its results
+SEARCH_OUTPUT_PATH = "../search.json" # Where --part search writes its ranked candidates
+SEARCH_MODEL_PATH = "../model_search.pkl" # Where --part search saves the winning model
+METRICS_PROMETHEUS_PATH = "../metrics.prom" # Detector metrics in Prometheus text format
+METRICS_JSONL_PATH = "../metrics.jsonl" # Detector metrics as a JSON lines log
 ALERT_THRESHOLD = 6 # Alert after this many windows predicted as seizure (6 is 3 seconds)
+PROB_THRESHOLD = 0.6 # A window is predicted as seizure if P(seizure) is at least this
+CASCADE_TREES = 10 # Trees in the cascade's first stage
+CASCADE_MARGIN = 0.3 # The first stage settles windows with P(seizure) below PROB_THRESHOLD - this
+INFERENCE_BATCH_SIZE = 32 # Windows scored together by the inference engine
+INFERENCE_MAX_LATENCY = 0.05 # Seconds a window can wait for its batch before it's scored anyway
 TEST_SIZE = 0.2  # Proportion of segments to use as test set
+CV_FOLDS = 5 # Folds for --part cv (grouped by segment, stratified by set)
+CV_WORKERS = None # Processes used to run the folds (None = all cores, 1 = serial)
+SEARCH_WINDOWS = ((87, 43), (173, 87), (347, 87), (347, 173)) # (window size, step size) pairs tried by --part search
+SEARCH_N_ESTIMATORS = (25, 50, 100) # Forest sizes tried by --part search
+SEARCH_PROB_THRESHOLDS = (0.4, 0.5, 0.6, 0.7) # PROB_THRESHOLD values tried by --part search
+SEARCH_ALERT_THRESHOLDS = (2, 4, 6, 8) # ALERT_THRESHOLD values (in windows) tried by --part search
+SEARCH_VALIDATION_SIZE = 0.25 # Proportion of the training segments candidates are scored on
+SEARCH_MIN_SENSITIVITY = 0.95 # Candidates that alert on fewer seizure segments than this rank last
+SEARCH_FALSE_ALARM_COST_S = 5.0 # One false alarm per hour is ranked as bad as this many seconds of latency
+SEARCH_WORKERS = None # Processes used by --part search (None = all cores, 1 = serial)
 
 SET_LABELS = {
     "F": 0,  
@@ -1,8 +1,12 @@
 """
 Functions for breaking EEG segments into sliding windows and 
 pairing each window with the segment's label.
+- window_view gives the same windows as one strided 2D view (no copies, no tuples).
 """
 
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
 from variables import WINDOW_SIZE, STEP_SIZE
 
 def get_windows(signal):
@@ -25,3 +29,33 @@ def windows(segment):
     for window in get_windows(segment["signal"]):
         winds.append((window, segment["label"]))
     return winds
+
+
+def window_view(signal, window_size=WINDOW_SIZE, step_size=STEP_SIZE):
+    """
+    Returns a read-only strided view of shape (n_windows, window_size) over a 1D signal.
+    Same windows as get_windows, but no sample data is copied.
+    """
+    signal = np.asarray(signal)
+    if len(signal) < window_size:
+        return signal[:0].reshape(0, window_size)
+    return sliding_window_view(signal, window_size)[::step_size]
+
+
+def chunked_windows(chunks, window_size=WINDOW_SIZE, step_size=STEP_SIZE):
+    """
+    Windows over a signal that arrives as a sequence of 1D chunks (e.g. from recording.py's readers).
+    Yields (start, windows) per chunk: the index of the first window and a (n, window_size) view.
+    The samples after the last complete window are carried into the next chunk, so the windows
+    are exactly the ones window_view would give for the whole signal, and only one chunk
+    (plus less than one window) is ever held at a time.
+    """
+    carry = np.empty(0)
+    start = 0
+    for chunk in chunks:
+        buf = np.concatenate([carry, chunk]) if len(carry) else np.asarray(chunk)
+        winds = window_view(buf, window_size, step_size)
+        if len(winds):
+            yield start, winds
+        start += len(winds)
+        carry = buf[len(winds) * step_size:]